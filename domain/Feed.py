@@ -14,7 +14,13 @@ class Feed:
   lastRefreshed=None  #: the last time this feed was read from the source, as datetime.datetime
   lastChanged=None    #: the last time this feed changed, as datetime.datetime
 
-  items=[]            #: items in this feed, as array of domain.Item objects
+  etag=None           #: the upstream's ETag from the last read, sent back to check for changes, as string
+  lastModified=None   #: the upstream's Last-Modified value from the last read, sent back to check for changes, as string
+  contentHash=None    #: a hash of the upstream's content from the last read, to detect unchanged content, as string
+
+  _items=None
+  _itemLoader=None
+  _dirty=False
 
 
   def __init__(self, id=None, sourceName=None, feedURL=None, updateInterval=None, title=None):
@@ -32,3 +38,65 @@ class Feed:
     self.title=title
     self.items=[]
 
+
+  @property
+  def items(self):
+    """items in this feed, as list of domain.Item objects. Items track their own changes.
+
+    Feeds read without items (e.g. via Storage.getFeedHeaders()) load their items on first access.
+    """
+    if self._items==None:
+      loader=self._itemLoader
+      self._itemLoader=None
+      if loader!=None:
+        self._items=loader()
+      else:
+        self._items=[]
+    return self._items
+
+  @items.setter
+  def items(self, items):
+    self._itemLoader=None
+    self._items=items
+
+  def setItemLoader(self, loader):
+    """Discards the current items, they'll be loaded on the next access to .items instead.
+
+    :param Callable[[],List[Item]] loader: the function returning this feed's items
+    """
+    self._items=None
+    self._itemLoader=loader
+
+  def hasItemsLoaded(self) -> bool:
+    """Checks whether this feed's items are in memory, i.e. accessing .items won't load them.
+
+    :rtype: bool
+    """
+    return self._items!=None
+
+  def __getstate__(self):
+    """Excludes the item loader from copies: copies of feeds without loaded items don't include any items.
+    """
+    state=self.__dict__.copy()
+    state.pop("_itemLoader",None)
+    return state
+
+
+  def __setattr__(self, name, value):
+    if name[0]!="_" and name!="items" and not self._dirty and getattr(self,name,None)!=value:
+      object.__setattr__(self,"_dirty",True)
+    object.__setattr__(self,name,value)
+
+  def isDirty(self) -> bool:
+    """Checks whether this feed's own fields were changed since it was last loaded or stored.
+
+    Changes to items aren't included, check the items themselves for that.
+
+    :rtype: bool
+    """
+    return self._dirty
+
+  def markClean(self):
+    """Resets the dirty flag, storage implementations call this after loading or storing the feed.
+    """
+    object.__setattr__(self,"_dirty",False)
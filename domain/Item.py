@@ -6,9 +6,13 @@ class Item:
 
   guid=None            #: the item's guid, as string
   title=None           #: the item's title, as string
-  description=None     #: the item's description, as string
   itemURL=None         #: the item's URL, as string
   publicationDate=None #: the time this item was published, as datetime.datetime
+  fingerprint=None     #: a hash of the item's upstream values from the last read, to detect unchanged items, as string
+
+  _description=None
+  _descriptionLoader=None
+  _dirty=False
 
   def __init__(self, id=None, feedID=None, title=None):
     """
@@ -19,3 +23,57 @@ class Item:
     self.id=id
     self.feedID=feedID
     self.title=title
+
+  @property
+  def description(self):
+    """the item's description, as string
+
+    Storage implementations may defer reading or decoding descriptions until they're first accessed.
+    """
+    if self._descriptionLoader!=None:
+      loader=self._descriptionLoader
+      self._descriptionLoader=None
+      self._description=loader()
+    return self._description
+
+  @description.setter
+  def description(self, description):
+    self._descriptionLoader=None
+    self._description=description
+
+  def setDescriptionLoader(self, loader):
+    """Discards the current description, it'll be loaded on the next access to .description instead.
+
+    :param Callable[[],Union[str,None]] loader: the function returning this item's description
+    """
+    self._description=None
+    self._descriptionLoader=loader
+
+  def hasDescriptionLoaded(self) -> bool:
+    """Checks whether this item's description is in memory, i.e. accessing .description won't load it.
+
+    :rtype: bool
+    """
+    return self._descriptionLoader==None
+
+  def __setattr__(self, name, value):
+    if name[0]!="_" and not self._dirty:
+      if name=="description" and self._descriptionLoader!=None:
+        changed=True #comparing would load the description just to discard it
+      else:
+        changed=getattr(self,name,None)!=value
+      if changed:
+        object.__setattr__(self,"_dirty",True)
+    object.__setattr__(self,name,value)
+
+  def isDirty(self) -> bool:
+    """Checks whether this item was changed since it was last loaded or stored.
+
+    :rtype: bool
+    """
+    return self._dirty
+
+  def markClean(self):
+    """Resets the dirty flag, storage implementations call this after loading or storing the item.
+    """
+    object.__setattr__(self,"_dirty",False)
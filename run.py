@@ -4,6 +4,17 @@ from storage import *
 
 if __name__=="__main__":
   configuration=parse_cli_arguments()
-  runner=Runner(storage=SQLiteStorage("feeds.sqlite"),configuration=configuration)
+  settings={"wal":configuration.walMode,
+            "read_pool_size":configuration.readPoolSize,
+            "synchronous":configuration.sqliteSynchronous,
+            "mmap_size":configuration.sqliteMmapSize,
+            "cache_size":configuration.sqliteCacheSize}
+  if configuration.shardCount>1:
+    storage=ShardedSQLiteStorage("feeds.%d.sqlite",configuration.shardCount,**settings)
+  else:
+    storage=SQLiteStorage("feeds.sqlite",**settings)
+  if configuration.readCacheSize>0:
+    storage=CachingStorage(storage,configuration.readCacheSize)
+  runner=Runner(storage=storage,configuration=configuration)
   runner.run()
 
@@ -1,8 +1,11 @@
 import argparse
+from datetime import timedelta
 import logging
+import unittest
+from unittest.mock import patch
 
 
-actions=["server"]
+actions=["server","export","import"]
 
 
 class Configuration:
@@ -13,6 +16,25 @@ class Configuration:
   runTime=60             #: the application lifetime, in seconds (as int or float)
   logLevel=logging.INFO  #: the default log level
   serverPort=58000       #: the TCP port to listen on
+  pageSize=100           #: the default number of items per served feed
+  fetchWorkers=1         #: the maximum number of feeds to refresh at once, 1 to refresh feeds one after another
+  fetchWorkersPerHost=2  #: the maximum number of feeds of the same upstream host to refresh at once
+  parseWorkers=0         #: the number of processes to parse downloaded feeds in, 0 to parse them in the refreshing threads
+
+  shardCount=1           #: the number of SQLite database files to partition feeds across
+  walMode=False          #: whether to use SQLite's WAL mode with separate reader and writer connections
+  readPoolSize=4         #: the maximum number of SQLite reader connections in WAL mode
+  sqliteSynchronous=None #: SQLite's "synchronous" setting (OFF, NORMAL, FULL or EXTRA), None for SQLite's default
+  sqliteMmapSize=None    #: the number of bytes SQLite may memory-map per connection, None for SQLite's default
+  sqliteCacheSize=None   #: SQLite's page cache size per connection, negative values are in KiB, None for SQLite's default
+  readCacheSize=0        #: the maximum number of feed headers and item lists to cache in memory, 0 to disable caching
+
+  retentionMaxItems=None  #: the maximum number of items to keep per feed, None for no limit
+  retentionMaxAge=None    #: the maximum age of items to keep, as datetime.timedelta, None for no limit
+  retentionArchive=False  #: whether to archive expired items instead of deleting them
+  compactionInterval=3600 #: the time between compaction runs, in seconds
+
+  archiveFile="feeds.ndjson.gz" #: the file to export to or import from, compressed with gzip if the name ends with ".gz"
 
 
 def parse_cli_arguments() -> Configuration:
@@ -25,19 +47,60 @@ def parse_cli_arguments() -> Configuration:
   parser=argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
   log_levels=["critical","error","warning","info","debug","off"]
   parser.add_argument("--port",dest="serverPort",type=int,default=Configuration.serverPort,help="the server port to listen on")
+  parser.add_argument("--page-size",dest="pageSize",type=_parsePageSize,default=Configuration.pageSize,help="the default number of items per served feed")
   parser.add_argument("--log-level",dest="logLevel",choices=log_levels,default="info",help="the default log level")
   parser.add_argument("--runtime",dest="runTime",type=int,default=Configuration.runTime,help="the application lifetime in seconds, 0 to keep running indefinitely")
+  parser.add_argument("--fetch-workers",dest="fetchWorkers",type=int,default=Configuration.fetchWorkers,help="the maximum number of feeds to refresh at once")
+  parser.add_argument("--fetch-workers-per-host",dest="fetchWorkersPerHost",type=int,default=Configuration.fetchWorkersPerHost,help="the maximum number of feeds of the same upstream host to refresh at once")
+  parser.add_argument("--parse-workers",dest="parseWorkers",type=int,default=Configuration.parseWorkers,help="the number of processes to parse downloaded feeds in, 0 to parse them in the refreshing threads")
+  parser.add_argument("--shards",dest="shardCount",type=int,default=Configuration.shardCount,help="the number of SQLite database files to partition feeds across, feeds in different files are written in parallel")
+  parser.add_argument("--wal",dest="walMode",action="store_true",help="use SQLite's WAL mode, HTTP reads won't wait for feed updates")
+  parser.add_argument("--read-pool-size",dest="readPoolSize",type=int,default=Configuration.readPoolSize,help="the maximum number of SQLite reader connections in WAL mode")
+  parser.add_argument("--sqlite-synchronous",dest="sqliteSynchronous",choices=["off","normal","full","extra"],help="SQLite's synchronous setting")
+  parser.add_argument("--sqlite-mmap-size",dest="sqliteMmapSize",type=int,help="the number of bytes SQLite may memory-map per connection")
+  parser.add_argument("--sqlite-cache-size",dest="sqliteCacheSize",type=int,help="SQLite's page cache size per connection, negative values are in KiB")
+  parser.add_argument("--read-cache-size",dest="readCacheSize",type=int,default=Configuration.readCacheSize,help="the maximum number of feed headers and item lists to cache in memory, 0 to disable")
+  parser.add_argument("--retention-max-items",dest="retentionMaxItems",type=int,help="the maximum number of items to keep per feed")
+  parser.add_argument("--retention-max-age",dest="retentionMaxAge",type=int,help="the maximum age of items to keep, in days")
+  parser.add_argument("--retention-archive",dest="retentionArchive",action="store_true",help="archive expired items instead of deleting them")
+  parser.add_argument("--compaction-interval",dest="compactionInterval",type=int,default=Configuration.compactionInterval,help="the time between compaction runs, in seconds")
+  parser.add_argument("--file",dest="archiveFile",default=Configuration.archiveFile,help="the file to export to or import from, gzip-compressed if the name ends with .gz")
   parser.add_argument("action",metavar="action",default=actions[0],choices=actions,nargs="?",help="the application action to perform")
   args=parser.parse_args()
 
   config=Configuration()
+  config.action=args.action
+  config.archiveFile=args.archiveFile
   config.serverPort=args.serverPort
+  config.pageSize=args.pageSize
   config.logLevel=_parseLogLevel(args.logLevel)
   config.runTime=args.runTime
+  config.fetchWorkers=args.fetchWorkers
+  config.fetchWorkersPerHost=args.fetchWorkersPerHost
+  config.parseWorkers=args.parseWorkers
+  config.shardCount=args.shardCount
+  config.walMode=args.walMode
+  config.readPoolSize=args.readPoolSize
+  config.sqliteSynchronous=args.sqliteSynchronous
+  config.sqliteMmapSize=args.sqliteMmapSize
+  config.sqliteCacheSize=args.sqliteCacheSize
+  config.readCacheSize=args.readCacheSize
+  config.retentionMaxItems=args.retentionMaxItems
+  if args.retentionMaxAge!=None:
+    config.retentionMaxAge=timedelta(days=args.retentionMaxAge)
+  config.retentionArchive=args.retentionArchive
+  config.compactionInterval=args.compactionInterval
 
   return config
 
 
+def _parsePageSize(raw:str) -> int:
+  page_size=int(raw)
+  if page_size<1:
+    raise argparse.ArgumentTypeError("page size must be at least 1, got %d"%page_size)
+  return page_size
+
+
 def _parseLogLevel(raw:str):
   map={"critical":logging.CRITICAL,
        "error":   logging.ERROR,
@@ -50,3 +113,16 @@ def _parseLogLevel(raw:str):
     raise ValueError("invalid log level '%s'"%raw)
   return map[key]
 
+
+class TestConfiguration(unittest.TestCase):
+  """Tests for parsing command-line arguments.
+  """
+
+  def testPageSize(self):
+    """Tests whether page sizes below 1 are refused, since storages treat them as unlimited.
+    """
+    with patch("sys.argv",["run.py","--page-size","20"]):
+      self.assertEqual(20,parse_cli_arguments().pageSize)
+    for raw in ["0","-1","x"]:
+      with patch("sys.argv",["run.py","--page-size",raw]), patch("sys.stderr"), self.assertRaises(SystemExit,msg=raw):
+        parse_cli_arguments()
@@ -1,5 +1,7 @@
 from datetime import datetime, timedelta
+import gzip
 import logging
+import os
 from time import sleep
 from uuid import uuid4
 import unittest
@@ -10,6 +12,7 @@ from runner import *
 from scheduler import *
 from server import *
 from source import *
+from storage import *
 from debug import *
 import config
 
@@ -28,6 +31,7 @@ class Runner:
   _runTime=None
   _logLevel=None
   _configuration=None
+  _policy=None
 
 
   def __init__(self, storage:Storage, sources:Union[List[Source],None]=None, feedSpecs=None, configuration:Union[Configuration,None]=None):
@@ -39,35 +43,50 @@ class Runner:
     """
     self._storage=storage
 
+    if configuration==None:
+      configuration=Configuration()
+    self._configuration=configuration
+    self._policy=RetentionPolicy(max_items=configuration.retentionMaxItems,
+                                 max_age=configuration.retentionMaxAge,
+                                 archive=configuration.retentionArchive)
+
     if sources!=None:
       self._sources=sources
     else:
-      self._sources=[DummySource(),FeedSource()]
+      self._sources=[DummySource(),FeedSource(stage=ParseStage(configuration.parseWorkers),policy=self._policy)]
 
     if feedSpecs!=None:
       self._feedSpecs=feedSpecs
     else:
       self._feedSpecs=config.sources
 
-    if configuration==None:
-      configuration=Configuration()
-    self._configuration=configuration
     self._runTime=configuration.runTime
     self._logLevel=configuration.logLevel
 
 
   def run(self):
-    """Starts the application.
+    """Starts the application, or performs the configured export or import.
     """
     logger.register_handler(self._logLevel)
+    if self._configuration.action=="export":
+      return self.exportFeeds(self._configuration.archiveFile)
+    if self._configuration.action=="import":
+      return self.importFeeds(self._configuration.archiveFile)
 
     self._compileFeeds()
 
-    scheduler=StandaloneScheduler(self._storage,self._sources)
+    scheduler=StandaloneScheduler(self._storage,self._sources,
+                                  workers=self._configuration.fetchWorkers,
+                                  workers_per_host=self._configuration.fetchWorkersPerHost)
     scheduler.start()
 
+    compactor=Compactor(self._storage,self._policy)
+    compactor.interval=self._configuration.compactionInterval
+    compactor.start()
+
     server=FeedServer(self._storage)
     server.port=self._configuration.serverPort
+    server.pageSize=self._configuration.pageSize
     server.start()
 
     try:
@@ -82,38 +101,62 @@ class Runner:
     log.info("exiting application")
 
 
+  def exportFeeds(self, filename:str):
+    """Writes all stored feeds and items to a newline-delimited JSON file, see NDJSONExporter.
+
+    :param str filename: the file to write, it's compressed with gzip if the name ends with ".gz"
+    """
+    with self._openArchive(filename,"w") as stream:
+      feed_count,item_count=NDJSONExporter(self._storage).export(stream)
+    log.info("exported %d feeds with %d items to %s",feed_count,item_count,filename)
+
+  def importFeeds(self, filename:str):
+    """Stores all feeds and items from a newline-delimited JSON file, see NDJSONImporter.
+
+    :param str filename: the file to read, it's decompressed with gzip if the name ends with ".gz"
+    :raises ValueError: if the file is invalid, or if imported feeds exist already
+    """
+    with self._openArchive(filename,"r") as stream:
+      feed_count,item_count=NDJSONImporter(self._storage).load(stream)
+    log.info("imported %d feeds with %d items from %s",feed_count,item_count,filename)
+
+  def _openArchive(self, filename:str, mode:str):
+    if filename.endswith(".gz"):
+      return gzip.open(filename,mode+"t",encoding="utf-8")
+    return open(filename,mode,encoding="utf-8")
+
+
   def _compileFeeds(self):
-    stored_feeds=self._storage.getFeeds()
+    stored_feeds=self._storage.getFeedHeaders()
     handled_specs=[]
-    self._storage.acquireWriteLock()
-    for feed in stored_feeds:
-      spec=(feed.sourceName,feed.feedURL)
-      active=spec in self._feedSpecs
-      handled_specs.append(spec)
-      logstr="feed type=%s, url=%s:"%spec
-      if active:
-        if feed.updateInterval!=None:
-          log.debug("%s keeping active",logstr)
-          continue
+    with self._storage.writeTransaction():
+      for feed in stored_feeds:
+        spec=(feed.sourceName,feed.feedURL)
+        active=spec in self._feedSpecs
+        handled_specs.append(spec)
+        logstr="feed type=%s, url=%s:"%spec
+        if active:
+          if feed.updateInterval!=None:
+            log.debug("%s keeping active",logstr)
+            continue
+          else:
+            log.debug("%s reactivating",logstr)
+            feed.updateInterval=timedelta(minutes=60)
         else:
-          log.debug("%s reactivating",logstr)
-          feed.updateInterval=timedelta(minutes=60)
-      else:
-        if feed.updateInterval!=None:
-          log.debug("%s deactivating",logstr)
-          feed.updateInterval=None
-        else:
-          log.debug("%s keeping inactive",logstr)
-          continue
-      self._storage.putFeed(feed)
-
-    unhandled_specs=set(self._feedSpecs)-set(handled_specs)
-    for type,url in unhandled_specs:
-      log.info("got new source: type %s, url %s",type,url)
-      feed=Feed(sourceName=type,feedURL=url)
-      feed.updateInterval=timedelta(minutes=5)
-      self._storage.putFeed(feed)
-    self._storage.releaseWriteLock()
+          if feed.updateInterval!=None:
+            log.debug("%s deactivating",logstr)
+            feed.updateInterval=None
+          else:
+            log.debug("%s keeping inactive",logstr)
+            continue
+        self._storage.putFeed(feed)
+
+      unhandled_specs=set(self._feedSpecs)-set(handled_specs)
+      for type,url in unhandled_specs:
+        log.info("got new source: type %s, url %s",type,url)
+        feed=Feed(sourceName=type,feedURL=url)
+        feed.updateInterval=timedelta(minutes=5)
+        self._storage.putFeed(feed)
 
 
 class TestRunner(unittest.TestCase):
@@ -152,3 +195,26 @@ class TestRunner(unittest.TestCase):
     self.assertEqual(type,feed.sourceName)
     self.assertEqual(url,feed.feedURL)
     self.assertEqual(active,feed.updateInterval!=None)
+
+  def testExportImport(self):
+    """Checks whether feeds are copied between storages through compressed and uncompressed files.
+    """
+    source=SQLiteStorage(":memory:")
+    feed=Feed(id=4,sourceName="dummy",feedURL="f4",title="feed")
+    feed.items=[Item(title="item 1"),Item(title="item 2")]
+    source.acquireWriteLock()
+    source.putFeed(feed)
+    source.releaseWriteLock()
+
+    for filename in ["test.runner.Runner.ndjson","test.runner.Runner.ndjson.gz"]:
+      try:
+        Runner(source,[],[]).exportFeeds(filename)
+        target=InMemoryStorage()
+        Runner(target,[],[]).importFeeds(filename)
+        with open(filename,"rb") as f:
+          self.assertEqual(filename.endswith(".gz"),f.read(2)==b"\x1f\x8b","file should be compressed if named .gz")
+      finally:
+        if os.path.isfile(filename):
+          os.remove(filename)
+      self.assertEqual("feed",target.getFeedByID(4).title)
+      self.assertEqual(["item 1","item 2"],[item.title for item in target.getItemsByFeedID(4)])
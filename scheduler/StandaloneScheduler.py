@@ -1,7 +1,12 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
-from time import sleep
+from threading import Lock
+from time import sleep, time
+from typing import List
 import unittest
 from unittest.mock import patch
+from urllib.parse import urlsplit
 
 from domain import *
 import logger
@@ -19,8 +24,31 @@ class StandaloneScheduler(Scheduler):
   """A basic scheduler implementation.
 
   This scheduler reads each feed's last update time and waits until the feed's update interval has passed, then updates the feed from the appropriate source.
+
+  With more than one worker, due feeds are refreshed in parallel by a thread pool. At most workersPerHost feeds of the same
+  upstream host are refreshed at once, so slow or rate-limiting hosts only delay their own feeds. Refreshed feeds are stored by
+  a GroupCommitWriter, sharing write transactions between workers.
   """
 
+  workers=1        #: the maximum number of feeds to refresh at once, 1 to refresh feeds one after another
+  workersPerHost=2 #: the maximum number of feeds of the same upstream host to refresh at once
+
+  _pool=None
+  _writer=None
+
+  def __init__(self, storage:Storage, sources:List[Source], workers:int=1, workers_per_host:int=2):
+    """
+    :param Storage storage: where to read/write feed data from/to
+    :param List[Source] sources: the sources to use for feed updates
+    :param int workers: optional: the maximum number of feeds to refresh at once
+    :param int workers_per_host: optional: the maximum number of feeds of the same upstream host to refresh at once
+    """
+    super().__init__(storage,sources)
+    if workers<1 or workers_per_host<1:
+      raise ValueError("worker counts must be at least 1")
+    self.workers=workers
+    self.workersPerHost=workers_per_host
+
   def run(self, iteration_limit:int=0) -> None:
     """Starts the scheduler.
 
@@ -28,7 +56,13 @@ class StandaloneScheduler(Scheduler):
 
     :param int iteration_limit: how many iterations to perform, <=0 for no limit.
     """
+    self._startWorkers()
+    try:
+      self._runIterations(iteration_limit)
+    finally:
+      self._stopWorkers()
 
+  def _runIterations(self, iteration_limit:int):
     i=0
     while True:
       log.debug("starting scheduler iteration...")
@@ -43,11 +77,26 @@ class StandaloneScheduler(Scheduler):
       sleep(wait)
     log.info("reached iteration limit, exiting scheduler")
 
+  def _startWorkers(self):
+    if self.workers<2:
+      return
+    self._pool=ThreadPoolExecutor(self.workers,thread_name_prefix="FeedWorker")
+    self._writer=GroupCommitWriter(self._storage)
+    self._writer.start()
+
+  def _stopWorkers(self):
+    if self._pool==None:
+      return
+    self._pool.shutdown()
+    self._writer.stop()
+    self._pool=None
+    self._writer=None
+
   def _checkAll(self) -> float:
-    feeds=self._storage.getFeeds()
     now=datetime.now()
     deltas=[]
-    for feed in feeds:
+    due=[]
+    for feed in self._storage.iterFeeds():
       if feed.updateInterval==None:
         continue
       if feed.lastRefreshed!=None:
@@ -58,9 +107,14 @@ class StandaloneScheduler(Scheduler):
 #      print("feed %d, lastRefreshed=%s, interval=%s => next update delta: %5.2f"%(feed.id,feed.lastRefreshed,feed.updateInterval,next_update_delta))
       if next_update_delta>0:
         deltas.append(next_update_delta)
+      elif self._pool!=None:
+        due.append(feed)
       else:
-        self._updateFeed(feed)
+        self._tryUpdateFeed(feed)
         deltas.append(feed.updateInterval.total_seconds())
+    if len(due)>0:
+      self._updateFeedsInParallel(due)
+      deltas.extend([feed.updateInterval.total_seconds() for feed in due if feed.updateInterval!=None])
     if len(deltas)<1:
       log.warn("no more feeds to update, exiting scheduler")
       return None
@@ -68,11 +122,51 @@ class StandaloneScheduler(Scheduler):
 #    print("deltas: %s => waiting %s"%(deltas,wait))
     return wait
 
+  def _updateFeedsInParallel(self, feeds:List[Feed]):
+    """refreshes feeds in the worker pool, returning once all of them are stored.
+
+    Each host's feeds are queued separately and worked off by up to workersPerHost tasks, so workers never wait for a host.
+    """
+    queues={}
+    for feed in feeds:
+      queues.setdefault(self._getHost(feed),deque()).append(feed)
+    tasks=[]
+    for queue in queues.values():
+      for tc in range(0,min(self.workersPerHost,len(queue))):
+        tasks.append(self._pool.submit(self._workOff,queue))
+    wait(tasks)
+
+  def _getHost(self, feed:Feed) -> str:
+    """returns the feed URL's host name, URLs without host (e.g. dummy feeds) count as separate hosts
+    """
+    return urlsplit(feed.feedURL or "").hostname or feed.feedURL
+
+  def _workOff(self, queue:deque):
+    while True:
+      try:
+        feed=queue.popleft()
+      except IndexError:
+        return
+      self._tryUpdateFeed(feed)
+
+  def _tryUpdateFeed(self, feed:Feed):
+    """refreshes a feed, logging failures instead of raising them so other feeds are still refreshed
+    """
+    try:
+      self._updateFeed(feed)
+    except Exception:
+      log.exception("refreshing feed %s failed",feed.id)
+
   def _updateFeed(self, feed:Feed):
-    self._sources[feed.sourceName].updateFeed(feed)
-    self._storage.acquireWriteLock()
-    self._storage.putFeed(feed)
-    self._storage.releaseWriteLock()
+    changed=self._sources[feed.sourceName].updateFeed(feed)
+    if changed and self._writer!=None:
+      self._writer.putFeed(feed)
+      return
+    with self._storage.writeTransaction(feed.id):
+      if changed:
+        self._storage.putFeed(feed)
+      else:
+        self._storage.markRefreshed(feed.id,feed.lastRefreshed)
 
 
 class TestStandaloneScheduler(unittest.TestCase):
@@ -101,6 +195,92 @@ class TestStandaloneScheduler(unittest.TestCase):
     self._assertItemIDs([1,3],actuals[0])
     self._assertItemIDs([2],  actuals[1])
 
+  def testUnchangedFeeds(self):
+    """Tests whether feeds reported unchanged by their source only get their refresh time stored.
+    """
+    storage=InMemoryStorage()
+    source=DummySource()
+    self._storeFeed(source,storage,1,datetime(2018,10,1),60)
+    events=[]
+    storage.subscribe(events.append)
+    refreshed=datetime.now()
+
+    def unchanged(feed):
+      feed.title="not stored"
+      feed.lastRefreshed=refreshed
+      return False
+    with patch.object(DummySource,"updateFeed",side_effect=unchanged):
+      StandaloneScheduler(storage,[source])._checkAll()
+
+    stored=storage.getFeedHeaderByID(1)
+    self.assertEqual(refreshed,stored.lastRefreshed,"refresh time should have been stored")
+    self.assertEqual("feed 1 title",stored.title,"unchanged feed shouldn't have been stored")
+    self.assertEqual([],events)
+
+  def testParallelUpdates(self):
+    """Tests whether due feeds are refreshed in parallel within the global and per-host limits, and failures are isolated.
+    """
+    storage=InMemoryStorage()
+    with storage.writeTransaction():
+      for feed_id in range(1,9):
+        storage.putFeed(Feed(id=feed_id,sourceName="slow",feedURL="http://host%d/%d"%(feed_id%3,feed_id),
+                             updateInterval=timedelta(hours=1)))
+
+    class SlowSource(Source):
+      name="slow"
+      lock=Lock()
+      running={}
+      peaks={}
+      def updateFeed(self, feed):
+        host=feed.feedURL.split("/")[2]
+        with self.lock:
+          self.running[host]=self.running.get(host,0)+1
+          self.running["all"]=self.running.get("all",0)+1
+          for key in [host,"all"]:
+            self.peaks[key]=max(self.peaks.get(key,0),self.running[key])
+        sleep(0.1)
+        with self.lock:
+          self.running[host]-=1
+          self.running["all"]-=1
+        if feed.id==5:
+          raise RuntimeError("upstream failure")
+        feed.title="refreshed"
+        feed.lastRefreshed=datetime.now()
+        return True
+
+    source=SlowSource()
+    scheduler=StandaloneScheduler(storage,[source],workers=4,workers_per_host=2)
+    start=time()
+    scheduler.run(1)
+    duration=time()-start
+
+    titles=[feed.title for feed in storage.getFeedHeaders()]
+    self.assertEqual(["refreshed"]*4+[None]+["refreshed"]*3,titles,"failing feed shouldn't have stopped the others")
+    self.assertEqual(4,source.peaks["all"],"should have used all workers")
+    self.assertEqual(2,max([source.peaks["host%d"%host] for host in range(0,3)]),"should have respected the per-host limit")
+    self.assertLess(duration,0.6,"feeds should have been refreshed in parallel")
+
+  def testSerialFailures(self):
+    """Tests whether a failing feed doesn't stop the scheduler from refreshing the others without a worker pool.
+    """
+    storage=InMemoryStorage()
+    source=DummySource()
+    for feed_id in range(1,4):
+      self._storeFeed(source,storage,feed_id,datetime(2018,10,1),60)
+
+    def update(feed):
+      if feed.id==2:
+        raise IOError("upstream failure")
+      feed.title="refreshed"
+      feed.lastRefreshed=datetime.now()
+      return True
+    with patch.object(DummySource,"updateFeed",side_effect=update):
+      wait=StandaloneScheduler(storage,[source])._checkAll()
+
+    titles=[feed.title for feed in storage.getFeedHeaders()]
+    self.assertEqual(["refreshed","feed 2 title","refreshed"],titles,"failing feed shouldn't have stopped the others")
+    self.assertEqual(60,wait,"failing feed should have been scheduled again")
+
   def _storeFeed(self,source,storage,id,last_refreshed,update_interval):
     feed=Feed(id=id)
     source.updateFeed(feed,skip_items=True)
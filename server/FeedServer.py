@@ -1,8 +1,12 @@
+from datetime import datetime, timezone
 import http.server
 import io
 import socketserver
 import threading
+from typing import Iterator
+from urllib.parse import parse_qs, urlsplit
 
+from domain import *
 import logger
 from server import *
 from storage import *
@@ -15,27 +19,70 @@ class FeedHandler(http.server.BaseHTTPRequestHandler):
   """HTTP request handler implementation serving stored feeds as RSS 2.0 XML.
   """
 
+  wbufsize=65536 #: the response buffer size in bytes, streamed feeds are sent in chunks of this size
+
   def log_message(self, format, *args):
     """logging callback, silently discards messages.
     """
     pass
 
   def do_GET(self):
-    """callback for HTTP GET requests, serves feeds and denies everything else.
+    """callback for HTTP GET requests, serves feeds and search results and denies everything else.
+
+    Feeds contain the most recent items, up to the server's page size. The query parameters "limit", "before" and "since"
+    select other pages or time windows, times are given as Unix timestamps.
+
+    Each feed is read from a storage snapshot, so its header and items are always consistent. Feeds are streamed to the
+    client while being read, unless the storage's snapshots block writers: then the page is read into memory first and
+    sent after the snapshot ended, so slow clients don't hold up feed updates.
+
+    /search?q=<words> returns the items containing all given words as a feed, most relevant first. The "limit" parameter
+    works like for feeds.
     """
-    if not self.path.startswith("/feed/"):
-      return self._send404("only /feed/<id> is implemented")
+    url=urlsplit(self.path)
+    if url.path=="/search":
+      return self._sendSearchResults(url.query)
+    if not url.path.startswith("/feed/"):
+      return self._send404("only /feed/<id> and /search are implemented")
 
-    id_str=self.path[6:].split("/")[0]
+    id_str=url.path[6:].split("/")[0]
     if not id_str.isdecimal():
       return self._send400("need to pass id in URL")
 
     id=int(id_str)
 
-    feed=self.server.storage.getFeedByID(id)
-    if feed==None:
-      return self._send404("feed with ID %d not found"%id)
-
+    try:
+      limit,before,since=self._parsePageParameters(url.query)
+    except ValueError as e:
+      return self._send400(str(e))
+
+    storage=self.server.storage
+    stream=not storage.snapshotBlocksWriters()
+    with storage.snapshot():
+      feed=storage.getFeedHeaderByID(id)
+      if feed==None:
+        return self._send404("feed with ID %d not found"%id)
+      items=storage.iterItems(id,limit=limit,before=before,since=since)
+      if stream:
+        return self._streamFeed(feed,items)
+      feed.items=list(items) #bounded by the page size
+    self._sendFeed(feed)
+
+  def _sendSearchResults(self, query:str):
+    params=parse_qs(query)
+    words=params.get("q",[""])[0].strip()
+    if words=="":
+      return self._send400("need to pass search words in parameter q")
+    try:
+      limit=self._parseLimit(params)
+    except ValueError as e:
+      return self._send400(str(e))
+
+    feed=Feed(title="Search results for: %s"%words)
+    feed.items=self.server.storage.searchItems(words,limit)
+    self._sendFeed(feed)
+
+  def _sendFeed(self, feed:Feed):
     xml=self.server.renderer.renderFeed(feed)
     body=xml.encode()
 
@@ -45,6 +92,44 @@ class FeedHandler(http.server.BaseHTTPRequestHandler):
     self.end_headers()
     self.wfile.write(body)
 
+  def _streamFeed(self, feed:Feed, items:Iterator[Item]):
+    """sends a feed while its items are still being read, the connection is closed to mark the end of the response
+    """
+    self.send_response(http.server.HTTPStatus.OK)
+    self.send_header("Content-Type","application/rss+xml")
+    self.end_headers()
+    self.server.renderer.writeFeed(feed,items,self.wfile)
+
+  def _parsePageParameters(self, query:str):
+    params=parse_qs(query)
+    limit=self._parseLimit(params)
+    before=None
+    if "before" in params:
+      before=self._parseTimestamp(params["before"][0],"before")
+    since=None
+    if "since" in params:
+      since=self._parseTimestamp(params["since"][0],"since")
+    return limit,before,since
+
+  def _parseLimit(self, params:dict) -> int:
+    if not "limit" in params:
+      return self.server.pageSize
+    limit=self._parseInt(params["limit"][0],"limit")
+    if limit<1 or limit>self.server.maxPageSize:
+      raise ValueError("limit must be between 1 and %d"%self.server.maxPageSize)
+    return limit
+
+  def _parseInt(self, raw:str, name:str) -> int:
+    if not raw.isdecimal():
+      raise ValueError("%s must be a positive integer"%name)
+    return int(raw)
+
+  def _parseTimestamp(self, raw:str, name:str) -> datetime:
+    try:
+      return datetime.fromtimestamp(float(raw),timezone.utc)
+    except (ValueError,OverflowError,OSError):
+      raise ValueError("%s must be a Unix timestamp"%name)
+
   def _send400(self, message:str):
     self._sendTextResponse(http.server.HTTPStatus.BAD_REQUEST,message)
 
@@ -61,10 +146,12 @@ class FeedHandler(http.server.BaseHTTPRequestHandler):
 
 
 class TCPServer(socketserver.TCPServer):
-  """Utility class, contains references to Storage and Renderer implementations for handlers.
+  """Utility class, contains references to Storage and Renderer implementations and settings for handlers.
   """
-  storage=None  #: the storage to use, as storage.Storage
-  renderer=None #: the renderer to use, usually XMLRenderer
+  storage=None     #: the storage to use, as storage.Storage
+  renderer=None    #: the renderer to use, usually XMLRenderer
+  pageSize=None    #: the default number of items per feed
+  maxPageSize=None #: the maximum number of items per feed clients may request
 
 
 class FeedServer(threading.Thread):
@@ -73,10 +160,12 @@ class FeedServer(threading.Thread):
   This class extends threading.Thread: call start() to spawn it in the background.
   """
 
-  port=58000    #: the TCP port to listen on
+  port=58000       #: the TCP port to listen on
+  pageSize=100     #: the default number of items per feed
+  maxPageSize=1000 #: the maximum number of items per feed clients may request
   _socket=None
-  storage=None  #: the storage handler to use, will be initialized by the constructor
-  renderer=None #: the XML renderer to use, will be initialized by the constructor
+  storage=None     #: the storage handler to use, will be initialized by the constructor
+  renderer=None    #: the XML renderer to use, will be initialized by the constructor
 
   def __init__(self, storage:Storage):
     """
@@ -94,5 +183,7 @@ class FeedServer(threading.Thread):
     self._socket=TCPServer(("127.0.0.1",self.port),FeedHandler)
     self._socket.storage=self.storage
     self._socket.renderer=self.renderer
+    self._socket.pageSize=self.pageSize
+    self._socket.maxPageSize=self.maxPageSize
     log.info("listening on port %d",self.port)
     self._socket.serve_forever()
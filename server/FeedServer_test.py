@@ -1,8 +1,13 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from time import sleep
 import unittest
+from unittest.mock import patch
 
 import feedparser
 
 from server import *
+from server.FeedServer import FeedHandler
 from storage import *
 
 
@@ -26,7 +31,16 @@ class TestFeedServer(unittest.TestCase):
     feed2.items.append(item22)
     storage.putFeed(feed2)
 
+    feed3=Feed(id=30,title="feed 30")
+    for tc in range(1,151):
+      item=Item(feedID=30,title="item %d"%tc)
+      item.publicationDate=datetime.fromtimestamp(1500000000+tc*60,timezone.utc)
+      feed3.items.append(item)
+    storage.putFeed(feed3)
+
+    clazz.storage=storage
     FeedServer(storage).start()
+    sleep(0.2) #wait for server thread to start
 
 
   def testFeedPresentation(self):
@@ -58,6 +72,72 @@ class TestFeedServer(unittest.TestCase):
     self._fetchAndAssertStatus("http://127.0.0.1:58000/3",     404,"other URLs should produce status 404")
 
 
+  def testPagination(self):
+    """Tests whether feeds are limited to the most recent items, and whether other pages and time windows can be requested.
+    """
+    result=self._fetchAndAssertStatus("http://127.0.0.1:58000/feed/30",200,"feed should be found")
+    self.assertEqual(100,len(result.entries),"feed should be limited to default page size")
+    self.assertEqual("item 51",result.entries[0].title,"default page should contain the most recent items")
+
+    result=self._fetchAndAssertStatus("http://127.0.0.1:58000/feed/30?limit=3",200,"limit should be accepted")
+    self.assertEqual(["item 148","item 149","item 150"],[entry.title for entry in result.entries])
+
+    result=self._fetchAndAssertStatus("http://127.0.0.1:58000/feed/30?limit=2&before=%d"%(1500000000+50*60),200,"before should be accepted")
+    self.assertEqual(["item 48","item 49"],[entry.title for entry in result.entries])
+
+    result=self._fetchAndAssertStatus("http://127.0.0.1:58000/feed/30/suffix?since=%d"%(1500000000+148*60),200,"since should be accepted")
+    self.assertEqual(["item 148","item 149","item 150"],[entry.title for entry in result.entries])
+
+  def testPaginationErrors(self):
+    """Tests whether invalid pagination parameters are rejected.
+    """
+    self._fetchAndAssertStatus("http://127.0.0.1:58000/feed/30?limit=0",   400,"limit must be positive")
+    self._fetchAndAssertStatus("http://127.0.0.1:58000/feed/30?limit=1001",400,"limit must not exceed maximum page size")
+    self._fetchAndAssertStatus("http://127.0.0.1:58000/feed/30?limit=a",   400,"limit must be numeric")
+    self._fetchAndAssertStatus("http://127.0.0.1:58000/feed/30?before=a",  400,"before must be a timestamp")
+    self._fetchAndAssertStatus("http://127.0.0.1:58000/feed/30?since=1e99",400,"since must be a valid timestamp")
+
+
+  def testSearch(self):
+    """Tests whether search results are served as a feed.
+    """
+    result=self._fetchAndAssertStatus("http://127.0.0.1:58000/search?q=Title+20",200,"search should be accepted")
+    self.assertEqual(["title 20.1","title 20.2"],sorted([entry.title for entry in result.entries]),"should find both items")
+
+    result=self._fetchAndAssertStatus("http://127.0.0.1:58000/search?q=item+150&limit=1",200,"limit should be accepted")
+    self.assertEqual(["item 150"],[entry.title for entry in result.entries])
+
+    self._fetchAndAssertStatus("http://127.0.0.1:58000/search",        400,"search words must be given")
+    self._fetchAndAssertStatus("http://127.0.0.1:58000/search?q=a&limit=0",400,"limit must be positive")
+
+
+  def testBlockingSnapshots(self):
+    """Tests whether feeds are read into memory and sent after the snapshot if snapshots block writers.
+    """
+    storage=self.storage
+    open_snapshots=[]
+    original_snapshot=storage.snapshot
+    @contextmanager
+    def tracking_snapshot():
+      with original_snapshot():
+        open_snapshots.append(True)
+        try:
+          yield storage
+        finally:
+          open_snapshots.pop()
+    sent=[]
+    original_send=FeedHandler._sendFeed
+    def tracking_send(handler, feed):
+      sent.append(len(open_snapshots))
+      original_send(handler,feed)
+
+    with patch.object(storage,"snapshotBlocksWriters",return_value=True), patch.object(storage,"snapshot",tracking_snapshot), \
+         patch.object(FeedHandler,"_sendFeed",tracking_send):
+      result=self._fetchAndAssertStatus("http://127.0.0.1:58000/feed/30?limit=3",200,"feed should be found")
+    self.assertEqual(["item 148","item 149","item 150"],[entry.title for entry in result.entries])
+    self.assertEqual([0],sent,"feed should have been sent after the snapshot ended")
+
+
   def _fetchAndAssertStatus(self, url:str, status:int, message:str):
     result=feedparser.parse(url)
     self.assertEqual(status,result.status,message)
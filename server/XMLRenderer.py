@@ -1,5 +1,6 @@
 from PyRSS2Gen import *
 from datetime import datetime
+from typing import BinaryIO, Iterable
 
 from domain import *
 
@@ -15,16 +16,30 @@ class XMLRenderer:
     :return: the RSS 2.0 XML string
     :rtype: str
     """
-    items=[]
-    for item in feed.items:
-      items.append(RSSItem(title=item.title,
-                           link=item.itemURL,
-                           description=item.description,
-                           guid=item.guid,
-                           pubDate=item.publicationDate))
-    rss=RSS2(title=feed.title,
-             link=feed.websiteURL,
-             description=feed.description,
-             lastBuildDate=feed.lastRefreshed,
-             items=items)
-    return rss.to_xml(encoding='utf-8')
+    return self._createRSS(feed,[self._createRSSItem(item) for item in feed.items]).to_xml(encoding='utf-8')
+
+  def writeFeed(self, feed:Feed, items:Iterable[Item], stream:BinaryIO):
+    """Writes a feed as RSS XML to a stream, converting and writing items one at a time.
+
+    The feed's own .items are ignored. Only the item currently being written needs to be in memory, so items can be read
+    straight from storage with Storage.iterItems().
+
+    :param Feed feed: the input feed
+    :param Iterable[Item] items: the feed's items to write
+    :param BinaryIO stream: the stream to write UTF-8 encoded RSS 2.0 XML to
+    """
+    self._createRSS(feed,(self._createRSSItem(item) for item in items)).write_xml(stream,encoding='utf-8')
+
+  def _createRSS(self, feed:Feed, items:Iterable[RSSItem]) -> RSS2:
+    return RSS2(title=feed.title,
+                link=feed.websiteURL,
+                description=feed.description,
+                lastBuildDate=feed.lastRefreshed,
+                items=items)
+
+  def _createRSSItem(self, item:Item) -> RSSItem:
+    return RSSItem(title=item.title,
+                   link=item.itemURL,
+                   description=item.description,
+                   guid=item.guid,
+                   pubDate=item.publicationDate)
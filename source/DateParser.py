@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import re
+from typing import Union
+import unittest
+
+from logger import get_logger
+
+
+log=get_logger(__name__)
+
+
+class DateParser:
+  """Parser for feed timestamps: RFC 822 dates as used by RSS 2.0, and RFC 3339 (W3C-DTF) dates as used by Atom and RSS 1.0.
+
+  Both formats are matched with precompiled regular expressions, the format is detected automatically. RFC 822 time zone
+  abbreviations are looked up in timezoneOffsets, single-letter military zones are treated as UTC as recommended by
+  RFC 5322. Common deviations are accepted as well: missing weekdays or seconds, two-digit years, full month names and
+  offsets containing a colon.
+
+  RFC 822 dates are returned with their time zone offset. RFC 3339 dates are converted to naive UTC times without fractions
+  of seconds, the way feedparser returns them. Dates without time zone are returned as naive times.
+
+  Feeds repeat the same timestamps on every refresh, so results are kept in a bounded cache. Invalid dates are returned as
+  None instead of raising exceptions: a single bad date shouldn't keep a feed from being read.
+
+  Instances are thread-safe.
+  """
+
+  #: UTC offsets in minutes by time zone abbreviation. Ambiguous abbreviations use their most common meaning in feeds, e.g.
+  #: CST is US Central Standard Time (as defined by RFC 822) and IST is India Standard Time.
+  timezoneOffsets={"UT":0,"UTC":0,"GMT":0,"Z":0,"WET":0,"WEST":60,"BST":60,"IST":330,
+                   "EST":-300,"EDT":-240,"CST":-360,"CDT":-300,"MST":-420,"MDT":-360,"PST":-480,"PDT":-420,
+                   "AKST":-540,"AKDT":-480,"HST":-600,"HDT":-540,"AST":-240,"ADT":-180,"NST":-210,"NDT":-150,
+                   "BRT":-180,"BRST":-120,"ART":-180,"CLT":-240,"CLST":-180,
+                   "CET":60,"CEST":120,"MET":60,"MEST":120,"MEZ":60,"MESZ":120,"EET":120,"EEST":180,"MSK":180,"MSD":240,
+                   "PKT":300,"NPT":345,"ICT":420,"WIB":420,"HKT":480,"SGT":480,"PHT":480,"AWST":480,"JST":540,"KST":540,
+                   "ACST":570,"ACDT":630,"AEST":600,"AEDT":660,"NZST":720,"NZDT":780}
+
+  cacheSize=None #: the maximum number of cached results
+
+  _months={"jan":1,"feb":2,"mar":3,"apr":4,"may":5,"jun":6,"jul":7,"aug":8,"sep":9,"oct":10,"nov":11,"dec":12}
+  _rfc822Pattern=re.compile(r"(?:[A-Za-z]+,?\s*)?(\d{1,2})\s+([A-Za-z]{3})[A-Za-z]*\.?\s+(\d{2}|\d{4})\s+(\d{1,2}):(\d\d)"
+                            r"(?::(\d\d))?\s*(?:([+-])(\d\d):?(\d\d)|([A-Za-z]+))?$")
+  _rfc3339Pattern=re.compile(r"(\d{4})-(\d\d)-(\d\d)(?:[Tt ](\d\d):(\d\d)(?::(\d\d)(?:\.\d+)?)?\s*(?:([Zz])|([+-])(\d\d):?(\d\d))?)?$")
+  _timezones={}
+  _parse=None
+
+  def __init__(self, cache_size:int=4096):
+    """
+    :param int cache_size: optional: the maximum number of cached results
+    """
+    self.cacheSize=cache_size
+    self._parse=lru_cache(maxsize=cache_size)(self._parseUncached)
+
+  def parse(self, text:Union[str,None]) -> Union[datetime,None]:
+    """Parses an RFC 822 or RFC 3339 date.
+
+    :param Union[str,None] text: the date to parse
+    :return: the parsed date, or None if the text is empty or isn't a valid date
+    :rtype: Union[datetime,None]
+    """
+    if not text:
+      return None
+    return self._parse(text.strip())
+
+  def _parseUncached(self, text:str) -> Union[datetime,None]:
+    try:
+      if text[0:4].isdigit():
+        rv=self._parseRFC3339(text)
+      else:
+        rv=self._parseRFC822(text)
+    except (ValueError,OverflowError): #e.g. for day 31 of a 30 day month, or offsets moving dates out of datetime's range
+      rv=None
+    if rv==None:
+      log.debug("ignoring invalid date '%s'",text)
+    return rv
+
+  def _parseRFC822(self, text:str) -> Union[datetime,None]:
+    match=self._rfc822Pattern.match(text)
+    if match==None:
+      return None
+    day,month,year,hour,minute,second,sign,offset_hours,offset_minutes,zone=match.groups()
+    month=self._months.get(month.lower())
+    if month==None:
+      return None
+    year=int(year)
+    if year<100:
+      year+=2000 if year<50 else 1900
+    if sign!=None:
+      tz=self._getTimezone(int(offset_hours)*60+int(offset_minutes),sign)
+    elif zone!=None:
+      zone=zone.upper()
+      offset=self.timezoneOffsets.get(zone)
+      if offset==None and len(zone)==1:
+        offset=0 #military zones, see RFC 5322
+      if offset==None:
+        return None
+      tz=self._getTimezone(abs(offset),"-" if offset<0 else "+")
+    else:
+      tz=None
+    return datetime(year,month,int(day),int(hour),int(minute),int(second or 0),tzinfo=tz)
+
+  def _parseRFC3339(self, text:str) -> Union[datetime,None]:
+    match=self._rfc3339Pattern.match(text)
+    if match==None:
+      return None
+    year,month,day,hour,minute,second,utc,sign,offset_hours,offset_minutes=match.groups()
+    rv=datetime(int(year),int(month),int(day),int(hour or 0),int(minute or 0),int(second or 0))
+    if sign!=None:
+      offset=timedelta(hours=int(offset_hours),minutes=int(offset_minutes))
+      rv-=offset if sign=="+" else -offset
+    return rv
+
+  def _getTimezone(self, minutes:int, sign:str) -> timezone:
+    """returns a shared timezone instance for the given offset
+    """
+    key=minutes if sign=="+" else -minutes
+    tz=self._timezones.get(key)
+    if tz==None:
+      tz=timezone(timedelta(minutes=key))
+      self._timezones[key]=tz
+    return tz
+
+
+class TestDateParser(unittest.TestCase):
+  """Tests for the DateParser class.
+  """
+
+  def testRFC822(self):
+    """Tests whether RFC 822 dates are parsed with their offsets, including zone abbreviations and common deviations.
+    """
+    parser=DateParser()
+    cest=timezone(timedelta(hours=2))
+    tests={"Sun, 30 Sep 2018 02:00:00 CEST": datetime(2018,9,30,2,0,0,tzinfo=cest),
+           "Sun, 30 Sep 2018 02:00:00 +0200":datetime(2018,9,30,2,0,0,tzinfo=cest),
+           "30 Sep 2018 02:00 +02:00":       datetime(2018,9,30,2,0,0,tzinfo=cest),
+           "Sunday, 30 September 18 2:00:00 cest":datetime(2018,9,30,2,0,0,tzinfo=cest),
+           "Sat, 29 Sep 2018 06:34:56 EDT": datetime(2018,9,29,6,34,56,tzinfo=timezone(timedelta(hours=-4))),
+           "Mon, 01 Oct 2018 11:00:00 NST": datetime(2018,10,1,11,0,0,tzinfo=timezone(timedelta(hours=-3,minutes=-30))),
+           "Mon, 01 Oct 2018 11:00:00 A":   datetime(2018,10,1,11,0,0,tzinfo=timezone.utc),
+           "Fri, 31 Dec 99 23:59:59 GMT":   datetime(1999,12,31,23,59,59,tzinfo=timezone.utc),
+           "Mon, 01 Oct 2018 11:00:00":     datetime(2018,10,1,11,0,0)}
+    for text,expected in tests.items():
+      actual=parser.parse(text)
+      self.assertEqual(expected,actual,text)
+      self.assertEqual(expected.utcoffset(),actual.utcoffset(),text)
+
+  def testRFC3339(self):
+    """Tests whether RFC 3339 dates are converted to naive UTC times.
+    """
+    parser=DateParser()
+    self.assertEqual(datetime(2018,9,28,18,16,14),parser.parse("2018-09-28T20:16:14+02:00"))
+    self.assertEqual(datetime(2018,9,30,9,11,12),parser.parse("2018-09-29T21:11:12.5-12:00"))
+    self.assertEqual(datetime(2018,9,28,18,16,14),parser.parse("2018-09-28T18:16:14Z"))
+    self.assertEqual(datetime(2018,9,28),parser.parse(" 2018-09-28 "))
+
+  def testInvalidDates(self):
+    """Tests whether invalid dates are returned as None, and whether the cache is bounded.
+    """
+    parser=DateParser(cache_size=3)
+    for text in [None,"","yesterday","Sun, 31 Sep 2018 02:00:00 GMT","Sun, 30 Foo 2018 02:00:00 GMT",
+                 "Sun, 30 Sep 2018 02:00:00 XYZ","2018-13-01T00:00:00Z","2018-09-30T25:00:00Z",
+                 "0001-01-01T00:00:00+01:00","9999-12-31T23:59:59-01:00"]:
+      self.assertEqual(None,parser.parse(text),text)
+    self.assertEqual(3,parser._parse.cache_info().currsize)
@@ -21,13 +21,15 @@ class DummySource(Source):
     """
     return "dummy"
 
-  def updateFeed(self, feed:Feed, skip_items=False) -> None:
+  def updateFeed(self, feed:Feed, skip_items=False) -> bool:
     """Updates the given feed.
 
     Items are added on every other invocation of this method, regardless of which feed is passed.
 
     :param Feed feed: the feed to update
     :param bool skip_items: whether to skip adding items (default: False)
+    :return: always True, dummy feeds are always read
+    :rtype: bool
     """
     feed.id=self._getFeedID(feed)
     if not self.keepUpdateInterval:
@@ -50,6 +52,7 @@ class DummySource(Source):
       feed.lastChanged=max
     elif feed.lastChanged==None:
       feed.lastChanged=feed.lastRefreshed
+    return True
 
 
   def _createItem(self, feed:Feed) -> Item:
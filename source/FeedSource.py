@@ -1,14 +1,16 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import hashlib
 import string
 from time import strftime, sleep
-from typing import List
+from typing import List, Union
 import unittest
-
-import feedparser
+from unittest.mock import patch
 
 from domain import *
 from logger import get_logger
 from source import *
+from storage import *
 import testutils
 
 #from debug import *
@@ -19,100 +21,135 @@ log=get_logger(__name__)
 
 class FeedSource(Source):
   """An RSS/Atom feed source.
+
+  Feeds are downloaded by an HTTPClient, keeping connections to upstream hosts open between refreshes, and the downloaded
+  bytes are parsed separately. Only http and https feed URLs are supported.
+
+  Downloaded documents are parsed by a ParseStage, optionally in worker processes. Well-formed RSS 2.0, RSS 1.0 and Atom 1.0
+  documents are read by XMLFeedParser, feedparser is only used for documents it refuses: malformed ones and other formats.
+
+  Feeds remember a hash of the last downloaded body: identical downloads skip parsing and merging altogether, even if
+  upstream doesn't support conditional requests.
+
+  With a retention policy, items the Compactor would remove right away aren't added (again), see ItemMerger.
   """
 
+  _client=None
+  _stage=None
+  _policy=None
+  _headerFields=["updateInterval","title","description","websiteURL","lastChanged","etag","lastModified","contentHash"]
+
+  def __init__(self, client:Union[HTTPClient,None]=None, stage:Union[ParseStage,None]=None,
+               policy:Union[RetentionPolicy,None]=None):
+    """
+    :param Union[HTTPClient,None] client: optional: the HTTP client to download feeds with (default: a new HTTPClient)
+    :param Union[ParseStage,None] stage: optional: the parse stage to read feeds with (default: parsing in the calling thread)
+    :param Union[RetentionPolicy,None] policy: optional: the retention policy stored items are compacted with
+    """
+    self._client=client if client!=None else HTTPClient()
+    self._stage=stage if stage!=None else ParseStage()
+    self._policy=policy
+
   @property
   def name(self) -> str:
     """the unique source identifier for this source, 'feed'
     """
     return "feed"
 
-  def updateFeed(self, feed:Feed) -> None:
+  def updateFeed(self, feed:Feed) -> bool:
     """refreshes an RSS/Atom feed from its feed URL
 
+    The ETag and Last-Modified values upstream sent with the previous read are sent back: if upstream responds with 304 Not
+    Modified, the feed isn't parsed and only its lastRefreshed value is updated. The same applies to downloads that are
+    identical to the previous one, and feeds that were parsed but didn't change are reported as unchanged as well. Feeds with
+    changes that weren't stored yet are always reported as changed.
+
     :param Feed feed: the feed to update
+    :return: whether the feed changed, False if only its lastRefreshed value needs to be stored
+    :rtype: bool
+    :raises IOError: if the feed couldn't be downloaded
     """
-    result=feedparser.parse(feed.feedURL)
-
-    update_minutes=60
-    if "ttl" in result.feed:
-      update_minutes=int(result.feed["ttl"])
-    feed.updateInterval=timedelta(minutes=update_minutes)
-    feed.title=result.feed["title"]
-    if "subtitle" in result.feed:
-      feed.description=result.feed["subtitle"]
-    feed.websiteURL=result.feed["link"]
+    was_dirty=feed.isDirty()
+    response=self.fetch(feed)
     feed.lastRefreshed=datetime.now()
-    feed.lastChanged=self._parseDateTime(result.version,"updated",result.feed)
+    if response.status==304:
+      log.debug("feed %s not modified",feed.feedURL)
+      return was_dirty
+    if self._hashContent(response)==feed.contentHash:
+      log.debug("feed %s content unchanged",feed.feedURL)
+      return self._updateValidators(feed,response) or was_dirty
+    return self.parse(feed,response) or was_dirty
+
+  def fetch(self, feed:Feed) -> HTTPResult:
+    """Downloads a feed, sending its stored ETag and Last-Modified values along.
 
-    for entry in result.entries:
+    :param Feed feed: the feed to download
+    :return: the response, with status 304 if upstream reported the feed unchanged
+    :rtype: HTTPResult
+    :raises IOError: if the download failed or upstream responded with an error status
+    """
+    headers={}
+    if feed.etag!=None:
+      headers["If-None-Match"]=feed.etag
+    if feed.lastModified!=None:
+      headers["If-Modified-Since"]=feed.lastModified
+    response=self._client.get(feed.feedURL,headers)
+    if response.status!=304 and not 200<=response.status<300:
+      raise IOError("%s: HTTP status %d"%(feed.feedURL,response.status))
+    return response
+
+  def parse(self, feed:Feed, response:HTTPResult) -> bool:
+    """Updates a feed from a downloaded response body, merging the parsed items into the feed's items.
+
+    :param Feed feed: the feed to update
+    :param HTTPResult response: the downloaded feed
+    :return: whether any of the feed's values or items changed, including items stored without fingerprint before
+    :rtype: bool
+    """
+    header=[getattr(feed,name) for name in self._headerFields]
+    self._updateValidators(feed,response)
+    feed.contentHash=self._hashContent(response)
+    values,entries=self._stage.parse(response.body,response.url,response.headers.get("content-type",""))
+    for name,value in values.items():
+      setattr(feed,name,value)
+
+    merger=ItemMerger(feed,self._policy)
+    for entry in entries:
       item=Item()
       item.feedID=feed.id
-      if "title" in entry:
-        item.title=entry["title"]
-      if "summary" in entry:
-        item.description=entry["summary"]
-      if "link" in entry:
-        item.itemURL=entry["link"]
-      if "id" in entry:
-        item.guid=entry["id"]
-      item.publicationDate=self._parseDateTime(result.version,"updated",entry)
-      if item.publicationDate==None:
-        item.publicationDate=self._parseDateTime(result.version,"published",entry)
-      self._mergeItem(feed,item)
-#    dump_feed(feed)
-
-  def _mergeItem(self,feed,item): #TODO: add test
-    for ti,existing in enumerate(feed.items):
-      log.debug("merge: comparing (%s,%s) against (%s,%s)",item.guid,item.itemURL,existing.guid,existing.itemURL)
-      existing_id=existing.id
-      if item.guid!=None:
-        if item.guid!=existing.guid:
-          log.debug("merge: guid mismatch, can't be same")
-          continue
-        else:
-          log.debug("merge: guid match, updating")
-          item.id=existing_id
-          feed.items[ti]=item
-          return
-      if item.itemURL!=None:
-        if item.itemURL!=existing.itemURL:
-          log.debug("merge: itemURL mismatch, can't be same")
-          continue
-        else:
-          log.debug("merge: itemURL match, updating")
-          item.id=existing_id
-          feed.items[ti]=item
-          return
-    log.debug("inserting item")
-    feed.items.append(item)
-
-
-  def _parseDateTime(self,version,key,source):
-    if key in source and version=="rss20":
-      input=self._convertTimezoneNameToOffset(source[key])
-      return datetime.strptime(input,"%a, %d %b %Y %H:%M:%S %z")
-    if key+"_parsed" in source:
-      return datetime(*source[key+"_parsed"][:6])
-    return None
-
-  def _convertTimezoneNameToOffset(self, str):
-    offsets={"UTC":"+0000","CEST":"+0200","CET":"+0100","EST":"-0500","EDT":"-0400"} #TODO: improve this
-    for name in offsets:
-      str=str.replace(" "+name," "+offsets[name])
-    return str
+      for name,value in zip(ParseStage.itemFields,entry):
+        setattr(item,name,value)
+      merger.merge(item)
+    log.debug("merged feed %s: %d new items, %d changed items",feed.feedURL,len(merger.newItems),len(merger.changedItems))
+    return merger.hasChanges() or len(merger.fingerprintedItems)>0 or \
+           header!=[getattr(feed,name) for name in self._headerFields]
+
+  def _updateValidators(self, feed:Feed, response:HTTPResult) -> bool:
+    """stores the response's ETag and Last-Modified values in the feed, returns whether they changed
+    """
+    validators=(feed.etag,feed.lastModified)
+    feed.etag=response.headers.get("etag")
+    feed.lastModified=response.headers.get("last-modified")
+    return validators!=(feed.etag,feed.lastModified)
+
+  def _hashContent(self, response:HTTPResult) -> str:
+    return hashlib.sha256(response.body).hexdigest()
 
 
 class TestFeedSource(unittest.TestCase):
   """Tests for FeedSource.
   """
 
+  _server=None
+
   @classmethod
   def setUpClass(clazz):
     """test class fixture, called by unittest
     """
-    testutils.Server().start()
-    sleep(0.2) #wait server thread to start
+    if TestFeedSource._server==None: #shared with derived test classes
+      TestFeedSource._server=testutils.Server()
+      TestFeedSource._server.start()
+      sleep(0.2) #wait server thread to start
 
 
   def testMinimalRSS20(self):
@@ -157,6 +194,99 @@ class TestFeedSource(unittest.TestCase):
     self.assertEqual("title 2",             feed.items[1].title)
     self.assertEqual("http://test/atom10/2",feed.items[1].guid)
 
+  def testConditionalGet(self):
+    """Tests whether unchanged feeds are only marked as refreshed, unless they were changed locally.
+    """
+    feed=Feed(feedURL="http://127.0.0.1:58050/testresources/feeds/rss20.minimal.xml")
+    source=FeedSource()
+    self.assertTrue(source.updateFeed(feed),"first read should have parsed the feed")
+    self.assertNotEqual(None,feed.lastModified,"Last-Modified header should have been kept")
+    first_refresh=feed.lastRefreshed
+    feed.title="unchanged"
+    feed.markClean()
+
+    self.assertFalse(source.updateFeed(feed),"upstream should have reported the feed as not modified")
+    self.assertEqual("unchanged",feed.title,"unmodified feed shouldn't have been parsed")
+    self.assertEqual(2,len(feed.items))
+    self.assertGreater(feed.lastRefreshed,first_refresh,"refresh time should have been updated")
+
+    feed.title="changed locally"
+    self.assertTrue(source.updateFeed(feed),"local changes should have been reported even though upstream didn't change")
+    self.assertEqual("changed locally",feed.title)
+
+  def testUnchangedContent(self):
+    """Tests whether re-reading unchanged content merges into the known items and reports the feed as unchanged.
+    """
+    url="http://127.0.0.1:58050/testresources/feeds/rss20.full.xml"
+    feed=Feed(feedURL=url)
+    source=FeedSource()
+    source.updateFeed(feed)
+    response=source.fetch(Feed(feedURL=url))
+
+    self.assertFalse(source.parse(feed,response),"unchanged content should have been reported as unchanged")
+    self.assertEqual(2,len(feed.items),"known items should have been matched")
+    feed.items[0].title="changed locally"
+    self.assertTrue(source.parse(feed,response),"upstream values should have replaced local changes")
+    self.assertEqual(2,len(feed.items))
+
+  def testIdenticalContent(self):
+    """Tests whether downloads identical to the previous one skip parsing, even without conditional requests.
+    """
+    feed=Feed(feedURL="http://127.0.0.1:58050/testresources/feeds/rss20.full.xml")
+    source=FeedSource()
+    source.updateFeed(feed)
+    self.assertNotEqual(None,feed.contentHash,"content hash should have been stored")
+    validator=feed.lastModified
+    feed.lastModified=None #upstream won't respond with 304
+    feed.title="unchanged"
+    feed.markClean()
+    def fail():
+      self.fail("items shouldn't have been loaded")
+    feed.setItemLoader(fail)
+
+    self.assertTrue(source.updateFeed(feed),"the new Last-Modified value should have been reported as a change")
+    self.assertEqual(validator,feed.lastModified)
+    self.assertEqual("unchanged",feed.title,"identical content shouldn't have been parsed")
+    self.assertFalse(feed.hasItemsLoaded(),"identical content shouldn't have been merged")
+
+  def testMissingFeed(self):
+    """Tests whether error responses are reported instead of being parsed.
+    """
+    with self.assertRaises(IOError):
+      self._readFeed("http://127.0.0.1:58050/testresources/feeds/missing.xml")
+
+  def testRetention(self):
+    """Tests whether items removed by the Compactor aren't added again while upstream still lists them.
+    """
+    now=datetime.now(timezone.utc)
+    def respond(entries):
+      items="".join(["<item><guid>%s</guid><title>%s</title><pubDate>%s</pubDate></item>"
+                     %(guid,title,format_datetime(now-timedelta(days=days))) for guid,title,days in entries])
+      body=("<rss version=\"2.0\"><channel><title>test</title><link>http://test/</link>%s</channel></rss>"%items).encode()
+      return HTTPResult(200,"http://test/feed",{"content-type":"application/rss+xml"},body)
+
+    policy=RetentionPolicy(max_items=2,max_age=timedelta(days=10))
+    storage=SQLiteStorage(":memory:")
+    source=FeedSource(policy=policy)
+    events=[]
+    storage.subscribe(events.append)
+    def refresh(entries):
+      feed=storage.getFeedByID(1) or Feed(id=1,sourceName="feed",feedURL="http://test/feed")
+      self.assertTrue(source.parse(feed,respond(entries)),"self-check: refresh should have changed the feed")
+      with storage.writeTransaction():
+        storage.putFeed(feed)
+
+    refresh([("urn:g1","item 1",1),("urn:g2","item 2",2),("urn:old","expired",20)])
+    refresh([("urn:g0","item 0",0),("urn:g1","item 1",1),("urn:g2","item 2",2),("urn:old","expired",20)])
+    self.assertEqual(["urn:g2","urn:g1","urn:g0"],[item.guid for item in storage.getItemsByFeedID(1)],"expired item shouldn't have been added")
+    self.assertEqual(1,Compactor(storage,policy).compactAll(),"self-check: oldest item should have been removed")
+
+    refresh([("urn:g0","item 0, changed",0),("urn:g1","item 1",1),("urn:g2","item 2",2),("urn:old","expired",20)])
+    stored=storage.getItemsByFeedID(1)
+    self.assertEqual(["urn:g1","urn:g0"],[item.guid for item in stored],"expired items shouldn't have been added again")
+    self.assertEqual([[item.id for item in stored if item.guid=="urn:g0"]],[events[-1].itemIDs],
+                     "only the changed item should have been written")
+
   def _assertUTCDate(self,expected,dt):
     self.assertEqual(expected,strftime("%Y-%m-%d %H:%M:%S",dt.utctimetuple()))
 
@@ -166,3 +296,12 @@ class TestFeedSource(unittest.TestCase):
     source.updateFeed(feed)
     return feed
 
+
+class TestFeedSourceFallback(TestFeedSource):
+  """Runs the FeedSource tests with feedparser only.
+  """
+
+  def setUp(self):
+    patcher=patch.object(XMLFeedParser,"parse",side_effect=ValueError("disabled for test"))
+    patcher.start()
+    self.addCleanup(patcher.stop)
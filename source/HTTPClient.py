@@ -0,0 +1,363 @@
+import gzip
+import http.client
+import http.server
+import socket
+import socketserver
+from threading import Lock, Thread
+from time import sleep, time
+from typing import Dict, List, Tuple, Union
+import unittest
+from unittest.mock import patch
+from urllib.parse import urljoin, urlsplit
+import zlib
+
+
+class HTTPResult:
+  """Data class for an HTTP response read by HTTPClient.
+  """
+  status=None  #: the HTTP status code, as int
+  url=None     #: the URL the response was read from after following redirects, as string
+  headers=None #: the response headers with lowercase names, as dict of strings
+  body=None    #: the decompressed response body, as bytes
+
+  def __init__(self, status:int, url:str, headers:Dict[str,str], body:bytes):
+    """
+    :param int status: the HTTP status code
+    :param str url: the URL the response was read from
+    :param Dict[str,str] headers: the response headers with lowercase names
+    :param bytes body: the decompressed response body
+    """
+    self.status=status
+    self.url=url
+    self.headers=headers
+    self.body=body
+
+
+class HTTPClient:
+  """HTTP/1.1 client for fetching feeds, keeping connections to upstream hosts open between requests.
+
+  Each (scheme, host, port) gets its own pool of idle keep-alive connections, so feeds sharing a host skip the TCP and TLS
+  handshakes after the first request. Host names are resolved once per dnsTTL seconds, connections are attempted to each of
+  a host's addresses in turn. Instances are thread-safe: concurrent
+  requests to the same host use separate connections, up to maxIdlePerHost of them are kept afterwards.
+
+  Every socket operation times out after timeout seconds, and response bodies larger than maxBytes (after decompression) are
+  refused with an IOError. Redirects are followed, other statuses are returned to the caller.
+  """
+
+  timeout=None       #: the timeout for connecting and for each read, in seconds
+  maxBytes=None      #: the maximum response body size in bytes, after decompression
+  maxRedirects=5     #: the maximum number of redirects to follow
+  maxIdlePerHost=4   #: the maximum number of idle connections to keep per host
+  idleTimeout=30     #: the time in seconds idle connections are kept before closing them
+  dnsTTL=300         #: the time in seconds resolved host addresses are reused
+  userAgent="FeedTrough (+https://github.com/rinusser/FeedTrough)" #: the User-Agent header sent with requests
+
+  _idle=None
+  _addresses=None
+  _lock=None
+  _redirectStatuses=(301,302,303,307,308)
+  _staleConnectionErrors=(http.client.RemoteDisconnected,ConnectionResetError,BrokenPipeError)
+
+  def __init__(self, timeout:float=10, max_bytes:int=10*1024*1024):
+    """
+    :param float timeout: optional: the timeout for connecting and for each read, in seconds
+    :param int max_bytes: optional: the maximum response body size in bytes, after decompression
+    """
+    self.timeout=timeout
+    self.maxBytes=max_bytes
+    self._idle={}
+    self._addresses={}
+    self._lock=Lock()
+
+  def get(self, url:str, headers:Union[Dict[str,str],None]=None) -> HTTPResult:
+    """Performs a GET request, following redirects.
+
+    :param str url: the http or https URL to read
+    :param Union[Dict[str,str],None] headers: optional: additional request headers, e.g. for conditional requests
+    :rtype: HTTPResult
+    :raises ValueError: if the URL isn't an http or https URL
+    :raises IOError: if the connection failed or timed out, if there were too many redirects or if the body is too large
+    """
+    for tc in range(0,self.maxRedirects+1):
+      result=self._request(url,headers or {})
+      if not result.status in self._redirectStatuses or not "location" in result.headers:
+        return result
+      url=urljoin(url,result.headers["location"])
+    raise IOError("%s: too many redirects"%url)
+
+  def close(self):
+    """Closes all idle connections. Connections in use are closed when their requests finish.
+    """
+    with self._lock:
+      idle=self._idle
+      self._idle={}
+    for connections in idle.values():
+      for conn,since in connections:
+        conn.close()
+
+  def _request(self, url:str, headers:Dict[str,str]) -> HTTPResult:
+    parts=urlsplit(url)
+    if not parts.scheme in ("http","https") or not parts.hostname:
+      raise ValueError("unsupported URL: %s"%url)
+    key=(parts.scheme,parts.hostname,parts.port or (443 if parts.scheme=="https" else 80))
+    path=(parts.path or "/")+("?"+parts.query if parts.query else "")
+    request_headers={"Host":parts.netloc.rpartition("@")[2],
+                     "User-Agent":self.userAgent,
+                     "Accept":"application/rss+xml, application/atom+xml, application/xml;q=0.9, text/xml;q=0.9, */*;q=0.1",
+                     "Accept-Encoding":"gzip, deflate"}
+    request_headers.update(headers)
+
+    while True:
+      conn,reused=self._acquire(key)
+      try:
+        conn.request("GET",path,headers=request_headers)
+        response=conn.getresponse()
+      except self._staleConnectionErrors:
+        conn.close()
+        if reused:
+          continue #upstream closed the idle connection in the meantime, retry with a new one
+        raise
+      except:
+        conn.close()
+        raise
+      break
+
+    try:
+      body=self._readBody(url,response)
+    except:
+      conn.close()
+      raise
+    if response.will_close:
+      conn.close()
+    else:
+      self._release(key,conn)
+    return HTTPResult(response.status,url,{name.lower():value for name,value in response.getheaders()},body)
+
+  def _acquire(self, key:Tuple[str,str,int]) -> Tuple[http.client.HTTPConnection,bool]:
+    """returns an idle connection to the given host if there is one, or a new connection. Expired idle connections are closed.
+    """
+    now=time()
+    expired=[]
+    conn=None
+    with self._lock:
+      connections=self._idle.get(key,[])
+      while len(connections)>0:
+        candidate,since=connections.pop()
+        if since+self.idleTimeout>now:
+          conn=candidate
+          break
+        expired.append(candidate)
+    for candidate in expired:
+      candidate.close()
+    if conn!=None:
+      return conn,True
+
+    scheme,host,port=key
+    if scheme=="https":
+      conn=http.client.HTTPSConnection(host,port,timeout=self.timeout)
+    else:
+      conn=http.client.HTTPConnection(host,port,timeout=self.timeout)
+    conn._create_connection=self._connect
+    return conn,False
+
+  def _release(self, key:Tuple[str,str,int], conn:http.client.HTTPConnection):
+    with self._lock:
+      connections=self._idle.setdefault(key,[])
+      if len(connections)<self.maxIdlePerHost:
+        connections.append((conn,time()))
+        return
+    conn.close()
+
+  def _connect(self, address:Tuple[str,int], timeout, source_address=None) -> socket.socket:
+    """opens a TCP connection to the first reachable cached address of the given host. TLS still uses the host name.
+
+    If none of the addresses is reachable they're dropped from the cache, so the next attempt resolves the host name again.
+    """
+    error=None
+    for resolved in self._resolve(address):
+      try:
+        return socket.create_connection(resolved,timeout,source_address)
+      except OSError as e:
+        error=e
+    with self._lock:
+      self._addresses.pop(address,None)
+    raise error
+
+  def _resolve(self, address:Tuple[str,int]) -> List[Tuple[str,int]]:
+    now=time()
+    with self._lock:
+      cached=self._addresses.get(address)
+    if cached!=None and cached[1]>now:
+      return cached[0]
+    host,port=address
+    resolved=[]
+    for info in socket.getaddrinfo(host,port,type=socket.SOCK_STREAM):
+      if not info[4][0:2] in resolved:
+        resolved.append(info[4][0:2])
+    with self._lock:
+      self._addresses[address]=(resolved,now+self.dnsTTL)
+    return resolved
+
+  def _readBody(self, url:str, response:http.client.HTTPResponse) -> bytes:
+    """reads the whole response body, decompressing it and enforcing the size limit on the way
+    """
+    length=response.getheader("Content-Length")
+    if length!=None and length.isdigit() and int(length)>self.maxBytes:
+      raise IOError("%s: response size %s exceeds limit of %d bytes"%(url,length,self.maxBytes))
+    encoding=(response.getheader("Content-Encoding") or "identity").strip().lower()
+    decompressor=None
+    if encoding in ("gzip","x-gzip"):
+      decompressor=zlib.decompressobj(16+zlib.MAX_WBITS)
+    elif encoding=="deflate":
+      decompressor=zlib.decompressobj()
+
+    chunks=[]
+    size=0
+    while True:
+      raw=response.read(65536)
+      if decompressor==None:
+        chunk=raw
+      elif raw:
+        chunk=decompressor.decompress(raw,self.maxBytes-size+1)
+        if decompressor.unconsumed_tail:
+          size=self.maxBytes+1
+      else:
+        chunk=decompressor.flush()
+      size+=len(chunk)
+      if size>self.maxBytes:
+        raise IOError("%s: response exceeds limit of %d bytes"%(url,self.maxBytes))
+      chunks.append(chunk)
+      if not raw:
+        return b"".join(chunks)
+
+
+class _TestServer(socketserver.ThreadingMixIn,http.server.HTTPServer):
+  daemon_threads=True
+
+
+class _TestRequestHandler(http.server.BaseHTTPRequestHandler):
+  """keep-alive test server: serves a fixed body in several variants and records the client ports it was contacted from
+  """
+  protocol_version="HTTP/1.1"
+  ports=[]
+  body=b"<rss>"+b"x"*1000+b"</rss>"
+
+  def do_GET(self):
+    self.ports.append(self.client_address[1])
+    body=self.body
+    headers={"ETag":'"1"'}
+    if self.path=="/redirect":
+      self._respond(302,b"",{"Location":"/feed"})
+      return
+    if self.path=="/slow":
+      sleep(1)
+    if self.path=="/drop":
+      self.close_connection=True #closes the connection without announcing it, like an upstream idle timeout
+    if self.path=="/gzip":
+      body=gzip.compress(body)
+      headers["Content-Encoding"]="gzip"
+    if self.headers.get("If-None-Match")=='"1"':
+      self._respond(304,b"",headers)
+      return
+    self._respond(200,body,headers)
+
+  def _respond(self, status, body, headers):
+    try:
+      self.send_response(status)
+      for name,value in headers.items():
+        self.send_header(name,value)
+      if status!=304:
+        self.send_header("Content-Length",str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+    except (BrokenPipeError,ConnectionResetError): #e.g. clients giving up on /slow
+      self.close_connection=True
+
+  def log_message(self, format, *args):
+    pass
+
+
+class TestHTTPClient(unittest.TestCase):
+  """Tests for the HTTPClient class.
+  """
+
+  @classmethod
+  def setUpClass(clazz):
+    """test class fixture, called by unittest
+    """
+    clazz.server=_TestServer(("127.0.0.1",0),_TestRequestHandler)
+    clazz.baseURL="http://127.0.0.1:%d"%clazz.server.server_address[1]
+    Thread(target=clazz.server.serve_forever,daemon=True).start()
+
+  @classmethod
+  def tearDownClass(clazz):
+    """test class fixture, called by unittest
+    """
+    clazz.server.shutdown()
+    clazz.server.server_close()
+
+  def setUp(self):
+    _TestRequestHandler.ports.clear()
+
+  def testKeepAlive(self):
+    """Tests whether requests to the same host reuse the connection, including redirects and conditional requests.
+    """
+    client=HTTPClient()
+    first=client.get(self.baseURL+"/feed")
+    self.assertEqual(200,first.status)
+    self.assertEqual(_TestRequestHandler.body,first.body)
+    self.assertEqual('"1"',first.headers["etag"],"header names should be lowercase")
+
+    redirected=client.get(self.baseURL+"/redirect")
+    self.assertEqual(self.baseURL+"/feed",redirected.url,"redirect should have been followed")
+    self.assertEqual(304,client.get(self.baseURL+"/feed",{"If-None-Match":'"1"'}).status)
+    self.assertEqual(4,len(_TestRequestHandler.ports))
+    self.assertEqual(1,len(set(_TestRequestHandler.ports)),"all requests should have used the same connection")
+    client.close()
+
+  def testStaleConnection(self):
+    """Tests whether an idle connection closed by upstream is replaced transparently.
+    """
+    client=HTTPClient()
+    client.get(self.baseURL+"/drop")
+    sleep(0.1)
+    self.assertEqual(200,client.get(self.baseURL+"/feed").status)
+    self.assertEqual(2,len(set(_TestRequestHandler.ports)),"should have reconnected")
+    client.close()
+
+  def testAddressFallback(self):
+    """Tests whether a host's other addresses are tried if connecting to the first one fails.
+    """
+    closed=socket.socket()
+    closed.bind(("127.0.0.1",0))
+    unreachable=closed.getsockname()
+    closed.close()
+    port=self.server.server_address[1]
+    getaddrinfo=socket.getaddrinfo
+    def resolve(host, *args, **kwargs):
+      if host!="feedhost":
+        return getaddrinfo(host,*args,**kwargs)
+      return [(socket.AF_INET,socket.SOCK_STREAM,6,"",address) for address in [unreachable,("127.0.0.1",port)]]
+
+    client=HTTPClient()
+    with patch.object(socket,"getaddrinfo",side_effect=resolve):
+      self.assertEqual(200,client.get("http://feedhost:%d/feed"%port).status)
+    client.close()
+
+  def testLimits(self):
+    """Tests whether compressed bodies are decompressed, and whether size limits and timeouts are enforced.
+    """
+    client=HTTPClient(timeout=0.3,max_bytes=len(_TestRequestHandler.body))
+    self.assertEqual(_TestRequestHandler.body,client.get(self.baseURL+"/gzip").body)
+
+    client.maxBytes-=1
+    with self.assertRaises(IOError,msg="plain body exceeding the limit should have been refused"):
+      client.get(self.baseURL+"/feed")
+    with self.assertRaises(IOError,msg="decompressed body exceeding the limit should have been refused"):
+      client.get(self.baseURL+"/gzip")
+    with self.assertRaises(socket.timeout):
+      client.get(self.baseURL+"/slow")
+    with self.assertRaises(ValueError):
+      client.get("ftp://127.0.0.1/feed")
+    client.close()
@@ -0,0 +1,266 @@
+from bisect import bisect_right, insort
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+from typing import Union
+import unittest
+
+from domain import *
+from storage import *
+
+
+class ItemMerger:
+  """Merges items read from upstream into a feed's items, reporting which items are new and which changed.
+
+  Known items are looked up in hash indexes built once from the feed's items: items with a guid match the known item with
+  the same guid, items without guid match the known item with the same itemURL. Matching items have their values copied
+  into the known item, other items are appended to the feed. Merging a feed's upstream entries therefore takes time
+  proportional to the number of entries, regardless of how many items are stored already.
+
+  Every merged item gets a fingerprint of its upstream values. Stored items whose fingerprint matches the upstream entry's
+  are skipped without comparing (or loading) their values, so re-published but unchanged entries are never rewritten. Items
+  stored without fingerprint are compared value by value once, and get the fingerprint set even if their values match: they
+  need to be stored once more, but aren't reported as changed.
+
+  With a retention policy, unknown items the Compactor would remove right away aren't appended: items published before the
+  policy's cutoff, and items that have at least maxItems newer items in the feed. Items that expired and were removed from
+  storage therefore aren't added again while upstream still lists them.
+  """
+
+  newItems=None     #: the items appended to the feed, as list of domain.Item
+  changedItems=None #: the known items that got different values, as list of domain.Item
+  expiredItems=None #: the unknown items that weren't appended because the retention policy expires them, as list of domain.Item
+  fingerprintedItems=None #: the known items that only got their fingerprint set, as list of domain.Item
+
+  _feed=None
+  _byGUID=None
+  _byURL=None
+  _reported=None
+  _policy=None
+  _cutoff=None
+  _dates=None
+  _fields=["guid","title","description","itemURL","publicationDate"]
+
+  def __init__(self, feed:Feed, policy:Union[RetentionPolicy,None]=None):
+    """
+    :param Feed feed: the feed to merge items into, its items are loaded if necessary
+    :param Union[RetentionPolicy,None] policy: optional: the retention policy the feed's items are compacted with
+    """
+    self._feed=feed
+    self._byGUID={}
+    self._byURL={}
+    self.newItems=[]
+    self.changedItems=[]
+    self.expiredItems=[]
+    self.fingerprintedItems=[]
+    self._reported=set()
+    for item in feed.items:
+      self._index(item)
+    if policy!=None:
+      self._policy=policy
+      self._cutoff=policy.getCutoff()
+      if policy.maxItems!=None:
+        self._dates=sorted([self._toUTC(item.publicationDate) for item in feed.items if item.publicationDate!=None])
+
+  def merge(self, item:Item) -> Item:
+    """Merges an upstream item into the feed.
+
+    :param Item item: the upstream item
+    :return: the feed's item the upstream item was merged into: either a known item or the given item, if it was appended
+    :rtype: Item
+    """
+    item.fingerprint=self.fingerprint(item)
+    if item.guid!=None:
+      existing=self._byGUID.get(item.guid)
+    elif item.itemURL!=None:
+      existing=self._byURL.get(item.itemURL)
+    else:
+      existing=None
+
+    if existing==None:
+      if self._isExpired(item):
+        self.expiredItems.append(item)
+        return item
+      if self._dates!=None and item.publicationDate!=None:
+        insort(self._dates,self._toUTC(item.publicationDate))
+      self._feed.items.append(item)
+      self._index(item)
+      self.newItems.append(item)
+      self._reported.add(id(item))
+      return item
+
+    if existing.fingerprint==item.fingerprint and not existing.isDirty():
+      return existing
+    changes=[name for name in self._fields if getattr(existing,name)!=getattr(item,name)]
+    if len(changes)>0:
+      self._unindex(existing)
+      for name in changes:
+        setattr(existing,name,getattr(item,name))
+      self._index(existing)
+      if not id(existing) in self._reported:
+        self.changedItems.append(existing)
+        self._reported.add(id(existing))
+      existing.fingerprint=item.fingerprint
+    elif existing.fingerprint!=item.fingerprint:
+      existing.fingerprint=item.fingerprint
+      self.fingerprintedItems.append(existing)
+    return existing
+
+  def fingerprint(self, item:Item) -> str:
+    """Calculates the fingerprint of an item's upstream values.
+
+    :param Item item: the item to calculate the fingerprint for
+    :return: the SHA-256 hash of the item's values, as hex string
+    :rtype: str
+    """
+    values=json.dumps([getattr(item,name) for name in self._fields],default=str)
+    return hashlib.sha256(values.encode()).hexdigest()
+
+  def hasChanges(self) -> bool:
+    """Checks whether any item was appended or changed so far.
+
+    :rtype: bool
+    """
+    return len(self.newItems)>0 or len(self.changedItems)>0
+
+  def _isExpired(self, item:Item) -> bool:
+    """checks whether the Compactor would remove a new item right away, ordering items like it does: by publication date,
+    new items being newer than known items with the same date and items without date being the oldest
+    """
+    if self._policy==None:
+      return False
+    date=self._toUTC(item.publicationDate) if item.publicationDate!=None else None
+    if date!=None and self._cutoff!=None and date<self._cutoff:
+      return True
+    if self._dates!=None:
+      newer=len(self._dates)-bisect_right(self._dates,date) if date!=None else len(self._dates)
+      return newer>=self._policy.maxItems
+    return False
+
+  def _toUTC(self, date:datetime) -> datetime:
+    """returns a comparable date, naive dates are UTC
+    """
+    return date.replace(tzinfo=timezone.utc) if date.tzinfo==None else date
+
+  def _index(self, item:Item):
+    """adds an item to the indexes, the first item with a given key takes precedence
+    """
+    if item.guid!=None:
+      self._byGUID.setdefault(item.guid,item)
+    if item.itemURL!=None:
+      self._byURL.setdefault(item.itemURL,item)
+
+  def _unindex(self, item:Item):
+    if self._byGUID.get(item.guid) is item:
+      del self._byGUID[item.guid]
+    if self._byURL.get(item.itemURL) is item:
+      del self._byURL[item.itemURL]
+
+
+class TestItemMerger(unittest.TestCase):
+  """Tests for the ItemMerger class.
+  """
+
+  def _createItem(self, guid:str, url:str, title:str) -> Item:
+    item=Item(title=title)
+    item.guid=guid
+    item.itemURL=url
+    return item
+
+  def testMerge(self):
+    """Tests whether items are matched by guid first, by URL if they don't have a guid, and appended otherwise.
+    """
+    feed=Feed()
+    known=[self._createItem("g1","http://test/1","first"),
+           self._createItem(None,"http://test/2","second"),
+           self._createItem("g3","http://test/3","third")]
+    for item in known:
+      item.markClean()
+    feed.items=list(known)
+    merger=ItemMerger(feed)
+
+    self.assertIs(known[0],merger.merge(self._createItem("g1","http://test/1","first")),"should have matched by guid")
+    self.assertIs(known[1],merger.merge(self._createItem(None,"http://test/2","second, changed")))
+    self.assertIs(known[2],merger.merge(self._createItem(None,"http://test/3","third, without guid")),
+                  "items without guid should match known items by URL")
+    added=merger.merge(self._createItem("g4","http://test/2","different guid, same URL"))
+    self.assertIsNot(known[1],added,"items with different guids shouldn't match by URL")
+    anonymous=merger.merge(self._createItem(None,None,"no guid, no URL"))
+    self.assertIs(added,merger.merge(self._createItem("g4",None,"repeated")),"appended items should be matched too")
+
+    self.assertEqual(["first","second, changed","third, without guid","repeated","no guid, no URL"],
+                     [item.title for item in feed.items])
+    self.assertEqual(None,known[2].guid,"values should have been copied")
+    self.assertEqual([known[0]],merger.fingerprintedItems,"unchanged item should only have gotten a fingerprint")
+    self.assertEqual([added,anonymous],merger.newItems)
+    self.assertEqual([known[1],known[2]],merger.changedItems,"appended items shouldn't be reported as changed")
+    self.assertTrue(merger.hasChanges())
+
+  def testUnchanged(self):
+    """Tests whether merging known items without differences doesn't report changes, and only sets missing fingerprints once.
+    """
+    feed=Feed()
+    feed.items=[self._createItem("g%d"%tc,None,"item %d"%tc) for tc in range(0,100)]
+    merger=ItemMerger(feed)
+    for tc in reversed(range(0,100)):
+      merger.merge(self._createItem("g%d"%tc,None,"item %d"%tc))
+    self.assertEqual(100,len(feed.items))
+    self.assertFalse(merger.hasChanges())
+    self.assertEqual(100,len(merger.fingerprintedItems),"items without fingerprint should have gotten one")
+
+    def fail():
+      self.fail("fingerprinted items shouldn't have been compared again")
+    for item in feed.items:
+      item.setDescriptionLoader(fail)
+      item.markClean()
+    merger=ItemMerger(feed)
+    for tc in range(0,100):
+      merger.merge(self._createItem("g%d"%tc,None,"item %d"%tc))
+    self.assertEqual([],merger.fingerprintedItems)
+
+  def testFingerprints(self):
+    """Tests whether stored items with matching fingerprints are skipped without loading their descriptions.
+    """
+    upstream=self._createItem("g1",None,"title")
+    upstream.description="description"
+    stored=self._createItem("g1",None,"title")
+    stored.fingerprint=ItemMerger(Feed()).fingerprint(upstream)
+    def fail():
+      self.fail("description shouldn't have been loaded")
+    stored.setDescriptionLoader(fail)
+    stored.markClean()
+    feed=Feed()
+    feed.items=[stored]
+
+    merger=ItemMerger(feed)
+    self.assertIs(stored,merger.merge(upstream))
+    self.assertFalse(stored.isDirty(),"unchanged item shouldn't have been touched")
+    self.assertFalse(merger.hasChanges())
+
+    stored.setDescriptionLoader(lambda: "description")
+    changed=self._createItem("g1",None,"changed title")
+    changed.description="description"
+    merger.merge(changed)
+    self.assertEqual([stored],merger.changedItems)
+    self.assertEqual(changed.fingerprint,stored.fingerprint,"fingerprint should have been updated")
+    self.assertNotEqual(upstream.fingerprint,changed.fingerprint)
+
+  def testRetention(self):
+    """Tests whether unknown items the retention policy expires aren't appended, while known items are still merged.
+    """
+    now=datetime.now(timezone.utc)
+    def create(guid, days):
+      item=self._createItem(guid,None,guid)
+      item.publicationDate=now-timedelta(days=days) if days!=None else None
+      return item
+    feed=Feed()
+    feed.items=[create("known",5)]
+    merger=ItemMerger(feed,RetentionPolicy(max_items=3,max_age=timedelta(days=10)))
+
+    for guid,days in [("new",1),("too old",11),("known",5),("newest",0),("undated",None),("older",6),("naive",2)]:
+      item=create(guid,days)
+      if guid=="naive":
+        item.publicationDate=item.publicationDate.astimezone(timezone.utc).replace(tzinfo=None)
+      merger.merge(item)
+    self.assertEqual(["known","new","newest","naive"],[item.guid for item in feed.items])
+    self.assertEqual(["too old","undated","older"],[item.guid for item in merger.expiredItems])
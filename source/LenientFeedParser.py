@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple, Union
+
+import feedparser
+
+from domain import *
+from source.DateParser import *
+
+
+class LenientFeedParser:
+  """Feed document parser based on feedparser, for documents XMLFeedParser refuses: malformed ones and other formats.
+
+  feedparser handles almost anything that looks like a feed, at the cost of building large dictionaries and sanitizing every
+  entry.
+  """
+
+  _dates=DateParser() #shared by all instances, so cached dates are reused across documents
+
+  def parse(self, body:bytes, url:str, content_type:str) -> Tuple[Dict[str,object],List[Item]]:
+    """Reads a feed document.
+
+    :param bytes body: the feed document
+    :param str url: the URL the document was read from, for resolving relative links
+    :param str content_type: the document's HTTP Content-Type header, may be empty
+    :return: the feed values the document defines by Feed attribute name, and the document's entries as new items in document
+             order
+    :rtype: Tuple[Dict[str,object],List[Item]]
+    """
+    result=feedparser.parse(body,response_headers={"content-type":content_type,"content-location":url})
+
+    update_minutes=60
+    if "ttl" in result.feed:
+      update_minutes=int(result.feed["ttl"])
+    header={"updateInterval":timedelta(minutes=update_minutes),
+            "title":result.feed["title"]}
+    if "subtitle" in result.feed:
+      header["description"]=result.feed["subtitle"]
+    header["websiteURL"]=result.feed["link"]
+    header["lastChanged"]=self._parseDateTime(result.feed,"updated")
+
+    items=[]
+    for entry in result.entries:
+      item=Item()
+      if "title" in entry:
+        item.title=entry["title"]
+      if "summary" in entry:
+        item.description=entry["summary"]
+      if "link" in entry:
+        item.itemURL=entry["link"]
+      if "id" in entry:
+        item.guid=entry["id"]
+      item.publicationDate=self._parseDateTime(entry,"updated")
+      if item.publicationDate==None:
+        item.publicationDate=self._parseDateTime(entry,"published")
+      items.append(item)
+    return header,items
+
+  def _parseDateTime(self, source:dict, key:str) -> Union[datetime,None]:
+    """reads a date from feedparser's result: the original text if DateParser can read it, feedparser's parsed value otherwise
+    """
+    rv=self._dates.parse(source[key]) if key in source else None
+    if rv==None and key+"_parsed" in source:
+      rv=datetime(*source[key+"_parsed"][:6])
+    return rv
@@ -0,0 +1,151 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import signal
+import sys
+from threading import Lock
+from typing import Dict, List, Tuple
+import unittest
+
+from domain import *
+from logger import get_logger
+from source.LenientFeedParser import *
+from source.XMLFeedParser import *
+
+
+log=get_logger(__name__)
+
+
+class ParseStage:
+  """Turns downloaded feed documents into feed values and compact item tuples, optionally in a pool of worker processes.
+
+  Parsing is pure Python work: done in the refreshing thread it holds the GIL, and e.g. the FeedServer thread's responses
+  wait for it. With workers, documents are parsed in a ProcessPoolExecutor instead. Only the document's bytes are sent to
+  a worker process, and only the feed values and one tuple of itemFields values per entry are sent back. Refresh threads
+  simply wait for the results, so parsing runs on as many cores as there are workers.
+
+  Without workers documents are parsed in the calling thread. Either way, XMLFeedParser reads the document if it can and
+  LenientFeedParser reads it otherwise.
+
+  Worker processes are started on first use. If a worker dies (e.g. killed for using too much memory), the pool is replaced
+  and the document is parsed once more. Instances are thread-safe.
+  """
+
+  itemFields=("guid","title","description","itemURL","publicationDate") #: the Item attributes in returned item tuples
+
+  workers=None #: the number of worker processes, 0 to parse in the calling thread
+
+  _pool=None
+  _lock=None
+
+  def __init__(self, workers:int=0):
+    """
+    :param int workers: optional: the number of worker processes, 0 to parse in the calling thread (default)
+    :raises ValueError: if the number of workers is negative
+    """
+    if workers<0:
+      raise ValueError("number of parse workers can't be negative")
+    self.workers=workers
+    self._lock=Lock()
+
+  def parse(self, body:bytes, url:str, content_type:str) -> Tuple[Dict[str,object],List[tuple]]:
+    """Reads a feed document.
+
+    :param bytes body: the feed document
+    :param str url: the URL the document was read from
+    :param str content_type: the document's HTTP Content-Type header, may be empty
+    :return: the feed values the document defines by Feed attribute name, and a tuple of itemFields values per entry in
+             document order
+    :rtype: Tuple[Dict[str,object],List[tuple]]
+    :raises Exception: whatever parsing the document raised
+    """
+    if self.workers==0:
+      return _parseDocument(body,url,content_type)
+    pool=self._getPool()
+    try:
+      return pool.submit(_parseDocument,body,url,content_type).result()
+    except BrokenProcessPool:
+      log.warning("parse worker died while parsing %s, restarting parse workers",url)
+      self._dropPool(pool)
+    return self._getPool().submit(_parseDocument,body,url,content_type).result()
+
+  def close(self):
+    """Stops the worker processes, if there are any. They're started again if necessary.
+    """
+    with self._lock:
+      pool=self._pool
+      self._pool=None
+    if pool!=None:
+      pool.shutdown()
+
+  def _dropPool(self, pool:ProcessPoolExecutor):
+    """discards a broken pool, unless another thread replaced it already
+    """
+    with self._lock:
+      if self._pool is pool:
+        self._pool=None
+    pool.shutdown(wait=False)
+
+  def _getPool(self) -> ProcessPoolExecutor:
+    with self._lock:
+      if self._pool==None:
+        log.debug("starting %d parse workers",self.workers)
+        if sys.version_info>=(3,7):
+          #spawned workers don't inherit other threads' state, e.g. locks held while forking
+          self._pool=ProcessPoolExecutor(self.workers,mp_context=multiprocessing.get_context("spawn")) #requires Python 3.7+
+        else:
+          self._pool=ProcessPoolExecutor(self.workers)
+      return self._pool
+
+
+def _parseDocument(body:bytes, url:str, content_type:str) -> Tuple[Dict[str,object],List[tuple]]:
+  """parses a feed document into feed values and item tuples, this runs in worker processes and needs to be importable
+  """
+  try:
+    header,items=XMLFeedParser().parse(body)
+  except ValueError as e:
+    log.debug("parsing %s with feedparser: %s",url,e)
+    header,items=LenientFeedParser().parse(body,url,content_type)
+  return header,[tuple([getattr(item,name) for name in ParseStage.itemFields]) for item in items]
+
+
+class TestParseStage(unittest.TestCase):
+  """Tests for the ParseStage class.
+  """
+
+  _document=b"""<rss version="2.0"><channel><title>test</title><link>http://test/</link>
+    <item><guid>g1</guid><title>item 1</title><pubDate>Sun, 30 Sep 2018 02:00:00 CEST</pubDate></item>
+    <item><title>item&nbsp;2</title></item>
+  </channel></rss>"""
+
+  def testWorkers(self):
+    """Tests whether worker processes return the same results as parsing in the calling thread, including the fallback.
+    """
+    expected=ParseStage().parse(self._document,"http://test/feed","application/rss+xml")
+    self.assertEqual("test",expected[0]["title"])
+    self.assertEqual(["item 1","item\xa02"],[values[1] for values in expected[1]],"entity should have been resolved")
+
+    stage=ParseStage(2)
+    try:
+      self.assertEqual(expected,stage.parse(self._document,"http://test/feed","application/rss+xml"))
+      with self.assertRaises(KeyError,msg="errors in workers should have been passed on"):
+        stage.parse(b"not a feed","http://test/feed","")
+    finally:
+      stage.close()
+
+  def testDeadWorkers(self):
+    """Tests whether the worker pool is replaced after a worker process died.
+    """
+    stage=ParseStage(1)
+    try:
+      expected=stage.parse(self._document,"http://test/feed","application/rss+xml")
+      broken=stage._pool
+      for pid in list(broken._processes.keys()):
+        os.kill(pid,signal.SIGKILL)
+      self.assertEqual(expected,stage.parse(self._document,"http://test/feed","application/rss+xml"),
+                       "document should have been parsed by a new worker")
+      self.assertIsNot(broken,stage._pool,"broken pool should have been replaced")
+      self.assertEqual(expected,stage.parse(self._document,"http://test/feed","application/rss+xml"))
+    finally:
+      stage.close()
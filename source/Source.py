@@ -21,10 +21,15 @@ class Source(ABC):
     pass
 
   @abstractmethod
-  def updateFeed(self, feed:Feed) -> None:
+  def updateFeed(self, feed:Feed) -> bool:
     """abstract: this should update feed data from its source, e.g. an upstream RSS feed
 
+    Sources able to tell that upstream didn't change since the last read should only update feed.lastRefreshed and return
+    False, callers then don't need to store anything else.
+
     :param Feed feed: the feed to update
+    :return: whether the feed's contents were read, False if upstream reported them unchanged
+    :rtype: bool
     """
     pass
 
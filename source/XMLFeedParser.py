@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Dict, List, Tuple, Union
+import unittest
+from xml.etree import ElementTree
+
+from domain import *
+from source.DateParser import *
+
+
+_ATOM="{http://www.w3.org/2005/Atom}"
+_RSS10="{http://purl.org/rss/1.0/}"
+_RDF="{http://www.w3.org/1999/02/22-rdf-syntax-ns#}"
+_DC="{http://purl.org/dc/elements/1.1/}"
+_CONTENT="{http://purl.org/rss/1.0/modules/content/}"
+_XHTML="{http://www.w3.org/1999/xhtml}"
+
+
+class XMLFeedParser:
+  """Lean parser for well-formed RSS 2.0, RSS 1.0 and Atom 1.0 documents, reading only the values FeedTrough stores.
+
+  Documents are read incrementally with ElementTree.iterparse(): every entry is converted into an Item as soon as it's
+  complete and discarded afterwards. Values are taken as they are, without feedparser's sanitizing and normalization. Dates
+  are read by DateParser, invalid dates are left empty.
+
+  Malformed documents and other formats are refused with a ValueError, callers should fall back to a lenient parser like
+  feedparser for those.
+  """
+
+  _dates=DateParser() #shared by all instances, so cached dates are reused across documents
+
+  def parse(self, body:bytes) -> Tuple[Dict[str,object],List[Item]]:
+    """Reads a feed document.
+
+    :param bytes body: the feed document
+    :return: the feed values the document defines by Feed attribute name, and the document's entries as new items in document
+             order
+    :rtype: Tuple[Dict[str,object],List[Item]]
+    :raises ValueError: if the document is malformed or isn't an RSS 2.0, RSS 1.0 or Atom 1.0 feed
+    """
+    try:
+      events=ElementTree.iterparse(BytesIO(body),events=("start","end"))
+      event,root=next(events)
+      formats={"rss":      ("channel",       "item",       self._readRSSHeader, self._readRSSItem),
+               _RDF+"RDF": (_RSS10+"channel",_RSS10+"item",self._readRDFHeader, self._readRDFItem),
+               _ATOM+"feed":(_ATOM+"feed",   _ATOM+"entry",self._readAtomHeader,self._readAtomItem)}
+      if not root.tag in formats:
+        raise ValueError("unsupported document type %s"%root.tag)
+      channel_tag,item_tag,read_header,read_item=formats[root.tag]
+
+      header=None
+      items=[]
+      for event,element in events:
+        if event!="end":
+          continue
+        if element.tag==item_tag:
+          items.append(read_item(element))
+          element.clear()
+        elif element.tag==channel_tag:
+          header=read_header(element)
+    except ElementTree.ParseError as e:
+      raise ValueError("malformed document: %s"%e)
+    if header==None:
+      raise ValueError("document doesn't contain a channel")
+    return header,items
+
+  def _readRSSHeader(self, channel:ElementTree.Element) -> Dict[str,object]:
+    rv=self._readHeader(channel,"title","description","link","ttl")
+    rv["lastChanged"]=self._findDate(channel,_DC+"date") or \
+                      self._findDate(channel,"lastBuildDate")
+    return rv
+
+  def _readRSSItem(self, element:ElementTree.Element) -> Item:
+    item=Item()
+    item.title=self._findText(element,"title")
+    item.description=self._findText(element,"description")
+    if item.description==None:
+      item.description=self._findText(element,_CONTENT+"encoded")
+    item.itemURL=self._findText(element,"link")
+    guid=element.find("guid")
+    if guid!=None:
+      item.guid=self._getText(guid)
+      if item.itemURL==None and guid.get("isPermaLink","true")=="true":
+        item.itemURL=item.guid
+    item.publicationDate=self._findDate(element,_DC+"date") or \
+                         self._findDate(element,"pubDate")
+    return item
+
+  def _readRDFHeader(self, channel:ElementTree.Element) -> Dict[str,object]:
+    rv=self._readHeader(channel,_RSS10+"title",_RSS10+"description",_RSS10+"link",None)
+    rv["lastChanged"]=self._findDate(channel,_DC+"date")
+    return rv
+
+  def _readRDFItem(self, element:ElementTree.Element) -> Item:
+    item=Item()
+    item.title=self._findText(element,_RSS10+"title")
+    item.description=self._findText(element,_RSS10+"description")
+    if item.description==None:
+      item.description=self._findText(element,_CONTENT+"encoded")
+    item.itemURL=self._findText(element,_RSS10+"link")
+    item.guid=element.get(_RDF+"about")
+    item.publicationDate=self._findDate(element,_DC+"date")
+    return item
+
+  def _readAtomHeader(self, feed:ElementTree.Element) -> Dict[str,object]:
+    rv={"updateInterval":timedelta(minutes=60),
+        "title":self._findAtomText(feed,_ATOM+"title"),
+        "websiteURL":self._findAtomLink(feed) or self._findText(feed,_ATOM+"id"),
+        "lastChanged":self._findDate(feed,_ATOM+"updated")}
+    subtitle=self._findAtomText(feed,_ATOM+"subtitle")
+    if subtitle!=None:
+      rv["description"]=subtitle
+    return rv
+
+  def _readAtomItem(self, element:ElementTree.Element) -> Item:
+    item=Item()
+    item.title=self._findAtomText(element,_ATOM+"title")
+    item.description=self._findAtomText(element,_ATOM+"summary")
+    if item.description==None:
+      item.description=self._findAtomText(element,_ATOM+"content")
+    item.guid=self._findText(element,_ATOM+"id")
+    item.itemURL=self._findAtomLink(element) or item.guid
+    item.publicationDate=self._findDate(element,_ATOM+"updated") or \
+                         self._findDate(element,_ATOM+"published")
+    return item
+
+  def _readHeader(self, channel:ElementTree.Element, title:str, description:str, link:str,
+                  ttl:Union[str,None]) -> Dict[str,object]:
+    """reads the header values RSS 2.0 and RSS 1.0 have in common, the description is only included if there is one
+    """
+    minutes=self._findText(channel,ttl) if ttl!=None else None
+    rv={"updateInterval":timedelta(minutes=int(minutes) if minutes else 60),
+        "title":self._findText(channel,title),
+        "websiteURL":self._findText(channel,link)}
+    text=self._findText(channel,description)
+    if text!=None:
+      rv["description"]=text
+    return rv
+
+  def _findText(self, parent:ElementTree.Element, tag:str) -> Union[str,None]:
+    element=parent.find(tag)
+    return self._getText(element) if element!=None else None
+
+  def _getText(self, element:ElementTree.Element) -> str:
+    """returns an element's content, child elements (e.g. unescaped XHTML) are included as markup
+    """
+    text=(element.text or "")+"".join([ElementTree.tostring(child,encoding="unicode") for child in element])
+    return text.strip()
+
+  def _findAtomText(self, parent:ElementTree.Element, tag:str) -> Union[str,None]:
+    """returns an Atom text construct's content: XHTML content is returned as markup without its wrapping div
+    """
+    element=parent.find(tag)
+    if element==None:
+      return None
+    if element.get("type")!="xhtml":
+      return self._getText(element)
+    div=element.find(_XHTML+"div")
+    if div==None:
+      return self._getText(element)
+    for node in div.iter():
+      if isinstance(node.tag,str) and node.tag.startswith(_XHTML):
+        node.tag=node.tag[len(_XHTML):]
+    return self._getText(div)
+
+  def _findAtomLink(self, parent:ElementTree.Element) -> Union[str,None]:
+    for link in parent.findall(_ATOM+"link"):
+      if link.get("rel","alternate")=="alternate" and link.get("href"):
+        return link.get("href").strip()
+    return None
+
+  def _findDate(self, parent:ElementTree.Element, tag:str) -> Union[datetime,None]:
+    return self._dates.parse(self._findText(parent,tag))
+
+
+class TestXMLFeedParser(unittest.TestCase):
+  """Tests for the XMLFeedParser class. The feeds in testresources/feeds are covered by TestFeedSource.
+  """
+
+  def testAtomConstructs(self):
+    """Tests whether Atom text constructs, links and fallbacks are read like feedparser reads them.
+    """
+    body=b"""<feed xmlns="http://www.w3.org/2005/Atom">
+      <title type="html">a &amp;lt;b&amp;gt;</title><id>tag:feed</id><link rel="self" href="http://test/self"/>
+      <entry><title> t1 </title><id>urn:1</id><published>2018-01-01T00:00:00-01:30</published>
+        <content type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml"><p>hi <b>there</b></p></div></content></entry>
+      <entry><id>tag:2</id><summary type="html">&lt;p&gt;s&lt;/p&gt;</summary><content>c</content>
+        <link rel="enclosure" href="http://test/e"/><link href="http://test/2"/><updated>2018</updated></entry>
+    </feed>"""
+    header,items=XMLFeedParser().parse(body)
+    self.assertEqual("a &lt;b&gt;",header["title"])
+    self.assertEqual("tag:feed",header["websiteURL"],"feed ID should have been used without alternate link")
+    self.assertFalse("description" in header)
+    self.assertEqual(["t1",None],[item.title for item in items])
+    self.assertEqual(["<p>hi <b>there</b></p>","<p>s</p>"],[item.description for item in items])
+    self.assertEqual(["urn:1","http://test/2"],[item.itemURL for item in items])
+    self.assertEqual([datetime(2018,1,1,1,30),None],[item.publicationDate for item in items],
+                     "invalid dates should have been ignored")
+
+  def testRSSFallbacks(self):
+    """Tests whether RSS 2.0 guids are used as links only if they're permalinks.
+    """
+    body=b"""<rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/"><channel><title>x</title>
+      <item><guid isPermaLink="false">abc</guid><description> &lt;b&gt;d&lt;/b&gt; </description></item>
+      <item><guid>http://test/1</guid><content:encoded>c</content:encoded><pubDate>yesterday</pubDate></item>
+    </channel></rss>"""
+    header,items=XMLFeedParser().parse(body)
+    self.assertEqual(60*60,header["updateInterval"].total_seconds())
+    self.assertEqual([None,"http://test/1"],[item.itemURL for item in items])
+    self.assertEqual(["<b>d</b>","c"],[item.description for item in items])
+    self.assertEqual(None,items[1].publicationDate)
+
+  def testRefusals(self):
+    """Tests whether malformed documents and other formats are refused.
+    """
+    parser=XMLFeedParser()
+    for body in [b"<rss><channel><title>x</title><item>&nbsp;</item></channel></rss>",
+                 b"<rss><channel><title>unclosed</title>",
+                 b"<html><body>not a feed</body></html>",
+                 b"<rss version=\"2.0\"></rss>",
+                 b""]:
+      with self.assertRaises(ValueError,msg=body):
+        parser.parse(body)
@@ -2,5 +2,11 @@
 """
 
 from source.Source import *
+from source.HTTPClient import *
+from source.ItemMerger import *
+from source.DateParser import *
+from source.XMLFeedParser import *
+from source.LenientFeedParser import *
+from source.ParseStage import *
 from source.DummySource import *
 from source.FeedSource import *
@@ -1,4 +1,5 @@
 from abc import ABC
+from datetime import datetime, timedelta, timezone
 import unittest
 
 from storage import *
@@ -23,10 +24,286 @@ class BaseStorageTest(ABC):
     storage=self._createStorage()
 
     self.assertEqual([],  storage.getFeeds(),         "empty storage should not have any contents")
+    self.assertEqual([],  storage.getFeedHeaders(),   "empty storage should not have any feed headers")
     self.assertEqual(None,storage.getFeedByID(1),     "empty storage shouldn't find feed by ID")
     self.assertEqual([],  storage.getItemsByFeedID(1),"empty storage shouldn't find items by feed ID")
 
 
+  def testFeedHeaders(self):
+    """Tests whether feed headers are read without items, and load them on demand.
+    """
+    storage=self._createStorage()
+    feed=Feed(id=7,sourceName="test",feedURL="uri://test",title="feed title")
+    feed.items=[Item(id=71,title="item 1"),Item(id=72,title="item 2")]
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    self.assertEqual(None,storage.getFeedHeaderByID(8),"shouldn't find unknown feed")
+    headers=storage.getFeedHeaders()
+    self.assertEqual(1,len(headers),"should find stored feed")
+    for header in [headers[0],storage.getFeedHeaderByID(7)]:
+      self.assertEqual("feed title",header.title,"header should contain feed fields")
+      self.assertFalse(header.hasItemsLoaded(),"header shouldn't have loaded items")
+
+    header=headers[0]
+    header.title="changed title"
+    storage.acquireWriteLock()
+    storage.putFeed(header)
+    storage.releaseWriteLock()
+    self.assertFalse(header.hasItemsLoaded(),"storing the header shouldn't have loaded items")
+
+    stored=storage.getFeedByID(7)
+    self.assertEqual("changed title",stored.title,"header change should have been stored")
+    self.assertEqual(["item 1","item 2"],[item.title for item in stored.items],"storing the header should have kept items")
+    self.assertEqual(2,len(header.items),"accessing header's items should load them")
+
+
+  def testItemPagination(self):
+    """Tests whether items are ordered by publication date and can be limited to pages and time windows.
+    """
+    storage=self._createStorage()
+    feed=Feed(id=3,sourceName="test",feedURL="uri://test")
+    for hour in [4,1,None,3,5,2]:
+      item=Item(title="%s"%hour)
+      if hour!=None:
+        item.publicationDate=datetime(2018,10,1,hour+2,tzinfo=timezone(timedelta(hours=2)))
+      feed.items.append(item)
+    naive=Item(title="naive")
+    naive.publicationDate=datetime(2018,10,1,3,30)
+    feed.items.append(naive)
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    def titles(**kwargs):
+      rv=[item.title for item in storage.getItemsByFeedID(3,**kwargs)]
+      self.assertEqual(rv,[item.title for item in storage.iterItems(3,**kwargs)],"iterItems() should yield the same items")
+      return rv
+    hour=lambda hour: datetime(2018,10,1,hour,tzinfo=timezone.utc)
+
+    self.assertEqual(["None","1","2","3","naive","4","5"],titles(),      "items should be ordered by publication date")
+    self.assertEqual(["4","5"],                           titles(limit=2),"limit should return the most recent items")
+    self.assertEqual(["1","2","3","naive"],               titles(before=hour(4)))
+    self.assertEqual(["3","naive"],                       titles(before=hour(4),limit=2))
+    self.assertEqual(["2","3","naive","4","5"],           titles(since=hour(2)))
+    self.assertEqual(["2","3"],                           titles(since=hour(2),before=datetime(2018,10,1,3,30)))
+    self.assertEqual([],                                  titles(since=hour(6)))
+
+
+  def testIterFeeds(self):
+    """Tests whether iterFeeds() yields feeds without items ordered by ID, and whether feeds may be written while iterating.
+    """
+    storage=self._createStorage()
+    self.assertEqual([],list(storage.iterFeeds()),"empty storage shouldn't yield any feeds")
+    storage.acquireWriteLock()
+    for feed_id in [5,2,9,4]:
+      feed=Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id)
+      feed.items=[Item(title="item %d"%feed_id)]
+      storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    ids=[]
+    for feed in storage.iterFeeds():
+      self.assertFalse(feed.hasItemsLoaded(),"feeds should be yielded without items")
+      ids.append(feed.id)
+      feed.title="visited"
+      storage.acquireWriteLock(feed.id)
+      storage.putFeed(feed)
+      storage.releaseWriteLock(feed.id)
+    self.assertEqual([2,4,5,9],ids,"should have yielded all feeds once, ordered by ID")
+    self.assertEqual(["visited"]*4,[feed.title for feed in storage.getFeedHeaders()])
+    self.assertEqual(["item 9"],[item.title for item in storage.getFeedByID(9).items],"storing yielded feeds should keep items")
+    self.assertEqual(["item 5"],[item.title for item in storage.iterItems(5)])
+
+
+  def testSnapshotReads(self):
+    """Tests whether reads within (nested) snapshots work, and whether writes are visible once the snapshot ended.
+    """
+    storage=self._createStorage()
+    feed=Feed(id=6,sourceName="test",feedURL="uri://test",title="old")
+    feed.items=[Item(title="item")]
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    with storage.snapshot():
+      self.assertEqual("old",storage.getFeedHeaderByID(6).title)
+      with storage.snapshot():
+        self.assertEqual(["item"],[item.title for item in storage.getFeedByID(6).items],"nested snapshot should work")
+      self.assertEqual(["item"],[item.title for item in storage.iterItems(6)])
+      self.assertEqual([6],[feed.id for feed in storage.iterFeeds()])
+
+    feed.title="new"
+    storage.acquireWriteLock(6)
+    storage.putFeed(feed)
+    storage.releaseWriteLock(6)
+    self.assertEqual("new",storage.getFeedHeaderByID(6).title,"writes after the snapshot should be visible")
+
+
+  def testChangeEvents(self):
+    """Tests whether subscribers are notified of committed writes, and only of writes that changed something.
+    """
+    storage=self._createStorage()
+    events=[]
+    storage.subscribe(events.append)
+    changed=datetime(2018,10,1,12,tzinfo=timezone.utc)
+    feed=Feed(id=8,sourceName="test",feedURL="uri://test")
+    feed.lastChanged=changed
+    feed.items=[Item(id=81,title="item 1"),Item(id=82,title="item 2")]
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+    storage.putFeed(feed)
+    feed.items[1].title="changed"
+    storage.putFeed(feed)
+    storage.putItem(Item(id=83,feedID=8,title="item 3"))
+    storage.putItem(Item(id=91,feedID=9,title="unknown feed"))
+    storage.compactItems(8,RetentionPolicy(max_items=1),10)
+    storage.unsubscribe(events.append)
+    feed.title="unsubscribed"
+    storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    self.assertEqual([8]*4,[event.feedID for event in events],"should have published one event per changing write")
+    self.assertEqual([[81,82],[82],[83],[]],[event.itemIDs for event in events])
+    self.assertEqual([[],[],[],[81,82]],[sorted(event.removedItemIDs) for event in events])
+    self.assertEqual([changed]*4,[event.lastChanged for event in events])
+    sequences=[event.sequence for event in events]
+    self.assertEqual(sorted(set(sequences)),sequences,"sequence numbers should increase")
+
+  def testChangeLog(self):
+    """Tests whether logged changes can be read in batches, resuming after a sequence number, and whether they can be pruned.
+    """
+    storage=self._createStorage()
+    events=[]
+    storage.subscribe(events.append)
+    storage.acquireWriteLock()
+    for feed_id in range(1,6):
+      storage.putFeed(Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id))
+    storage.releaseWriteLock()
+
+    self.assertEqual(events[0:2],storage.getChanges(0,2),"logged changes should match published events")
+    self.assertEqual(events[2:5],storage.getChanges(events[1].sequence,10),"should resume after the given sequence number")
+    self.assertEqual([],storage.getChanges(events[4].sequence,10))
+
+    storage.acquireWriteLock()
+    self.assertEqual(3,storage.pruneChanges(2))
+    self.assertEqual(0,storage.pruneChanges(2),"nothing should be left to prune")
+    storage.releaseWriteLock()
+    self.assertEqual(events[3:5],storage.getChanges(0,10),"most recent changes should have been kept")
+
+  def testWriteTransaction(self):
+    """Tests whether writes within a write transaction are stored and published, and whether the write lock is released.
+    """
+    storage=self._createStorage()
+    events=[]
+    storage.subscribe(events.append)
+    with storage.writeTransaction():
+      for feed_id in range(1,4):
+        storage.putFeed(Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id,title="feed %d"%feed_id))
+      storage.putItem(Item(id=21,feedID=2,title="item"))
+    self.assertFalse(storage.isWriteLocked(),"write lock should have been released")
+    self.assertEqual(["feed 1","feed 2","feed 3"],[feed.title for feed in storage.getFeedHeaders()])
+    self.assertEqual(["item"],[item.title for item in storage.getItemsByFeedID(2)])
+    self.assertEqual([1,2,2,3],sorted([event.feedID for event in events]),"each write should have been published")
+
+    with self.assertRaises(RuntimeError):
+      with storage.writeTransaction(1):
+        raise RuntimeError()
+    self.assertFalse(storage.isWriteLocked(),"write lock should have been released after an error")
+
+
+  def testCompactItems(self):
+    """Tests whether compactItems() removes expired items in batches.
+    """
+    storage=self._createStorage()
+    now=datetime.now(timezone.utc)
+    feed=Feed(id=4,sourceName="test",feedURL="uri://test")
+    for days in [3,None,0,1,5,2,4]:
+      item=Item(title="%s"%days)
+      if days!=None:
+        item.publicationDate=now-timedelta(days=days,minutes=1)
+      feed.items.append(item)
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+
+    by_count=RetentionPolicy(max_items=4)
+    self.assertEqual(2,storage.compactItems(4,by_count,2),"first batch should be full")
+    self.assertEqual(1,storage.compactItems(4,by_count,2),"second batch should contain the remaining expired item")
+    self.assertEqual(0,storage.compactItems(4,by_count,2),"no expired items should be left")
+    self.assertEqual(["3","2","1","0"],[item.title for item in storage.getItemsByFeedID(4)],"most recent items should be kept")
+
+    self.assertEqual(3,storage.compactItems(4,RetentionPolicy(max_age=timedelta(days=1)),5),"should remove items by age")
+    self.assertEqual(["0"],[item.title for item in storage.getItemsByFeedID(4)])
+    self.assertEqual(0,storage.compactItems(4,RetentionPolicy(),5),"unlimited policy shouldn't remove anything")
+    storage.releaseWriteLock()
+
+  def testSearchItems(self):
+    """Tests whether searchItems() finds items by words in their title or description, and follows changes.
+    """
+    storage=self._createStorage()
+    feed=Feed(id=6,sourceName="test",feedURL="uri://test")
+    for title,description in [("Python release","notes"),
+                              ("Other news","mentions python once, with plenty of other words around it"),
+                              ("Gardening","nothing to see"),
+                              ("Python, Python and python","more python")]:
+      item=Item(title=title)
+      item.description=description
+      feed.items.append(item)
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+    other=Feed(id=7,sourceName="test",feedURL="uri://other")
+    other.items=[Item(title="python elsewhere")]
+    storage.putFeed(other)
+
+    titles=lambda query,limit=10: [item.title for item in storage.searchItems(query,limit)]
+    self.assertEqual("Python, Python and python",titles("PYTHON")[0],"most relevant item should come first")
+    self.assertEqual(4,len(titles("python")),"should find items in all feeds")
+    self.assertEqual(["Other news"],titles("python -words?"),"all words should need to match, ignoring punctuation")
+    self.assertEqual(2,len(titles("python",2)),"results should be limited")
+    self.assertEqual([],titles("pyth"),"partial words shouldn't match")
+    self.assertEqual([],titles(" ,. "),"queries without words shouldn't find anything")
+
+    stored=storage.getFeedByID(6)
+    stored.items[2].title="Pruning"
+    storage.putFeed(stored)
+    self.assertEqual([],titles("gardening"),"changed items should be reindexed")
+    self.assertEqual(["Pruning"],titles("pruning"))
+
+    storage.compactItems(6,RetentionPolicy(max_items=1),10)
+    self.assertEqual(["Python, Python and python","python elsewhere"],sorted(titles("python")),"removed items shouldn't be found")
+    storage.releaseWriteLock()
+
+  def testMarkRefreshed(self):
+    """Tests whether refresh times, validators and fingerprints are stored, and whether marking a feed refreshed doesn't log a
+    change.
+    """
+    storage=self._createStorage()
+    feed=Feed(id=4,sourceName="test",feedURL="uri://test",title="feed")
+    feed.etag='"abc"'
+    feed.lastModified="Sat, 29 Sep 2018 10:34:56 GMT"
+    feed.contentHash="0123abcd"
+    feed.items=[Item(id=41,title="item")]
+    feed.items[0].fingerprint="4567cdef"
+    refreshed=datetime(2018,10,1,12,tzinfo=timezone.utc)
+    with storage.writeTransaction():
+      storage.putFeed(feed)
+    events=[]
+    storage.subscribe(events.append)
+    with storage.writeTransaction():
+      storage.markRefreshed(4,refreshed)
+      storage.markRefreshed(5,refreshed)
+
+    stored=storage.getFeedHeaderByID(4)
+    self.assertEqual(refreshed,stored.lastRefreshed)
+    self.assertEqual(('"abc"',"Sat, 29 Sep 2018 10:34:56 GMT"),(stored.etag,stored.lastModified),"validators should be stored")
+    self.assertEqual("0123abcd",stored.contentHash,"content hash should be stored")
+    self.assertEqual("feed",stored.title,"other fields should have been kept")
+    self.assertEqual([("item","4567cdef")],[(item.title,item.fingerprint) for item in stored.items])
+    self.assertEqual(None,storage.getFeedHeaderByID(5),"unknown feeds should have been ignored")
+    self.assertEqual([],events,"refreshing shouldn't count as a change")
+
+
   def testPutFeed(self):
     """Tests whether .putFeed() stores data independently from live objects.
     """
@@ -74,3 +351,26 @@ class BaseStorageTest(ABC):
     self.assertEqual(11,stored.items[0].id,"pre-existing item should have same ID as before")
     self.assertEqual(12,stored.items[1].id,"manually stored item should have expected ID")
 
+
+  def testDirtyTracking(self):
+    """Tests whether stored and loaded objects are marked as unchanged.
+    """
+    storage=self._createStorage()
+    feed=Feed(id=5,sourceName="test",feedURL="uri://test")
+    feed.items=[Item(id=51,feedID=5)]
+    self.assertTrue(feed.isDirty(),         "new feed should be dirty")
+    self.assertTrue(feed.items[0].isDirty(),"new item should be dirty")
+
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+    storage.releaseWriteLock()
+    self.assertFalse(feed.isDirty(),         "stored feed should be clean")
+    self.assertFalse(feed.items[0].isDirty(),"stored item should be clean")
+
+    stored=storage.getFeedByID(5)
+    self.assertFalse(stored.isDirty(),         "loaded feed should be clean")
+    self.assertFalse(stored.items[0].isDirty(),"loaded item should be clean")
+    stored.items[0].title=None
+    self.assertFalse(stored.items[0].isDirty(),"assigning an unchanged value shouldn't mark item as dirty")
+    stored.items[0].title="changed"
+    self.assertTrue(stored.items[0].isDirty(),"changing a value should mark item as dirty")
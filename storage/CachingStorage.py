@@ -0,0 +1,401 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import copy
+from datetime import datetime
+import os
+from threading import local, Lock
+from typing import Iterator, List, Union
+import unittest
+
+from domain import *
+from storage import *
+
+
+class CachingStorage(Storage):
+  """Read-through cache for any other storage implementation.
+
+  Feed headers and item lists read by ID are kept in a size-bounded LRU cache, so repeated reads of unchanged feeds don't reach
+  the wrapped storage. Writes go to the wrapped storage and then drop all cached entries of the written feed, writes within
+  .writeTransaction() once the transaction is committed. Reads that started before a write never add their results to the
+  cache afterwards.
+
+  Cached entries may be newer than a snapshot of the wrapped storage, so reads within a snapshot bypass the cache and read from
+  the wrapped storage's snapshot instead.
+
+  The cache subscribes to the wrapped storage's change events, so writes that bypass this class invalidate cached data too.
+
+  Iterating a feed's items reads through the cache as well, while iterating feeds is passed on to the wrapped storage. All
+  other methods, including the write lock, are passed on to the wrapped storage. Returned objects are copies: changing them
+  doesn't affect cached data.
+  """
+
+  hits=0     #: the number of reads answered from the cache
+  misses=0   #: the number of reads passed on to the wrapped storage
+
+  _storage=None
+  _maxEntries=None
+  _entries=None
+  _keysByFeed=None
+  _generations=None
+  _lock=None
+  _threadlocal=None
+
+  def __init__(self, storage:Storage, max_entries:int=1000):
+    """
+    :param Storage storage: the storage to read from and write to
+    :param int max_entries: the maximum number of cached feed headers and item lists (default: 1000)
+    """
+    if max_entries<1:
+      raise ValueError("cache size must be at least 1, got %d"%max_entries)
+    self._storage=storage
+    self._maxEntries=max_entries
+    self._entries=OrderedDict()
+    self._keysByFeed={}
+    self._generations={}
+    self._lock=Lock()
+    self._threadlocal=local()
+    storage.subscribe(self._onChange)
+    self.hits=0
+    self.misses=0
+
+  def acquireWriteLock(self, feed_id:Union[int,None]=None):
+    """Gets the wrapped storage's write lock.
+    """
+    return self._storage.acquireWriteLock(feed_id)
+
+  def releaseWriteLock(self, feed_id:Union[int,None]=None):
+    """Releases the wrapped storage's write lock.
+    """
+    return self._storage.releaseWriteLock(feed_id)
+
+  def getWriteLockGroup(self, feed_id:int) -> Union[int,None]:
+    """Returns the wrapped storage's write lock group for the given feed.
+    """
+    return self._storage.getWriteLockGroup(feed_id)
+
+  def isWriteLocked(self, feed_id:Union[int,None]=None):
+    """Checks whether the wrapped storage is currently write-locked.
+
+    :return bool: whether a write lock is in place
+    """
+    return self._storage.isWriteLocked(feed_id)
+
+  @contextmanager
+  def writeTransaction(self, feed_id:Union[int,None]=None):
+    """context manager for writes, using the wrapped storage's transaction: written feeds' cached entries are dropped once it's
+    committed, reads before that may still see (and cache) the previous state
+    """
+    written=set()
+    self._threadlocal.written=written
+    try:
+      with self._storage.writeTransaction(feed_id):
+        yield self
+    finally:
+      self._threadlocal.written=None
+      for id in written:
+        self.invalidate(id)
+
+  @contextmanager
+  def snapshot(self):
+    """context manager for consistent reads: the current thread reads from the wrapped storage's snapshot, bypassing the cache
+    """
+    if getattr(self._threadlocal,"snapshot",False):
+      yield self
+      return
+    with self._storage.snapshot():
+      self._threadlocal.snapshot=True
+      try:
+        yield self
+      finally:
+        self._threadlocal.snapshot=False
+
+  def snapshotBlocksWriters(self) -> bool:
+    """Checks whether the wrapped storage's snapshots block writers.
+    """
+    return self._storage.snapshotBlocksWriters()
+
+  def subscribe(self, callback) -> None:
+    """Registers a function for the wrapped storage's change events.
+    """
+    self._storage.subscribe(callback)
+
+  def unsubscribe(self, callback) -> None:
+    """Removes a function registered with .subscribe().
+    """
+    self._storage.unsubscribe(callback)
+
+  def _onChange(self, event:ChangeEvent):
+    self.invalidate(event.feedID)
+
+  def getChanges(self, after:int, limit:int) -> List[ChangeEvent]:
+    """returns logged changes, read from the wrapped storage
+    """
+    return self._storage.getChanges(after,limit)
+
+  def pruneChanges(self, keep:int) -> int:
+    """deletes old logged changes in the wrapped storage
+    """
+    return self._storage.pruneChanges(keep)
+
+  def getStatistics(self) -> dict:
+    """Returns the cache's hit and miss counters and its current size.
+
+    :return: a dict with the keys "hits", "misses" and "entries"
+    :rtype: dict
+    """
+    with self._lock:
+      return {"hits":self.hits,"misses":self.misses,"entries":len(self._entries)}
+
+  def getFeeds(self) -> List[Feed]:
+    """returns all feeds including their items, read from the wrapped storage
+    """
+    return self._storage.getFeeds()
+
+  def getFeedHeaders(self) -> List[Feed]:
+    """returns all feeds without their items, read from the wrapped storage
+    """
+    return self._storage.getFeedHeaders()
+
+  def iterFeeds(self) -> Iterator[Feed]:
+    """yields all feeds without their items, read from the wrapped storage
+    """
+    return self._storage.iterFeeds()
+
+  def getFeedByID(self, id:int) -> Union[Feed,None]:
+    """looks up an individual feed by ID, using cached data if possible
+    """
+    feed=self.getFeedHeaderByID(id)
+    if feed==None:
+      return None
+    feed.items=self.getItemsByFeedID(id)
+    return feed
+
+  def getFeedHeaderByID(self, id:int) -> Union[Feed,None]:
+    """looks up an individual feed by ID without its items, using cached data if possible
+    """
+    header=self._read(id,("header",id),lambda: self._storage.getFeedHeaderByID(id))
+    if header==None:
+      return None
+    rv=copy(header)
+    rv.setItemLoader(lambda: self.getItemsByFeedID(id))
+    return rv
+
+  def getItemsByFeedID(self, feed_id:int, limit:Union[int,None]=None, before:Union[datetime,None]=None,
+                       since:Union[datetime,None]=None) -> List[Item]:
+    """looks up a feed's items, using cached data if the same items were read before
+    """
+    key=("items",feed_id,limit,before,since)
+    items=self._read(feed_id,key,lambda: tuple(self._storage.getItemsByFeedID(feed_id,limit=limit,before=before,since=since)))
+    return [copy(item) for item in items]
+
+  def _read(self, feed_id:int, key:tuple, loader):
+    if getattr(self._threadlocal,"snapshot",False):
+      return loader()
+    with self._lock:
+      if key in self._entries:
+        self._entries.move_to_end(key)
+        self.hits+=1
+        return self._entries[key]
+      self.misses+=1
+      generation=self._generations.get(feed_id,0)
+
+    value=loader()
+
+    with self._lock:
+      if self._generations.get(feed_id,0)==generation:
+        self._entries[key]=value
+        self._keysByFeed.setdefault(feed_id,set()).add(key)
+        while len(self._entries)>self._maxEntries:
+          self._forget(self._entries.popitem(last=False)[0])
+    return value
+
+  def _forget(self, key:tuple):
+    keys=self._keysByFeed[key[1]]
+    keys.discard(key)
+    if len(keys)<1:
+      del self._keysByFeed[key[1]]
+
+  def invalidate(self, feed_id:int):
+    """Drops all cached data of a feed.
+
+    Writes through this storage do this automatically, call this only if the wrapped storage was written to directly.
+
+    :param int feed_id: the feed ID to drop data for
+    """
+    with self._lock:
+      self._generations[feed_id]=self._generations.get(feed_id,0)+1
+      for key in self._keysByFeed.pop(feed_id,set()):
+        del self._entries[key]
+
+  def _invalidateWritten(self, feed_id:Union[int,None]):
+    """drops a written feed's cached data: right away, or when the current thread's write transaction ends
+    """
+    if feed_id==None:
+      return
+    written=getattr(self._threadlocal,"written",None)
+    if written!=None:
+      written.add(feed_id)
+    else:
+      self.invalidate(feed_id)
+
+  def putFeed(self, feed:Feed) -> None:
+    """stores a feed in the wrapped storage and drops its cached data
+    """
+    try:
+      self._storage.putFeed(feed)
+    finally:
+      self._invalidateWritten(feed.id)
+
+  def markRefreshed(self, feed_id:int, last_refreshed:datetime) -> None:
+    """stores a feed's refresh time in the wrapped storage and drops the feed's cached data
+    """
+    try:
+      self._storage.markRefreshed(feed_id,last_refreshed)
+    finally:
+      self._invalidateWritten(feed_id)
+
+  def putItem(self, item:Item) -> None:
+    """stores an item in the wrapped storage and drops its feed's cached data
+    """
+    try:
+      self._storage.putItem(item)
+    finally:
+      self._invalidateWritten(item.feedID)
+
+  def compactItems(self, feed_id:int, policy:RetentionPolicy, limit:int) -> int:
+    """compacts a feed's items in the wrapped storage and drops the feed's cached data
+    """
+    try:
+      return self._storage.compactItems(feed_id,policy,limit)
+    finally:
+      self._invalidateWritten(feed_id)
+
+  def reclaimSpace(self, pages:int) -> int:
+    """releases unused space in the wrapped storage
+    """
+    return self._storage.reclaimSpace(pages)
+
+  def searchItems(self, query:str, limit:int) -> List[Item]:
+    """searches items in the wrapped storage
+    """
+    return self._storage.searchItems(query,limit)
+
+
+class TestCachingStorage(BaseStorageTest,unittest.TestCase):
+  """Tests for the CachingStorage class.
+  """
+
+  def _createStorage(self):
+    return CachingStorage(InMemoryStorage())
+
+  def testHitsAndInvalidation(self):
+    """Tests whether repeated reads are answered from the cache until the feed is written to.
+    """
+    storage=self._createStorage()
+    storage.acquireWriteLock()
+    for feed_id in [1,2]:
+      feed=Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id,title="feed %d"%feed_id)
+      feed.items=[Item(title="item")]
+      storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    for tc in range(0,3):
+      self.assertEqual("feed 1",storage.getFeedByID(1).title)
+      self.assertEqual("feed 2",storage.getFeedHeaderByID(2).title)
+    self.assertEqual({"hits":6,"misses":3,"entries":3},storage.getStatistics(),"repeated reads should have been cached")
+
+    storage.acquireWriteLock()
+    storage.putItem(Item(feedID=1,title="added"))
+    storage.releaseWriteLock()
+    self.assertEqual(1,storage.getStatistics()["entries"],"only the written feed's entries should have been dropped")
+    self.assertEqual(["item","added"],[item.title for item in storage.getFeedByID(1).items],"should read the new item")
+    self.assertEqual("feed 2",storage.getFeedHeaderByID(2).title)
+    self.assertEqual(7,storage.hits)
+
+  def testCopies(self):
+    """Tests whether changing returned objects doesn't affect cached data.
+    """
+    storage=self._createStorage()
+    feed=Feed(id=1,sourceName="test",feedURL="uri://test",title="title")
+    feed.items=[Item(title="item")]
+    storage.putFeed(feed)
+
+    read=storage.getFeedByID(1)
+    read.title="changed"
+    read.items[0].title="changed"
+    read.items.append(Item())
+    cached=storage.getFeedByID(1)
+    self.assertEqual(2,storage.hits,"second read should have been cached")
+    self.assertEqual("title",cached.title)
+    self.assertEqual(["item"],[item.title for item in cached.items])
+
+  def testEviction(self):
+    """Tests whether the least recently used entries are dropped once the cache is full.
+    """
+    storage=CachingStorage(InMemoryStorage(),2)
+    for feed_id in [1,2,3]:
+      storage.putFeed(Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id))
+    storage.getFeedHeaderByID(1)
+    storage.getFeedHeaderByID(2)
+    storage.getFeedHeaderByID(1)
+    storage.getFeedHeaderByID(3)
+    self.assertEqual(2,storage.getStatistics()["entries"],"cache should have been limited")
+    storage.getFeedHeaderByID(1)
+    self.assertEqual(2,storage.hits,"recently used entry should have been kept")
+    storage.getFeedHeaderByID(2)
+    self.assertEqual(4,storage.misses,"least recently used entry should have been dropped")
+
+  def testWrappedWritesInvalidate(self):
+    """Tests whether writes to the wrapped storage drop cached data via change events.
+    """
+    storage=self._createStorage()
+    storage.putFeed(Feed(id=1,sourceName="test",feedURL="uri://test",title="old"))
+    self.assertEqual("old",storage.getFeedHeaderByID(1).title)
+    storage._storage.putFeed(Feed(id=1,sourceName="test",feedURL="uri://test",title="new"))
+    self.assertEqual("new",storage.getFeedHeaderByID(1).title,"cached header should have been dropped")
+
+  def testNoStaleEntries(self):
+    """Tests whether reads that overlap a write don't add outdated data to the cache.
+    """
+    storage=self._createStorage()
+    storage.putFeed(Feed(id=1,sourceName="test",feedURL="uri://test",title="old"))
+
+    def write_during_read():
+      header=storage._storage.getFeedHeaderByID(1)
+      storage.putFeed(Feed(id=1,sourceName="test",feedURL="uri://test",title="new"))
+      return header
+    self.assertEqual("old",storage._read(1,("header",1),write_during_read).title)
+    self.assertEqual("new",storage.getFeedHeaderByID(1).title,"outdated read shouldn't have been cached")
+
+  def testInvalidationOnCommit(self):
+    """Tests whether reads within a write transaction can't keep outdated data cached after the transaction is committed.
+    """
+    filename="test."+__name__+".sqlite"
+    storage=CachingStorage(SQLiteStorage(filename,wal=True)) #WAL readers see the last committed state during writes
+    try:
+      with storage.writeTransaction():
+        storage.putFeed(Feed(id=1,sourceName="test",feedURL="uri://test"))
+      refreshed=datetime(2018,10,1,12,0,0)
+      with storage.writeTransaction(1):
+        storage.markRefreshed(1,refreshed)
+        self.assertEqual(None,storage.getFeedHeaderByID(1).lastRefreshed,"self-check: write shouldn't be visible yet")
+      self.assertEqual(refreshed,storage.getFeedHeaderByID(1).lastRefreshed,"committed write should have been read")
+    finally:
+      storage._storage.close()
+      for suffix in ["","-wal","-shm"]:
+        if os.path.isfile(filename+suffix):
+          os.remove(filename+suffix)
+
+  def testSnapshotBypassesCache(self):
+    """Tests whether reads within a snapshot come from the wrapped storage's snapshot instead of the cache.
+    """
+    storage=self._createStorage()
+    storage.putFeed(Feed(id=1,sourceName="test",feedURL="uri://test",title="old"))
+    storage.getFeedHeaderByID(1)
+
+    with storage.snapshot():
+      storage.putFeed(Feed(id=1,sourceName="test",feedURL="uri://test",title="new"))
+      self.assertEqual("old",storage.getFeedHeaderByID(1).title,"snapshot shouldn't see the write")
+      self.assertEqual(0,storage.getStatistics()["entries"],"snapshot reads shouldn't have been cached")
+    self.assertEqual("new",storage.getFeedHeaderByID(1).title)
+    self.assertEqual({"hits":0,"misses":2,"entries":1},storage.getStatistics())
@@ -0,0 +1,37 @@
+from datetime import datetime
+from typing import List, Union
+
+
+class ChangeEvent:
+  """Data class describing a committed write to a feed, see Storage.subscribe() and Storage.getChanges().
+
+  Sequence numbers increase with every change in commit order, so consumers can resume from the last sequence number they
+  processed.
+  """
+  sequence=None       #: the change's sequence number, as int
+  feedID=None         #: the changed feed's ID, as int
+  itemIDs=None        #: the IDs of items added or changed, as list of int
+  removedItemIDs=None #: the IDs of items removed (e.g. by compaction), as list of int
+  lastChanged=None    #: the feed's lastChanged value after the change, as datetime.datetime
+
+  def __init__(self, sequence:int, feedID:int, itemIDs:Union[List[int],None]=None,
+               removedItemIDs:Union[List[int],None]=None, lastChanged:Union[datetime,None]=None):
+    """
+    :param int sequence: the change's sequence number
+    :param int feedID: the changed feed's ID
+    :param Union[List[int],None] itemIDs: optional: the IDs of items added or changed
+    :param Union[List[int],None] removedItemIDs: optional: the IDs of items removed
+    :param Union[datetime,None] lastChanged: optional: the feed's lastChanged value after the change
+    """
+    self.sequence=sequence
+    self.feedID=feedID
+    self.itemIDs=itemIDs or []
+    self.removedItemIDs=removedItemIDs or []
+    self.lastChanged=lastChanged
+
+  def __eq__(self, other):
+    return isinstance(other,ChangeEvent) and vars(self)==vars(other)
+
+  def __repr__(self):
+    return "ChangeEvent(sequence=%s, feedID=%s, itemIDs=%s, removedItemIDs=%s, lastChanged=%s)"\
+           %(self.sequence,self.feedID,self.itemIDs,self.removedItemIDs,repr(self.lastChanged))
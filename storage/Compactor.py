@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta, timezone
+import threading
+from time import sleep
+import unittest
+from unittest.mock import patch
+
+from domain import *
+import logger
+from storage import *
+
+
+log=logger.get_logger(__name__)
+
+
+class Compactor(threading.Thread):
+  """Background task applying a retention policy to all stored feeds.
+
+  Expired items are removed in small batches. The storage's write lock is released after every batch, so feed updates never
+  wait for long. Once items were removed, the freed space is returned to the file system in steps as well.
+
+  Sources need the same policy to keep items that are still listed upstream after they expired from being added again on
+  the next feed refresh, see FeedSource and ItemMerger.
+
+  Each run also prunes the storage's change log, keeping the most recent changes only.
+
+  Failed runs are logged, compaction continues with the next run.
+  """
+
+  interval=3600        #: the time between compaction runs, in seconds
+  batchSize=500        #: the maximum number of items to remove while holding the write lock
+  vacuumPages=256      #: the maximum number of free pages to release while holding the write lock
+  vacuumSteps=64       #: the maximum number of times to release free pages per run, the rest is released in later runs
+  changeLogSize=100000 #: the number of most recent change log entries to keep
+
+  _storage=None
+  _policy=None
+  _freePages=0
+
+  def __init__(self, storage:Storage, policy:RetentionPolicy):
+    """
+    :param Storage storage: the storage to compact
+    :param RetentionPolicy policy: the retention policy to apply
+    """
+    super().__init__(daemon=True)
+    self._storage=storage
+    self._policy=policy
+
+  def run(self, iteration_limit:int=0) -> None:
+    """Starts compacting periodically.
+
+    This is a thread: unless you're testing you'll probably want to call .start() instead.
+
+    :param int iteration_limit: how many compaction runs to perform, <=0 for no limit.
+    """
+    i=0
+    while True:
+      try:
+        removed=self.compactAll()
+        if removed>0:
+          log.info("compaction removed %d items",removed)
+      except Exception:
+        log.exception("compaction failed")
+      i+=1
+      if iteration_limit>0 and i>=iteration_limit:
+        break
+      sleep(self.interval)
+
+  def compactAll(self) -> int:
+    """Applies the retention policy to all feeds once.
+
+    :return: the number of items removed
+    :rtype: int
+    """
+    total=0
+    if not self._policy.isUnlimited():
+      for feed in self._storage.iterFeeds():
+        while True:
+          removed=self._withWriteLock(feed.id,self._storage.compactItems,feed.id,self._policy,self.batchSize)
+          total+=removed
+          if removed<self.batchSize:
+            break
+
+    pruned=self._withWriteLock(None,self._storage.pruneChanges,self.changeLogSize)
+    if pruned>0:
+      log.info("pruned %d change log entries",pruned)
+
+    if total>0 or pruned>0 or self._freePages>0:
+      self._reclaimSpace()
+    return total
+
+  def _reclaimSpace(self):
+    """releases free pages in up to vacuumSteps steps, stopping early if a step didn't release any pages
+    """
+    left=None
+    for step in range(0,self.vacuumSteps):
+      previous=left
+      left=self._withWriteLock(None,self._storage.reclaimSpace,self.vacuumPages)
+      if left<1 or left==previous:
+        break
+    self._freePages=left
+
+  def _withWriteLock(self, feed_id, method, *args):
+    self._storage.acquireWriteLock(feed_id)
+    try:
+      return method(*args)
+    finally:
+      self._storage.releaseWriteLock(feed_id)
+
+
+class TestCompactor(unittest.TestCase):
+  """Tests for the Compactor class.
+  """
+
+  def testCompactAll(self):
+    """Tests whether all feeds are compacted in batches, and whether space is reclaimed afterwards.
+    """
+    storage=SQLiteStorage(":memory:")
+    now=datetime.now(timezone.utc)
+    storage.acquireWriteLock()
+    for feed_id in [1,2]:
+      feed=Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id)
+      for tc in range(0,30):
+        item=Item(title="item %d"%tc)
+        item.description="x"*2000
+        item.publicationDate=now-timedelta(days=tc)
+        feed.items.append(item)
+      storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    compactor=Compactor(storage,RetentionPolicy(max_items=20,max_age=timedelta(days=5,hours=12)))
+    compactor.batchSize=7
+    compactor.changeLogSize=2
+    self.assertEqual(48,compactor.compactAll(),"should have removed all but the 6 most recent items per feed")
+    self.assertEqual(6,len(storage.getItemsByFeedID(1)))
+    self.assertEqual(6,len(storage.getItemsByFeedID(2)))
+
+    conn=storage._getConnection()
+    self.assertEqual(0,conn.execute("PRAGMA freelist_count").fetchone()[0],"free pages should have been released")
+    self.assertEqual(0,conn.execute("SELECT COUNT(*) FROM archivedItems").fetchone()[0],"items shouldn't have been archived")
+    self.assertEqual(2,len(storage.getChanges(0,100)),"change log should have been pruned")
+    self.assertFalse(storage.isWriteLocked(),"write lock should have been released")
+
+  def testArchive(self):
+    """Tests whether expired items are archived if the policy says so.
+    """
+    storage=SQLiteStorage(":memory:")
+    feed=Feed(id=1,sourceName="test",feedURL="uri://test")
+    feed.items=[Item(title="item %d"%tc) for tc in range(0,5)]
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    Compactor(storage,RetentionPolicy(max_items=2,archive=True)).compactAll()
+    self.assertEqual(["item 3","item 4"],[item.title for item in storage.getItemsByFeedID(1)])
+    archived=storage._getConnection().execute("SELECT title FROM archivedItems ORDER BY id").fetchall()
+    self.assertEqual([("item 0",),("item 1",),("item 2",)],archived,"expired items should have been archived")
+
+
+  def testFailures(self):
+    """Tests whether failed runs are logged without stopping compaction, and whether releasing space is bounded per run.
+    """
+    storage=SQLiteStorage(":memory:")
+    compactor=Compactor(storage,RetentionPolicy())
+    compactor.interval=0
+    with patch.object(compactor,"compactAll",side_effect=[IOError("disk failure"),0]) as compact_all:
+      compactor.run(2)
+    self.assertEqual(2,compact_all.call_count,"should have continued after the failed run")
+
+    compactor.vacuumSteps=3
+    with patch.object(storage,"reclaimSpace",side_effect=[10,9,8,7,7]) as reclaim_space, \
+         patch.object(storage,"pruneChanges",return_value=1):
+      compactor.compactAll()
+      self.assertEqual(3,reclaim_space.call_count,"should have stopped after vacuumSteps steps")
+      compactor.compactAll()
+      self.assertEqual(5,reclaim_space.call_count,"should have continued in the next run, stopping without progress")
+    self.assertFalse(storage.isWriteLocked(),"write lock should have been released")
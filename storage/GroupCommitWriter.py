@@ -0,0 +1,215 @@
+from concurrent.futures import Future
+import os
+import queue
+import sqlite3
+from threading import Barrier, Thread
+from time import time
+from typing import List, Tuple, Union
+import unittest
+
+from domain import *
+from logger import get_logger
+from storage import *
+
+
+log=get_logger(__name__)
+
+
+class GroupCommitWriter(Thread):
+  """Background thread storing feeds handed over by other threads, several feeds per write transaction.
+
+  Worker threads pass feeds to .putFeed() (or .submit()) instead of writing to the storage themselves. The writer collects
+  pending feeds until either maxBatchSize feeds are waiting or maxDelay seconds passed since the first one arrived, then
+  stores all of them in a single write transaction: the cost of committing, e.g. syncing SQLite's file, is shared by the
+  whole batch. Storages with separate locks for groups of feeds (see Storage.getWriteLockGroup()) get one transaction per
+  group instead, so other groups' writers don't have to wait. New feeds are stored in a transaction locking all feeds.
+
+  If storing a batch fails, its feeds are stored again one transaction each, so only the feeds causing errors fail.
+
+  Call .start() before submitting feeds and .stop() to flush pending feeds and end the thread.
+  """
+
+  maxBatchSize=None #: the maximum number of feeds to store in one transaction
+  maxDelay=None     #: the maximum time in seconds a feed waits for others to join its batch
+
+  _storage=None
+  _queue=None
+
+  def __init__(self, storage:Storage, max_batch_size:int=100, max_delay:float=0.005):
+    """
+    :param Storage storage: the storage to write to
+    :param int max_batch_size: optional: the maximum number of feeds to store in one transaction
+    :param float max_delay: optional: the maximum time in seconds to wait for more feeds before committing
+    """
+    super().__init__(name="GroupCommitWriter",daemon=True)
+    if max_batch_size<1:
+      raise ValueError("batch size must be at least 1")
+    self._storage=storage
+    self._queue=queue.Queue()
+    self.maxBatchSize=max_batch_size
+    self.maxDelay=max_delay
+
+  def submit(self, feed:Feed) -> Future:
+    """Queues a feed for storing and returns immediately.
+
+    The feed mustn't be changed until the returned future is done.
+
+    :param Feed feed: the feed to store
+    :return: a future resolving to None once the feed is committed, or to the exception storing it raised
+    :rtype: concurrent.futures.Future
+    """
+    future=Future()
+    self._queue.put((feed,future))
+    return future
+
+  def putFeed(self, feed:Feed, timeout:Union[float,None]=None) -> None:
+    """Stores a feed with the next batch, blocking until it's committed.
+
+    :param Feed feed: the feed to store
+    :param Union[float,None] timeout: optional: the maximum time in seconds to wait
+    :raises Exception: whatever storing the feed raised
+    """
+    return self.submit(feed).result(timeout)
+
+  def stop(self):
+    """Stores all pending feeds and ends the writer thread.
+    """
+    self._queue.put(None)
+    self.join()
+
+  def run(self):
+    running=True
+    while running:
+      entry=self._queue.get()
+      if entry==None:
+        break
+      batch=[entry]
+      deadline=time()+self.maxDelay
+      while len(batch)<self.maxBatchSize:
+        try:
+          entry=self._queue.get(timeout=max(0,deadline-time()))
+        except queue.Empty:
+          break
+        if entry==None:
+          running=False
+          break
+        batch.append(entry)
+      self._writeBatch(batch)
+
+  def _writeBatch(self, batch:List[Tuple[Feed,Future]]):
+    groups={}
+    for entry in batch:
+      feed_id=entry[0].id
+      groups.setdefault(None if feed_id==None else self._storage.getWriteLockGroup(feed_id),[]).append(entry)
+    for group,entries in groups.items():
+      self._writeGroup(None if group==None else entries[0][0].id,entries)
+
+  def _writeGroup(self, lock_id:Union[int,None], batch:List[Tuple[Feed,Future]]):
+    """stores feeds sharing a write lock in a single transaction, locked for the given feed ID
+    """
+    try:
+      with self._storage.writeTransaction(lock_id):
+        for feed,future in batch:
+          self._storage.putFeed(feed)
+    except Exception as e:
+      if len(batch)>1:
+        log.warning("storing batch of %d feeds failed, storing them separately",len(batch))
+        for entry in batch:
+          self._writeGroup(lock_id,[entry])
+      else:
+        log.warning("storing feed %s failed: %s",batch[0][0].id,e)
+        batch[0][1].set_exception(e)
+      return
+    for feed,future in batch:
+      future.set_result(None)
+
+
+class TestGroupCommitWriter(unittest.TestCase):
+  """Tests for the GroupCommitWriter class.
+  """
+
+  _filename="test."+__name__+".sqlite"
+
+  def setUp(self):
+    if os.path.isfile(self._filename):
+      os.remove(self._filename)
+
+  def tearDown(self):
+    if os.path.isfile(self._filename):
+      os.remove(self._filename)
+
+  def testBatches(self):
+    """Tests whether feeds submitted by several threads at once are stored in shared transactions.
+    """
+    storage=SQLiteStorage(self._filename) #we're writing from another thread, this requires a local file
+    transactions=[]
+    original=storage.writeTransaction
+    def counting_transaction(feed_id=None):
+      transactions.append(feed_id)
+      return original(feed_id)
+    storage.writeTransaction=counting_transaction
+
+    writer=GroupCommitWriter(storage,max_batch_size=4,max_delay=0.5)
+    writer.start()
+    barrier=Barrier(8)
+    def work(feed_id):
+      barrier.wait()
+      writer.putFeed(Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id))
+    threads=[Thread(target=work,args=(feed_id,)) for feed_id in range(1,9)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    writer.stop()
+
+    self.assertEqual(list(range(1,9)),[feed.id for feed in storage.getFeedHeaders()],"all feeds should have been stored")
+    self.assertEqual(2,len(transactions),"feeds should have been stored in full batches")
+    self.assertFalse(writer.is_alive(),"writer should have stopped")
+    storage.close()
+
+  def testShardedBatches(self):
+    """Tests whether batches are split into one transaction per shard, and new feeds are stored locking all shards.
+    """
+    pattern="test."+__name__+".%d.sqlite"
+    storage=ShardedSQLiteStorage(pattern,2)
+    try:
+      with storage.writeTransaction():
+        for feed_id in range(1,5):
+          storage.putFeed(Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id))
+      transactions=[]
+      original=storage.writeTransaction
+      def counting_transaction(feed_id=None):
+        transactions.append(feed_id)
+        return original(feed_id)
+      storage.writeTransaction=counting_transaction
+
+      writer=GroupCommitWriter(storage,max_delay=10)
+      writer.start()
+      futures=[writer.submit(Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id,title="changed"))
+               for feed_id in range(1,5)]
+      futures.append(writer.submit(Feed(sourceName="test",feedURL="uri://new")))
+      writer.stop()
+
+      self.assertEqual([None]*5,[future.result(0) for future in futures])
+      self.assertEqual([1,2,None],transactions,"should have used one transaction per shard, and one for new feeds")
+      self.assertEqual(["changed"]*4+[None],[feed.title for feed in storage.getFeedHeaders()])
+    finally:
+      storage.close()
+      for index in range(0,2):
+        if os.path.isfile(pattern%index):
+          os.remove(pattern%index)
+
+  def testFailuresAreIsolated(self):
+    """Tests whether a failing feed only fails its own submission, and pending feeds are stored when stopping.
+    """
+    storage=SQLiteStorage(self._filename)
+    writer=GroupCommitWriter(storage,max_delay=10)
+    writer.start()
+    good=writer.submit(Feed(id=1,sourceName="test",feedURL="uri://same"))
+    bad=writer.submit(Feed(id=2,sourceName="test",feedURL="uri://same"))
+    writer.stop()
+
+    self.assertEqual(None,good.result(0))
+    self.assertIsInstance(bad.exception(0),sqlite3.IntegrityError,"duplicate feed URL should have failed")
+    self.assertEqual([1],[feed.id for feed in storage.getFeedHeaders()])
+    storage.close()
@@ -1,60 +1,337 @@
-from typing import List,Union
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from threading import local
+from typing import Iterator,List,Tuple,Union
 import unittest
 
 from domain import *
 from storage import *
-from copy import deepcopy
+
+
+_FeedRecord=namedtuple("_FeedRecord",["id","sourceName","feedURL","updateInterval","title","description","websiteURL",
+                                      "lastRefreshed","lastChanged","etag","lastModified","contentHash"])
+_ItemRecord=namedtuple("_ItemRecord",["id","feedID","guid","title","description","itemURL","publicationDate","fingerprint"])
+
+class _FeedState(namedtuple("_FeedState",["feed","items","ordered","guids"])):
+  """a feed's stored data: the feed record, its item records by ID, its item records ordered by publication date and its item
+  IDs by guid. States are never changed once created, writes replace them instead.
+  """
 
 
 class InMemoryStorage(Storage):
   """Non-persistent storage implementation.
 
   This storage adapter keeps feeds and items in memory only: upon application shutdown all data is lost.
+
+  Feeds and items are stored as immutable records, indexed by feed ID and by (feed ID, guid). Reads build new domain objects
+  from these records, writes replace the affected feed's records. Readers therefore always see a consistent state without
+  copying stored data, and objects passed to or returned by this storage can be changed without affecting stored data.
+
+  Snapshots keep the feed states current at the start of the snapshot, so readers don't wait for writers.
+
+  New feeds and items get IDs assigned, items without ID that match a stored item's guid replace that item - just like in
+  SQLiteStorage.
   """
-  _feeds=[]
+  _feeds=None
+  _archive=None
+  _nextFeedID=1
+  _nextItemID=1
+  _threadlocal=None
+  _changes=None
+  _nextSequence=1
 
   def __init__(self):
     super().__init__()
-    self._feeds=[]
+    self._feeds={}
+    self._changes=[]
+    self._nextSequence=1
+    self._threadlocal=local()
+    self._archive={}
+    self._nextFeedID=1
+    self._nextItemID=1
 
-  def getFeeds(self) -> List[Feed]:
-    """returns a list of all feeds
+  @contextmanager
+  def snapshot(self):
+    """context manager for consistent reads: the current thread's reads use the feed states stored when the block started
     """
+    if getattr(self._threadlocal,"feeds",None)!=None:
+      yield self
+      return
+    self._threadlocal.feeds=dict(self._feeds)
+    try:
+      yield self
+    finally:
+      self._threadlocal.feeds=None
+
+  def _getFeedStates(self) -> dict:
+    """returns the feed states to read from: the current snapshot's if there is one, otherwise the stored ones
+    """
+    feeds=getattr(self._threadlocal,"feeds",None)
+    if feeds!=None:
+      return feeds
     return self._feeds
 
+  def getFeeds(self) -> List[Feed]:
+    """returns a list of all feeds, including their items
+    """
+    rv=[]
+    for state in self._getStates():
+      feed=self._createFeed(state.feed)
+      feed.items=[self._createItem(record) for record in state.ordered]
+      rv.append(feed)
+    return rv
+
   def getFeedByID(self, id:int) -> Union[Feed,None]:
     """looks up an individual feed by ID
     """
-    for feed in self._feeds:
-      if feed.id==id:
-        return feed
-    return None
+    state=self._getFeedStates().get(id)
+    if state==None:
+      return None
+    feed=self._createFeed(state.feed)
+    feed.items=[self._createItem(record) for record in state.ordered]
+    return feed
+
+  def getFeedHeaders(self) -> List[Feed]:
+    """returns a list of all feeds, their items are loaded on first access
+    """
+    return [self._createHeader(state) for state in self._getStates()]
+
+  def iterFeeds(self) -> Iterator[Feed]:
+    """yields all feeds stored at the time of the call, their items are loaded on first access
+    """
+    for state in self._getStates():
+      yield self._createHeader(state)
+
+  def getFeedHeaderByID(self, id:int) -> Union[Feed,None]:
+    """looks up an individual feed by ID, its items are loaded on first access
+    """
+    state=self._getFeedStates().get(id)
+    if state==None:
+      return None
+    return self._createHeader(state)
+
+  def _getStates(self) -> List[_FeedState]:
+    return sorted(list(self._getFeedStates().values()),key=lambda state: state.feed.id)
+
+  def _createHeader(self, state:_FeedState) -> Feed:
+    feed=self._createFeed(state.feed)
+    feed_id=feed.id
+    feed.setItemLoader(lambda: self.getItemsByFeedID(feed_id))
+    return feed
+
+  def _createFeed(self, record:_FeedRecord) -> Feed:
+    feed=Feed()
+    for name,value in zip(record._fields,record):
+      setattr(feed,name,value)
+    feed.markClean()
+    return feed
+
+  def _createItem(self, record:_ItemRecord) -> Item:
+    item=Item()
+    for name,value in zip(record._fields,record):
+      setattr(item,name,value)
+    item.markClean()
+    return item
 
   def putFeed(self, feed:Feed) -> None:
-    """stores an individual feed
+    """stores an individual feed along with new and changed items, keeping the stored items if the feed's items weren't loaded
+    """
+    if feed.id==None:
+      feed.id=self._nextFeedID
+    self._nextFeedID=max(self._nextFeedID,feed.id+1)
+    record=_FeedRecord(*[getattr(feed,name) for name in _FeedRecord._fields])
+
+    state=self._feeds.get(feed.id)
+    changed=state==None or state.feed!=record
+    if state==None:
+      state=_FeedState(record,{},(),{})
+    else:
+      state=state._replace(feed=record)
+    item_ids=[]
+    if feed.hasItemsLoaded():
+      for item in feed.items:
+        item.feedID=feed.id
+      state,item_ids=self._putItems(state,feed.items)
+    self._feeds[feed.id]=state
+    if changed or len(item_ids)>0:
+      self._logChange(feed.id,item_ids,[])
+
+    feed.markClean()
+    if feed.hasItemsLoaded():
+      for item in feed.items:
+        item.markClean()
+
+  def _putItems(self, state:_FeedState, items:List[Item]) -> Tuple[_FeedState,List[int]]:
+    """returns a copy of the feed state with new and changed items replaced, and the written items' IDs. The stored records
+    are shared.
+    """
+    dirty=[item for item in items if item.id==None or item.isDirty() or not item.id in state.items]
+    if len(dirty)<1:
+      return state,[]
+
+    records=dict(state.items)
+    guids=dict(state.guids)
+    for item in dirty:
+      if item.id==None:
+        item.id=guids.get(item.guid) if item.guid!=None else None
+      if item.id==None:
+        item.id=self._nextItemID
+      self._nextItemID=max(self._nextItemID,item.id+1)
+
+      previous=records.get(item.id)
+      if previous!=None and previous.guid!=None and guids.get(previous.guid)==item.id:
+        del guids[previous.guid]
+      records[item.id]=_ItemRecord(*[getattr(item,name) for name in _ItemRecord._fields])
+      if item.guid!=None:
+        guids[item.guid]=item.id
+    return self._createState(state.feed,records,guids),[item.id for item in dirty]
+
+  def _createState(self, feed:_FeedRecord, records:dict, guids:dict) -> _FeedState:
+    ordered=tuple(sorted(records.values(),key=self._getSortKey))
+    return _FeedState(feed,records,ordered,guids)
+
+  def getItemsByFeedID(self, feed_id:int, limit:Union[int,None]=None, before:Union[datetime,None]=None,
+                       since:Union[datetime,None]=None) -> List[Item]:
+    """looks up a feed's items, ordered by publication date
+    """
+    return list(self.iterItems(feed_id,limit=limit,before=before,since=since))
+
+  def iterItems(self, feed_id:int, limit:Union[int,None]=None, before:Union[datetime,None]=None,
+                since:Union[datetime,None]=None) -> Iterator[Item]:
+    """yields a feed's items ordered by publication date, creating each item when it's consumed
     """
-    cp=deepcopy(feed)
-    for ti,local in enumerate(self._feeds):
-      if local.id==cp.id:
-        self._feeds[ti]=cp
-        return
-    self._feeds.append(cp)
+    state=self._getFeedStates().get(feed_id)
+    if state==None:
+      return
+    records=state.ordered
+    if before!=None or since!=None:
+      records=[record for record in records if self._isInWindow(record.publicationDate,before,since)]
+    if limit!=None:
+      records=records[max(len(records)-limit,0):]
+    for record in records:
+      yield self._createItem(record)
 
-  def getItemsByFeedID(self, feed_id:int) -> List[Item]:
-    """looks up a feed's items
+  def _isInWindow(self, date:Union[datetime,None], before:Union[datetime,None], since:Union[datetime,None]) -> bool:
+    if date==None:
+      return False
+    date=self._toUTC(date)
+    if before!=None and date>=self._toUTC(before):
+      return False
+    if since!=None and date<self._toUTC(since):
+      return False
+    return True
+
+  def _getSortKey(self, record:_ItemRecord):
+    """orders items like SQLiteStorage does: undated items first, then by publication date, ties by ID
     """
-    feed=self.getFeedByID(feed_id)
-    if feed==None:
+    if record.publicationDate==None:
+      return (0,record.id)
+    return (1,self._toUTC(record.publicationDate),record.id)
+
+  def _toUTC(self, date:datetime) -> datetime:
+    """makes naive datetimes comparable to aware ones, by treating them as UTC - just like SQLiteStorage does
+    """
+    if date.utcoffset()==None:
+      return date.replace(tzinfo=timezone.utc)
+    return date
+
+  def searchItems(self, query:str, limit:int) -> List[Item]:
+    """looks up items containing all query words, scanning all items
+    """
+    terms=self._getSearchTerms(query)
+    if len(terms)<1:
       return []
-    return feed.items
+    matches=[]
+    for state in self._getStates():
+      for record in state.ordered:
+        score=self._getSearchScore(record,terms)
+        if score>0:
+          matches.append((-score,record.id,record))
+    matches.sort(key=lambda match: match[0:2])
+    return [self._createItem(match[2]) for match in matches[0:limit]]
+
+  def _getSearchScore(self, record:_ItemRecord, terms:List[str]) -> int:
+    title=self._getSearchTerms(record.title or "")
+    description=self._getSearchTerms(record.description or "")
+    score=0
+    for term in terms:
+      count=10*title.count(term)+description.count(term)
+      if count<1:
+        return 0
+      score+=count
+    return score
+
+  def compactItems(self, feed_id:int, policy:RetentionPolicy, limit:int) -> int:
+    """removes a batch of a feed's items the retention policy doesn't keep, archived items are kept in memory separately
+    """
+    state=self._feeds.get(feed_id)
+    if state==None:
+      return 0
+    records=state.ordered
+    expired=[]
+    if policy.maxItems!=None:
+      expired=list(records[0:max(len(records)-policy.maxItems,0)])
+    cutoff=policy.getCutoff()
+    if cutoff!=None:
+      expired+=[record for record in records[len(expired):] if self._isInWindow(record.publicationDate,cutoff,None)]
+    expired=expired[0:limit]
+    if len(expired)<1:
+      return 0
+
+    remaining=dict(state.items)
+    guids=dict(state.guids)
+    for record in expired:
+      del remaining[record.id]
+      if record.guid!=None and guids.get(record.guid)==record.id:
+        del guids[record.guid]
+    self._feeds[feed_id]=self._createState(state.feed,remaining,guids)
+    if policy.archive:
+      self._archive.setdefault(feed_id,[]).extend(expired)
+    self._logChange(feed_id,[],[record.id for record in expired])
+    return len(expired)
+
+  def markRefreshed(self, feed_id:int, last_refreshed:datetime) -> None:
+    """replaces a stored feed's lastRefreshed value, without logging a change
+    """
+    state=self._feeds.get(feed_id)
+    if state==None:
+      return
+    self._feeds[feed_id]=state._replace(feed=state.feed._replace(lastRefreshed=last_refreshed))
 
   def putItem(self, item:Item) -> None:
     """stores an individual item, if the parent feed is stored already
     """
-    feed=self.getFeedByID(item.feedID)
-    if feed==None:
+    state=self._feeds.get(item.feedID)
+    if state==None:
       return
-    feed.items.append(deepcopy(item))
+    state,item_ids=self._putItems(state,[item])
+    self._feeds[item.feedID]=state
+    item.markClean()
+    if len(item_ids)>0:
+      self._logChange(item.feedID,item_ids,[])
+
+  def _logChange(self, feed_id:int, item_ids:List[int], removed_ids:List[int]):
+    event=ChangeEvent(self._nextSequence,feed_id,item_ids,removed_ids,self._feeds[feed_id].feed.lastChanged)
+    self._nextSequence+=1
+    self._changes.append(event)
+    self._publishChange(event)
+
+  def getChanges(self, after:int, limit:int) -> List[ChangeEvent]:
+    """returns logged changes after the given sequence number, the log is kept in memory
+    """
+    changes=self._changes
+    if len(changes)<1:
+      return []
+    start=max(after-changes[0].sequence+1,0)
+    return changes[start:start+limit]
+
+  def pruneChanges(self, keep:int) -> int:
+    """deletes logged changes except for the given number of most recent ones
+    """
+    removed=max(len(self._changes)-keep,0)
+    self._changes=self._changes[removed:]
+    return removed
 
 
 class TestInMemoryStorage(BaseStorageTest,unittest.TestCase):
@@ -79,10 +356,60 @@ class TestInMemoryStorage(BaseStorageTest,unittest.TestCase):
     self.assertEqual("asdf",contents1[0].title,     "stored .title should match input")
     self.assertEqual(1,     len(contents1[0].items),"number of stored items should match")
 
-    self.assertEqual(contents1[0],storage1.getFeedByID(2),          "should find stored feed by ID")
-    self.assertEqual(1,           len(storage1.getItemsByFeedID(2)),"should find stored feed's items by feed ID")
+    self.assertEqual("asdf",storage1.getFeedByID(2).title,    "should find stored feed by ID")
+    self.assertEqual(1,     len(storage1.getItemsByFeedID(2)),"should find stored feed's items by feed ID")
 
     self.assertEqual([],  storage2.getFeeds(),         "other storage should still be empty")
     self.assertEqual(None,storage2.getFeedByID(2),     "other storage shouldn't find feed by ID")
     self.assertEqual([],  storage2.getItemsByFeedID(2),"other storage shouldn't find feed items by feed ID")
 
+  def testReadsAreIndependent(self):
+    """Tests whether changing read objects doesn't affect stored data, and whether reads share stored records.
+    """
+    storage=self._createStorage()
+    feed=Feed(id=1,sourceName="test",feedURL="uri://test",title="title")
+    item=Item(title="item")
+    item.guid="guid"
+    feed.items=[item]
+    storage.putFeed(feed)
+    state=storage._feeds[1]
+
+    read=storage.getFeedByID(1)
+    read.title="changed"
+    read.items[0].title="changed"
+    read.items.append(Item(title="added"))
+    self.assertEqual("title",storage.getFeedByID(1).title,"changing read feed shouldn't change stored feed")
+    self.assertEqual(["item"],[item.title for item in storage.getItemsByFeedID(1)],"changing read items shouldn't change stored items")
+    self.assertIs(state,storage._feeds[1],"reads shouldn't have replaced stored state")
+
+    replacement=Item(feedID=1,title="replacement")
+    replacement.guid="guid"
+    storage.putItem(replacement)
+    self.assertEqual(item.id,replacement.id,"item with known guid should replace the stored item")
+    self.assertEqual(["replacement"],[item.title for item in storage.getItemsByFeedID(1)])
+    self.assertEqual({"guid":item.id},storage._feeds[1].guids,"guid index should be up to date")
+    self.assertEqual(["item"],[record.title for record in state.ordered],"previous state should be unchanged")
+
+  def testSnapshotIsolation(self):
+    """Tests whether reads within a snapshot don't see writes committed during the snapshot.
+    """
+    storage=self._createStorage()
+    feed=Feed(id=1,sourceName="test",feedURL="uri://test",title="old")
+    feed.items=[Item(title="old item")]
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    with storage.snapshot():
+      header=storage.getFeedHeaderByID(1)
+      update=storage.getFeedHeaderByID(1)
+      update.title="new"
+      update.items=[Item(title="new item")]
+      storage.acquireWriteLock()
+      storage.putFeed(update)
+      storage.releaseWriteLock()
+      self.assertEqual("old",header.title)
+      self.assertEqual(["old item"],[item.title for item in storage.iterItems(1)],"snapshot shouldn't see new items")
+      self.assertEqual("old",storage.getFeedByID(1).title,"snapshot shouldn't see new feed data")
+    self.assertEqual(["old item","new item"],[item.title for item in storage.getFeedByID(1).items],"write should be visible afterwards")
+    self.assertEqual("new",storage.getFeedHeaderByID(1).title)
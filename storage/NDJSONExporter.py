@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta, timezone
+import io
+import json
+from typing import TextIO, Tuple, Union
+import unittest
+
+from domain import *
+from storage import *
+
+
+class NDJSONExporter:
+  """Writes all feeds and items of a storage as newline-delimited JSON, one record per line.
+
+  Each feed record is followed by its items' records, ordered by publication date. Records are plain JSON objects with a
+  "type" key of either "feed" or "item" and the domain objects' fields as further keys: datetimes are ISO 8601 strings,
+  update intervals are seconds. NDJSONImporter reads this format into any storage.
+
+  Records are written while reading, one at a time: memory usage doesn't depend on the number of stored feeds or items.
+  """
+
+  _storage=None
+
+  def __init__(self, storage:Storage):
+    """
+    :param Storage storage: the storage to read from
+    """
+    self._storage=storage
+
+  def export(self, stream:TextIO) -> Tuple[int,int]:
+    """Writes all feeds and their items to the given text stream.
+
+    :param TextIO stream: the stream to write to, e.g. an opened text file
+    :return: the number of feeds and the number of items written
+    :rtype: Tuple[int,int]
+    """
+    feed_count=0
+    item_count=0
+    for feed in self._storage.iterFeeds():
+      self._writeRecord(stream,self._feedToRecord(feed))
+      feed_count+=1
+      for item in self._storage.iterItems(feed.id):
+        self._writeRecord(stream,self._itemToRecord(item))
+        item_count+=1
+    return feed_count,item_count
+
+  def _writeRecord(self, stream:TextIO, record:dict):
+    stream.write(json.dumps(record,ensure_ascii=False,separators=(",",":")))
+    stream.write("\n")
+
+  def _feedToRecord(self, feed:Feed) -> dict:
+    return {"type":"feed",
+            "id":feed.id,
+            "sourceName":feed.sourceName,
+            "feedURL":feed.feedURL,
+            "updateInterval":self._timedeltaToJSON(feed.updateInterval),
+            "title":feed.title,
+            "description":feed.description,
+            "websiteURL":feed.websiteURL,
+            "lastRefreshed":self._datetimeToJSON(feed.lastRefreshed),
+            "lastChanged":self._datetimeToJSON(feed.lastChanged),
+            "etag":feed.etag,
+            "lastModified":feed.lastModified,
+            "contentHash":feed.contentHash}
+
+  def _itemToRecord(self, item:Item) -> dict:
+    return {"type":"item",
+            "id":item.id,
+            "feedID":item.feedID,
+            "guid":item.guid,
+            "title":item.title,
+            "description":item.description,
+            "itemURL":item.itemURL,
+            "publicationDate":self._datetimeToJSON(item.publicationDate),
+            "fingerprint":item.fingerprint}
+
+  def _datetimeToJSON(self, obj:Union[datetime,None]) -> Union[str,None]:
+    if obj==None:
+      return None
+    return obj.isoformat()
+
+  def _timedeltaToJSON(self, obj:Union[timedelta,None]) -> Union[float,None]:
+    if obj==None:
+      return None
+    return obj.total_seconds()
+
+
+class TestNDJSONExporter(unittest.TestCase):
+  """Tests for the NDJSONExporter class.
+  """
+
+  def testExport(self):
+    """Tests whether feeds are written with their items following them, one record per line.
+    """
+    storage=InMemoryStorage()
+    feed=Feed(id=2,sourceName="test",feedURL="uri://test",updateInterval=timedelta(minutes=5),title="feed")
+    feed.lastRefreshed=datetime(2017,3,1,12,30,tzinfo=timezone(timedelta(hours=2)))
+    item=Item(id=5,title="item")
+    item.description="description ä"
+    item.publicationDate=datetime(2017,2,28,8,0,0,500)
+    feed.items=[item]
+    storage.putFeed(feed)
+    storage.putFeed(Feed(id=3,sourceName="test",feedURL="uri://empty"))
+
+    stream=io.StringIO()
+    self.assertEqual((2,1),NDJSONExporter(storage).export(stream))
+    lines=stream.getvalue().split("\n")
+    self.assertEqual(4,len(lines),"should have written one line per record")
+    self.assertEqual("",lines[3],"last record should end with a newline")
+
+    records=[json.loads(line) for line in lines[0:3]]
+    self.assertEqual(["feed","item","feed"],[record["type"] for record in records])
+    self.assertEqual(300,records[0]["updateInterval"])
+    self.assertEqual("2017-03-01T12:30:00+02:00",records[0]["lastRefreshed"])
+    self.assertEqual(None,records[0]["lastChanged"])
+    self.assertEqual({"type":"item","id":5,"feedID":2,"guid":None,"title":"item","description":"description ä",
+                      "itemURL":None,"publicationDate":"2017-02-28T08:00:00.000500","fingerprint":None},records[1])
+    self.assertEqual(3,records[2]["id"])
@@ -0,0 +1,211 @@
+from datetime import datetime, timedelta, timezone
+import io
+import json
+from typing import List, TextIO, Tuple, Union
+import unittest
+
+from domain import *
+from storage import *
+
+
+class NDJSONImporter:
+  """Reads feeds and items written by NDJSONExporter into a storage.
+
+  Feeds and items keep their IDs, so links to feeds stay valid. Items are stored in batches: each batch is written in a single
+  write transaction while holding the feed's write lock, and memory usage doesn't depend on the number of imported items.
+
+  Imported feeds must not exist in the target storage yet, usually the target is empty.
+  """
+
+  batchSize=500 #: the maximum number of items to store at once
+
+  _storage=None
+  _schema=None
+
+  def __init__(self, storage:Storage):
+    """
+    :param Storage storage: the storage to write to
+    """
+    self._storage=storage
+    self._schema=SQLiteSchema()
+
+  def load(self, stream:TextIO) -> Tuple[int,int]:
+    """Reads all records from the given text stream and stores them.
+
+    :param TextIO stream: the stream to read from, e.g. an opened text file
+    :return: the number of feeds and the number of items imported
+    :rtype: Tuple[int,int]
+    :raises ValueError: if a record is invalid, or if a feed exists in the storage already
+    """
+    feed=None
+    batch=[]
+    feed_count=0
+    item_count=0
+    for number,line in enumerate(stream,1):
+      if line.strip()=="":
+        continue
+      try:
+        record=json.loads(line)
+      except ValueError as e:
+        raise ValueError("line %d: invalid JSON: %s"%(number,e))
+      type=record.get("type")
+
+      if type=="feed":
+        self._storeItems(feed,batch)
+        batch=[]
+        feed=self._recordToFeed(record)
+        if self._storage.getFeedHeaderByID(feed.id)!=None:
+          raise ValueError("line %d: feed %d exists already"%(number,feed.id))
+        self._withWriteLock(feed.id,self._storage.putFeed,feed)
+        feed_count+=1
+      elif type=="item":
+        if feed==None or record.get("feedID")!=feed.id:
+          raise ValueError("line %d: item doesn't follow its feed"%number)
+        batch.append(self._recordToItem(record))
+        item_count+=1
+        if len(batch)>=self.batchSize:
+          self._storeItems(feed,batch)
+          batch=[]
+      else:
+        raise ValueError("line %d: unknown record type %s"%(number,repr(type)))
+
+    self._storeItems(feed,batch)
+    return feed_count,item_count
+
+  def _storeItems(self, feed:Union[Feed,None], items:List[Item]):
+    """stores a batch of items via the already stored feed: unchanged feeds only get their items written
+    """
+    if len(items)<1:
+      return
+    feed.items=items
+    self._withWriteLock(feed.id,self._storage.putFeed,feed)
+
+  def _withWriteLock(self, feed_id, method, *args):
+    self._storage.acquireWriteLock(feed_id)
+    try:
+      return method(*args)
+    finally:
+      self._storage.releaseWriteLock(feed_id)
+
+  def _recordToFeed(self, record:dict) -> Feed:
+    feed=Feed()
+    feed.id=record["id"]
+    feed.sourceName=record.get("sourceName")
+    feed.feedURL=record.get("feedURL")
+    feed.updateInterval=self._jsonToTimedelta(record.get("updateInterval"))
+    feed.title=record.get("title")
+    feed.description=record.get("description")
+    feed.websiteURL=record.get("websiteURL")
+    feed.lastRefreshed=self._jsonToDatetime(record.get("lastRefreshed"))
+    feed.lastChanged=self._jsonToDatetime(record.get("lastChanged"))
+    feed.etag=record.get("etag")
+    feed.lastModified=record.get("lastModified")
+    feed.contentHash=record.get("contentHash")
+    return feed
+
+  def _recordToItem(self, record:dict) -> Item:
+    item=Item()
+    item.id=record.get("id")
+    item.feedID=record["feedID"]
+    item.guid=record.get("guid")
+    item.title=record.get("title")
+    item.description=record.get("description")
+    item.itemURL=record.get("itemURL")
+    item.publicationDate=self._jsonToDatetime(record.get("publicationDate"))
+    item.fingerprint=record.get("fingerprint")
+    return item
+
+  def _jsonToDatetime(self, raw:Union[str,None]) -> Union[datetime,None]:
+    return self._schema.parseISODatetime(raw)
+
+  def _jsonToTimedelta(self, raw:Union[float,None]) -> Union[timedelta,None]:
+    if raw==None:
+      return None
+    return timedelta(seconds=raw)
+
+
+class TestNDJSONImporter(unittest.TestCase):
+  """Tests for the NDJSONImporter class.
+  """
+
+  def _createFeeds(self, storage:Storage):
+    storage.acquireWriteLock()
+    feed=Feed(id=3,sourceName="test",feedURL="uri://3",updateInterval=timedelta(minutes=5),title="feed 3")
+    feed.description="description"
+    feed.websiteURL="http://localhost/"
+    feed.lastRefreshed=datetime(2017,3,1,12,30,tzinfo=timezone(timedelta(hours=-5)))
+    feed.lastChanged=datetime(2017,3,1,12,0,0,123)
+    feed.etag='W/"3"'
+    for tc in range(0,7):
+      item=Item(title="item %d"%tc)
+      item.guid="guid %d"%tc
+      item.description="text %d"%(tc%2)
+      item.itemURL="http://localhost/%d"%tc
+      item.fingerprint="fingerprint %d"%tc
+      if tc>0:
+        item.publicationDate=datetime(2017,2,tc,tzinfo=timezone(timedelta(hours=tc)))
+      feed.items.append(item)
+    storage.putFeed(feed)
+    storage.putFeed(Feed(id=5,sourceName="test",feedURL="uri://5"))
+    storage.releaseWriteLock()
+
+  def _transfer(self, source:Storage, target:Storage, batch_size:int=500) -> Tuple[int,int]:
+    stream=io.StringIO()
+    NDJSONExporter(source).export(stream)
+    stream.seek(0)
+    importer=NDJSONImporter(target)
+    importer.batchSize=batch_size
+    return importer.load(stream)
+
+  def _assertSameContents(self, expected:Storage, actual:Storage):
+    feed_fields=["id","sourceName","feedURL","updateInterval","title","description","websiteURL","lastRefreshed","lastChanged",
+                 "etag","lastModified","contentHash"]
+    item_fields=["id","feedID","guid","title","description","itemURL","publicationDate","fingerprint"]
+    expected_feeds=expected.getFeeds()
+    actual_feeds=actual.getFeeds()
+    self.assertEqual([feed.id for feed in expected_feeds],[feed.id for feed in actual_feeds])
+    for expected_feed,actual_feed in zip(expected_feeds,actual_feeds):
+      for field in feed_fields:
+        self.assertEqual(getattr(expected_feed,field),getattr(actual_feed,field),"feed field %s should match"%field)
+      self.assertEqual(len(expected_feed.items),len(actual_feed.items))
+      for expected_item,actual_item in zip(expected_feed.items,actual_feed.items):
+        for field in item_fields:
+          self.assertEqual(getattr(expected_item,field),getattr(actual_item,field),"item field %s should match"%field)
+        if actual_item.publicationDate!=None:
+          self.assertEqual(expected_item.publicationDate.utcoffset(),actual_item.publicationDate.utcoffset())
+
+  def testSQLiteToInMemory(self):
+    """Tests whether SQLiteStorage contents are copied into an InMemoryStorage, in several batches.
+    """
+    source=SQLiteStorage(":memory:")
+    self._createFeeds(source)
+    target=InMemoryStorage()
+    self.assertEqual((2,7),self._transfer(source,target,3))
+    self._assertSameContents(source,target)
+
+  def testInMemoryToSQLite(self):
+    """Tests whether InMemoryStorage contents are copied into a SQLiteStorage, keeping search and deduplication intact.
+    """
+    source=InMemoryStorage()
+    self._createFeeds(source)
+    target=SQLiteStorage(":memory:")
+    self.assertEqual((2,7),self._transfer(source,target,2))
+    self._assertSameContents(source,target)
+    self.assertEqual(["item 6"],[item.title for item in target.searchItems("6",10)],"imported items should be searchable")
+    count=target._getConnection().execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+    self.assertEqual(2,count,"descriptions should have been deduplicated")
+    self.assertFalse(target.isWriteLocked(),"write lock should have been released")
+
+  def testInvalidInput(self):
+    """Tests whether invalid records and existing feeds are refused.
+    """
+    storage=InMemoryStorage()
+    storage.putFeed(Feed(id=1,sourceName="test",feedURL="uri://1"))
+    cases=['{"type":"feed","id":1}',
+           '{"type":"item","id":1,"feedID":2}',
+           '{"type":"feed","id":2}\n{"type":"item","id":1,"feedID":3}',
+           '{"type":"other"}',
+           '{"type":']
+    for case in cases:
+      with self.assertRaises(ValueError,msg=case):
+        NDJSONImporter(storage).load(io.StringIO(case))
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta, timezone
+from typing import Union
+
+
+class RetentionPolicy:
+  """Data class for item retention settings, applied by the Compactor.
+
+  Items exceeding either limit expire. Items without publication date only expire by count, as the oldest ones.
+  """
+  maxItems=None #: the maximum number of items to keep per feed, None for no limit
+  maxAge=None   #: the maximum age of items to keep by publication date, as datetime.timedelta, None for no limit
+  archive=False #: whether expired items are moved to the archive instead of being deleted
+
+  def __init__(self, max_items:Union[int,None]=None, max_age:Union[timedelta,None]=None, archive:bool=False):
+    """
+    :param Union[int,None] max_items: optional: the maximum number of items to keep per feed
+    :param Union[timedelta,None] max_age: optional: the maximum age of items to keep
+    :param bool archive: whether to archive expired items instead of deleting them (default: False)
+    """
+    self.maxItems=max_items
+    self.maxAge=max_age
+    self.archive=archive
+
+  def isUnlimited(self) -> bool:
+    """Checks whether this policy keeps all items.
+
+    :rtype: bool
+    """
+    return self.maxItems==None and self.maxAge==None
+
+  def getCutoff(self) -> Union[datetime,None]:
+    """Returns the publication date items need to be younger than, based on the current time.
+
+    :return: the cutoff time, or None if items don't expire by age
+    :rtype: Union[datetime,None]
+    """
+    if self.maxAge==None:
+      return None
+    return datetime.now(timezone.utc)-self.maxAge
+
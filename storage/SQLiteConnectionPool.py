@@ -0,0 +1,126 @@
+from contextlib import contextmanager
+import sqlite3
+from threading import Condition, Thread
+from time import sleep
+import unittest
+
+
+class SQLiteConnectionPool:
+  """Bounded pool of SQLite connections shared between threads.
+
+  Connections are created on demand by the given factory, up to the pool size. If all connections are in use, acquire()
+  blocks until another thread releases one. The factory needs to create connections that may be used across threads (i.e.
+  with check_same_thread=False).
+  """
+
+  _factory=None
+  _size=None
+  _idle=None
+  _created=0
+  _condition=None
+
+  def __init__(self, factory, size:int):
+    """
+    :param Callable[[],sqlite3.Connection] factory: creates a new connection
+    :param int size: the maximum number of connections
+    """
+    if size<1:
+      raise ValueError("pool size must be at least 1, got %d"%size)
+    self._factory=factory
+    self._size=size
+    self._idle=[]
+    self._created=0
+    self._condition=Condition()
+
+  def acquire(self) -> sqlite3.Connection:
+    """Takes a connection from the pool, blocking until one is available.
+
+    Connections need to be returned with .release().
+
+    :rtype: sqlite3.Connection
+    """
+    with self._condition:
+      while len(self._idle)<1 and self._created>=self._size:
+        self._condition.wait()
+      if len(self._idle)>0:
+        return self._idle.pop()
+      self._created+=1
+
+    try:
+      return self._factory()
+    except:
+      with self._condition:
+        self._created-=1
+        self._condition.notify()
+      raise
+
+  def release(self, conn:sqlite3.Connection):
+    """Returns a connection to the pool, ending any transaction still open on it.
+
+    :param sqlite3.Connection conn: the connection to return
+    """
+    if conn.in_transaction:
+      conn.rollback()
+    with self._condition:
+      self._idle.append(conn)
+      self._condition.notify()
+
+  @contextmanager
+  def connection(self):
+    """Context manager for acquiring and releasing a connection.
+    """
+    conn=self.acquire()
+    try:
+      yield conn
+    finally:
+      self.release(conn)
+
+  def close(self):
+    """Closes all idle connections. Connections still in use are left open.
+    """
+    with self._condition:
+      for conn in self._idle:
+        conn.close()
+      self._created-=len(self._idle)
+      self._idle=[]
+
+
+class TestSQLiteConnectionPool(unittest.TestCase):
+  """Tests for the SQLiteConnectionPool class.
+  """
+
+  def testReuse(self):
+    """Tests whether released connections are reused instead of creating new ones.
+    """
+    created=[]
+    def factory():
+      created.append(sqlite3.connect(":memory:",check_same_thread=False))
+      return created[-1]
+    pool=SQLiteConnectionPool(factory,2)
+
+    with pool.connection() as conn1:
+      pass
+    with pool.connection() as conn2:
+      self.assertIs(conn1,conn2,"released connection should have been reused")
+    self.assertEqual(1,len(created),"should only have created one connection")
+
+  def testBlocksWhenExhausted(self):
+    """Tests whether acquire() waits for a connection to be released once the pool size is reached.
+    """
+    pool=SQLiteConnectionPool(lambda: sqlite3.connect(":memory:",check_same_thread=False),1)
+    conn=pool.acquire()
+    events=[]
+
+    def other():
+      with pool.connection() as other_conn:
+        events.append(other_conn)
+    thread=Thread(target=other)
+    thread.start()
+    sleep(0.2)
+    self.assertEqual([],events,"second acquire() should block while the only connection is in use")
+
+    pool.release(conn)
+    thread.join(2)
+    self.assertEqual([conn],events,"second acquire() should have gotten the released connection")
+    pool.close()
+
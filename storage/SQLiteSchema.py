@@ -0,0 +1,500 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+import hashlib
+import sys
+from typing import List, Tuple, Union
+import unittest
+import zlib
+
+from logger import get_logger
+
+
+log=get_logger(__name__)
+
+
+class SQLiteSchema:
+  """Versioned schema migrations for SQLiteStorage.
+
+  The current schema version is kept in the single-row table "schemaVersion". Databases created before versioning was
+  introduced don't have this table: they're treated as version 0 and upgraded in place.
+
+  Each entry in _migrations names a method upgrading the schema by one version: the method at index i upgrades from version i
+  to i+1. Every step runs in its own transaction, so an interrupted upgrade resumes at the last completed step. Steps listed in
+  _nonTransactional can't run inside a transaction (e.g. VACUUM), they need to be safe to repeat.
+
+  Timestamps are stored as two integer columns: microseconds since the epoch in UTC, and the UTC offset in seconds. Naive
+  datetimes are stored as if they were UTC, with the offset set to NULL. Use datetimeToSQL() and sqlToDatetime() to convert.
+
+  Item descriptions are stored once per distinct text in the "descriptions" table, zlib-compressed and keyed by their SHA-256
+  hash. Items refer to them by hash, each description row counts its references from items and archivedItems. Use
+  descriptionToSQL() and sqlToDescription() to convert.
+
+  Every committed write is recorded in "changeLog", numbered by the AUTOINCREMENT column "sequence". Item ID lists are stored as
+  comma-separated text, use idsToSQL() and sqlToIDs() to convert.
+  """
+
+  _migrations=["_createBaseTables",
+               "_addIndexes",
+               "_storeNumericTimestamps",
+               "_addArchive",
+               "_enableIncrementalVacuum",
+               "_addSearchIndex",
+               "_storeDescriptionBlobs",
+               "_addChangeLog",
+               "_addValidators",
+               "_addFingerprints"]
+  _nonTransactional=["_enableIncrementalVacuum"]
+
+  _epoch=datetime(1970,1,1)
+  _timezones={}
+
+  def getLatestVersion(self) -> int:
+    """Returns the schema version this class migrates to.
+
+    :rtype: int
+    """
+    return len(self._migrations)
+
+  def getVersion(self, conn:sqlite3.Connection) -> int:
+    """Returns the given database's current schema version.
+
+    :param sqlite3.Connection conn: the database connection to check
+    :return: the schema version, 0 for unversioned databases
+    :rtype: int
+    """
+    c=conn.cursor()
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='schemaVersion'")
+    if c.fetchone()==None:
+      c.close()
+      return 0
+    c.execute("SELECT version FROM schemaVersion")
+    row=c.fetchone()
+    c.close()
+    if row==None:
+      return 0
+    return row[0]
+
+  def migrate(self, conn:sqlite3.Connection) -> int:
+    """Upgrades the given database to the latest schema version.
+
+    :param sqlite3.Connection conn: the database connection to upgrade
+    :return: the number of migration steps performed
+    :rtype: int
+    """
+    version=self.getVersion(conn)
+    latest=self.getLatestVersion()
+    if version>latest:
+      raise RuntimeError("database schema version %d is newer than supported version %d"%(version,latest))
+
+    for step in range(version,latest):
+      log.info("migrating database schema to version %d",step+1)
+      name=self._migrations[step]
+      c=conn.cursor()
+      try:
+        if name in self._nonTransactional:
+          getattr(self,name)(c)
+        c.execute("BEGIN")
+        if not name in self._nonTransactional:
+          getattr(self,name)(c)
+        self._setVersion(c,step+1)
+        conn.commit()
+      except:
+        conn.rollback()
+        raise
+      finally:
+        c.close()
+    return latest-version
+
+  def datetimeToSQL(self, obj:Union[datetime,None]) -> Tuple[Union[int,None],Union[int,None]]:
+    """Converts a datetime into its stored representation.
+
+    :param Union[datetime,None] obj: the datetime to convert
+    :return: the microseconds since the epoch in UTC and the UTC offset in seconds, the offset is None for naive datetimes
+    :rtype: Tuple[Union[int,None],Union[int,None]]
+    """
+    if obj==None:
+      return None,None
+    delta=obj.replace(tzinfo=None)-self._epoch
+    microseconds=(delta.days*86400+delta.seconds)*1000000+delta.microseconds
+    offset=obj.utcoffset()
+    if offset==None:
+      return microseconds,None
+    offset_seconds=offset.days*86400+offset.seconds
+    return microseconds-offset_seconds*1000000,offset_seconds
+
+  def sqlToDatetime(self, microseconds:Union[int,None], offset:Union[int,None]) -> Union[datetime,None]:
+    """Converts a stored timestamp back into a datetime.
+
+    :param Union[int,None] microseconds: the microseconds since the epoch in UTC
+    :param Union[int,None] offset: the UTC offset in seconds, None for naive datetimes
+    :rtype: Union[datetime,None]
+    """
+    if microseconds==None:
+      return None
+    if offset==None:
+      return self._epoch+timedelta(microseconds=microseconds)
+    tz=self._timezones.get(offset)
+    if tz==None:
+      tz=timezone(timedelta(seconds=offset))
+      self._timezones[offset]=tz
+    return (self._epoch+timedelta(microseconds=microseconds+offset*1000000)).replace(tzinfo=tz)
+
+  def hashDescription(self, text:str) -> bytes:
+    """Returns the key an item description is stored under.
+
+    :param str text: the description
+    :rtype: bytes
+    """
+    return hashlib.sha256(text.encode()).digest()
+
+  def descriptionToSQL(self, text:str) -> bytes:
+    """Converts an item description into its stored, compressed representation.
+
+    :param str text: the description to convert
+    :rtype: bytes
+    """
+    return zlib.compress(text.encode())
+
+  def sqlToDescription(self, content:Union[bytes,None]) -> Union[str,None]:
+    """Converts a stored description back into text.
+
+    :param Union[bytes,None] content: the compressed description
+    :rtype: Union[str,None]
+    """
+    if content==None:
+      return None
+    return zlib.decompress(content).decode()
+
+  def idsToSQL(self, ids:List[int]) -> str:
+    """Converts a list of IDs into its stored representation.
+
+    :param List[int] ids: the IDs to convert
+    :rtype: str
+    """
+    return ",".join([str(id) for id in ids])
+
+  def sqlToIDs(self, raw:str) -> List[int]:
+    """Converts a stored list of IDs back into a list.
+
+    :param str raw: the stored IDs
+    :rtype: List[int]
+    """
+    return [int(id) for id in raw.split(",") if id!=""]
+
+  def parseISODatetime(self, raw:Union[str,None]) -> Union[datetime,None]:
+    """Parses an ISO 8601 timestamp as written by datetime.isoformat(), as stored by schema versions before 3.
+
+    :param Union[str,None] raw: the timestamp, the date and time may be separated by a space or a "T"
+    :rtype: Union[datetime,None]
+    """
+    if raw==None:
+      return None
+    if sys.version_info>=(3,7):
+      return datetime.fromisoformat(raw) #requires Python 3.7+
+
+    plain=datetime.strptime(raw[0:10]+" "+raw[11:19],"%Y-%m-%d %H:%M:%S")
+    microseconds=0
+    tz=None
+    remainder=raw[19:]
+    if remainder[0:1]==".":
+      microseconds=int(remainder[1:7])
+      remainder=remainder[7:]
+    if remainder!="":
+      sign=1
+      if remainder[0]=="-":
+        sign=-1
+      parts=[int(part) for part in remainder[1:].split(":")]+[0,0]
+      tz=timezone(sign*timedelta(hours=parts[0],minutes=parts[1],seconds=parts[2]))
+    return datetime(plain.year,plain.month,plain.day,plain.hour,plain.minute,plain.second,microseconds,tz)
+
+  def _legacyToNumeric(self, raw:Union[str,None]) -> Tuple[Union[int,None],Union[int,None]]:
+    return self.datetimeToSQL(self.parseISODatetime(raw))
+
+  def _rebuildTable(self, c:sqlite3.Cursor, table:str, definition:str, columns:str, convert):
+    """replaces a table with a new definition, copying all rows in batches
+
+    AUTOINCREMENT counters are kept, indexes need to be recreated by the caller.
+    """
+    temporary=table+"Rebuilt"
+    c.execute("CREATE TABLE %s (%s)"%(temporary,definition))
+    reader=c.connection.cursor()
+    reader.execute("SELECT * FROM %s ORDER BY id"%table)
+    while True:
+      rows=reader.fetchmany(1000)
+      if len(rows)<1:
+        break
+      converted=[convert(row) for row in rows]
+      c.executemany("INSERT INTO %s (%s) VALUES (%s)"%(temporary,columns,",".join("?"*len(converted[0]))),converted)
+    reader.close()
+
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name=?",(table,))
+    row=c.fetchone()
+    c.execute("DROP TABLE %s"%table)
+    c.execute("ALTER TABLE %s RENAME TO %s"%(temporary,table))
+    if row!=None:
+      c.execute("UPDATE sqlite_sequence SET seq=MAX(seq,?) WHERE name=?",(row[0],table))
+
+  def _setVersion(self, c:sqlite3.Cursor, version:int):
+    c.execute("CREATE TABLE IF NOT EXISTS schemaVersion (version INT NOT NULL)")
+    c.execute("DELETE FROM schemaVersion")
+    c.execute("INSERT INTO schemaVersion (version) VALUES (?)",(version,))
+
+
+  def _createBaseTables(self, c:sqlite3.Cursor):
+    """version 1: the original feeds and items tables, these may already exist in unversioned databases
+    """
+    c.execute("""CREATE TABLE IF NOT EXISTS feeds (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                   sourceName TEXT NOT NULL,
+                                                   feedURL TEXT NOT NULL,
+                                                   updateInterval INT,
+                                                   title TEXT,
+                                                   description TEXT,
+                                                   websiteURL TEXT,
+                                                   lastRefreshed TEXT,
+                                                   lastChanged TEXT)""")
+
+    c.execute("""CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                   feedID INT NOT NULL,
+                                                   guid TEXT,
+                                                   title TEXT,
+                                                   description TEXT,
+                                                   itemURL TEXT,
+                                                   publicationDate TEXT)""")
+
+  def _addIndexes(self, c:sqlite3.Cursor):
+    """version 2: lookup indexes for items by feed and for feeds by source
+
+    Older databases may contain duplicates violating the new unique indexes. Duplicate feeds are merged into the oldest one,
+    duplicate items are reduced to the most recently inserted one.
+    """
+    c.execute("""UPDATE items SET feedID=(SELECT MIN(original.id) FROM feeds original, feeds duplicate
+                                           WHERE duplicate.id=items.feedID
+                                             AND original.sourceName=duplicate.sourceName
+                                             AND original.feedURL=duplicate.feedURL)
+                  WHERE feedID IN (SELECT id FROM feeds)
+                    AND feedID NOT IN (SELECT MIN(id) FROM feeds GROUP BY sourceName,feedURL)""")
+    c.execute("DELETE FROM feeds WHERE id NOT IN (SELECT MIN(id) FROM feeds GROUP BY sourceName,feedURL)")
+    c.execute("""DELETE FROM items WHERE guid IS NOT NULL
+                                     AND id NOT IN (SELECT MAX(id) FROM items WHERE guid IS NOT NULL GROUP BY feedID,guid)""")
+
+    c.execute("CREATE INDEX itemsFeedPublication ON items (feedID,publicationDate)")
+    c.execute("CREATE UNIQUE INDEX itemsFeedGUID ON items (feedID,guid)")
+    c.execute("CREATE UNIQUE INDEX feedsSource ON feeds (sourceName,feedURL)")
+
+  def _storeNumericTimestamps(self, c:sqlite3.Cursor):
+    """version 3: timestamps as integer microseconds plus UTC offset instead of ISO strings
+    """
+    self._rebuildTable(c,"feeds","""id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    sourceName TEXT NOT NULL,
+                                    feedURL TEXT NOT NULL,
+                                    updateInterval INT,
+                                    title TEXT,
+                                    description TEXT,
+                                    websiteURL TEXT,
+                                    lastRefreshed INT,
+                                    lastRefreshedOffset INT,
+                                    lastChanged INT,
+                                    lastChangedOffset INT""",
+                       "id,sourceName,feedURL,updateInterval,title,description,websiteURL,lastRefreshed,lastRefreshedOffset,lastChanged,lastChangedOffset",
+                       lambda row: row[0:7]+self._legacyToNumeric(row[7])+self._legacyToNumeric(row[8]))
+    self._rebuildTable(c,"items","""id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    feedID INT NOT NULL,
+                                    guid TEXT,
+                                    title TEXT,
+                                    description TEXT,
+                                    itemURL TEXT,
+                                    publicationDate INT,
+                                    publicationDateOffset INT""",
+                       "id,feedID,guid,title,description,itemURL,publicationDate,publicationDateOffset",
+                       lambda row: row[0:6]+self._legacyToNumeric(row[6]))
+
+    c.execute("CREATE INDEX itemsFeedPublication ON items (feedID,publicationDate)")
+    c.execute("CREATE UNIQUE INDEX itemsFeedGUID ON items (feedID,guid)")
+    c.execute("CREATE UNIQUE INDEX feedsSource ON feeds (sourceName,feedURL)")
+
+  def _addArchive(self, c:sqlite3.Cursor):
+    """version 4: table for items expired by a retention policy, if the policy archives them
+    """
+    c.execute("""CREATE TABLE archivedItems (id INTEGER PRIMARY KEY,
+                                             feedID INT NOT NULL,
+                                             guid TEXT,
+                                             title TEXT,
+                                             description TEXT,
+                                             itemURL TEXT,
+                                             publicationDate INT,
+                                             publicationDateOffset INT)""")
+    c.execute("CREATE INDEX archivedItemsFeedPublication ON archivedItems (feedID,publicationDate)")
+
+  def _enableIncrementalVacuum(self, c:sqlite3.Cursor):
+    """version 5: incremental auto-vacuum, so space freed by deleting items can be returned to the file system
+
+    Existing databases need a full VACUUM once for the setting to take effect.
+    """
+    c.execute("PRAGMA auto_vacuum")
+    if c.fetchone()[0]!=2:
+      c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+      c.execute("VACUUM")
+
+  def _addSearchIndex(self, c:sqlite3.Cursor):
+    """version 6: full-text index over item titles and descriptions
+
+    The index doesn't keep a copy of the texts, it refers to the items table instead. SQLiteStorage keeps it in sync.
+    """
+    c.execute("CREATE VIRTUAL TABLE itemsSearch USING fts5(title,description,content='items',content_rowid='id')")
+    c.execute("INSERT INTO itemsSearch (itemsSearch) VALUES ('rebuild')")
+
+  def _storeDescriptionBlobs(self, c:sqlite3.Cursor):
+    """version 7: item descriptions in a separate table, compressed and stored once per distinct text
+
+    The search index can't refer to the items table for descriptions anymore, it's recreated as contentless index.
+    """
+    c.execute("""CREATE TABLE descriptions (hash BLOB PRIMARY KEY,
+                                            content BLOB NOT NULL,
+                                            refCount INT NOT NULL) WITHOUT ROWID""")
+    c.execute("DROP TABLE itemsSearch")
+    c.execute("CREATE VIRTUAL TABLE itemsSearch USING fts5(title,description,content='')")
+
+    writer=c.connection.cursor()
+    def convert(row, indexed):
+      hash=None
+      if row[4]!=None:
+        hash=self.hashDescription(row[4])
+        writer.execute("""INSERT INTO descriptions (hash,content,refCount) VALUES (?,?,1)
+                            ON CONFLICT (hash) DO UPDATE SET refCount=refCount+1""",(hash,self.descriptionToSQL(row[4])))
+      if indexed:
+        writer.execute("INSERT INTO itemsSearch (rowid,title,description) VALUES (?,?,?)",(row[0],row[3],row[4]))
+      return row[0:4]+(hash,)+row[5:]
+
+    columns="id,feedID,guid,title,descriptionHash,itemURL,publicationDate,publicationDateOffset"
+    self._rebuildTable(c,"items","""id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    feedID INT NOT NULL,
+                                    guid TEXT,
+                                    title TEXT,
+                                    descriptionHash BLOB,
+                                    itemURL TEXT,
+                                    publicationDate INT,
+                                    publicationDateOffset INT""",
+                       columns,lambda row: convert(row,True))
+    self._rebuildTable(c,"archivedItems","""id INTEGER PRIMARY KEY,
+                                            feedID INT NOT NULL,
+                                            guid TEXT,
+                                            title TEXT,
+                                            descriptionHash BLOB,
+                                            itemURL TEXT,
+                                            publicationDate INT,
+                                            publicationDateOffset INT""",
+                       columns,lambda row: convert(row,False))
+    writer.close()
+
+    c.execute("CREATE INDEX itemsFeedPublication ON items (feedID,publicationDate)")
+    c.execute("CREATE UNIQUE INDEX itemsFeedGUID ON items (feedID,guid)")
+    c.execute("CREATE INDEX archivedItemsFeedPublication ON archivedItems (feedID,publicationDate)")
+
+  def _addChangeLog(self, c:sqlite3.Cursor):
+    """version 8: log of committed writes, consumers can resume reading it from a sequence number
+
+    AUTOINCREMENT keeps sequence numbers from being reused after old entries were pruned.
+    """
+    c.execute("""CREATE TABLE changeLog (sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+                                         feedID INT NOT NULL,
+                                         itemIDs TEXT NOT NULL,
+                                         removedItemIDs TEXT NOT NULL,
+                                         lastChanged INT,
+                                         lastChangedOffset INT)""")
+
+  def _addValidators(self, c:sqlite3.Cursor):
+    """version 9: the upstream's ETag and Last-Modified values, kept verbatim for conditional requests
+    """
+    c.execute("ALTER TABLE feeds ADD COLUMN etag TEXT")
+    c.execute("ALTER TABLE feeds ADD COLUMN lastModified TEXT")
+
+  def _addFingerprints(self, c:sqlite3.Cursor):
+    """version 10: hashes of the feeds' last read upstream content and of the items' upstream values
+    """
+    c.execute("ALTER TABLE feeds ADD COLUMN contentHash TEXT")
+    c.execute("ALTER TABLE items ADD COLUMN fingerprint TEXT")
+    c.execute("ALTER TABLE archivedItems ADD COLUMN fingerprint TEXT")
+
+
+class TestSQLiteSchema(unittest.TestCase):
+  """Tests for the SQLiteSchema class.
+  """
+
+  def testFreshDatabase(self):
+    """Tests whether an empty database is migrated to the latest version.
+    """
+    conn=sqlite3.connect(":memory:")
+    schema=SQLiteSchema()
+    self.assertEqual(0,schema.getVersion(conn),"empty database should be unversioned")
+
+    self.assertEqual(schema.getLatestVersion(),schema.migrate(conn),"all migration steps should have been performed")
+    self.assertEqual(schema.getLatestVersion(),schema.getVersion(conn),"database should be at latest version")
+    self.assertEqual(0,schema.migrate(conn),"repeated migration shouldn't do anything")
+    self._assertIndexes(conn)
+
+  def testLegacyDatabaseUpgrade(self):
+    """Tests whether an unversioned database keeps its data and has duplicates removed during migration.
+    """
+    conn=sqlite3.connect(":memory:")
+    c=conn.cursor()
+    c.execute("CREATE TABLE feeds (id INTEGER PRIMARY KEY AUTOINCREMENT, sourceName TEXT NOT NULL, feedURL TEXT NOT NULL, updateInterval INT, title TEXT, description TEXT, websiteURL TEXT, lastRefreshed TEXT, lastChanged TEXT)")
+    c.execute("CREATE TABLE items (id INTEGER PRIMARY KEY AUTOINCREMENT, feedID INT NOT NULL, guid TEXT, title TEXT, description TEXT, itemURL TEXT, publicationDate TEXT)")
+    c.executemany("INSERT INTO feeds (id,sourceName,feedURL,title) VALUES (?,?,?,?)",[(1,"feed","a","first"),
+                                                                                        (2,"feed","b","second"),
+                                                                                        (3,"feed","a","duplicate")])
+    c.execute("UPDATE feeds SET lastRefreshed='2018-10-06 16:17:18.192021', lastChanged='2017-06-15 14:13:12+04:30' WHERE id=1")
+    c.execute("INSERT INTO items (id,feedID,publicationDate) VALUES (7,2,'2016-01-02 03:04:05.060708-01:00')")
+    c.executemany("INSERT INTO items (id,feedID,guid,title,description) VALUES (?,?,?,?,?)",[(1,1,"g1","old",None),
+                                                                                                 (2,2,"g1","other feed","same"),
+                                                                                                 (3,1,None,"no guid",None),
+                                                                                                 (4,1,None,"no guid either","same"),
+                                                                                                 (5,3,"g1","new",None),
+                                                                                                 (6,3,"g2","moved","different")])
+    conn.commit()
+
+    schema=SQLiteSchema()
+    schema.migrate(conn)
+    self.assertEqual(schema.getLatestVersion(),schema.getVersion(conn))
+    self._assertIndexes(conn)
+
+    c.execute("SELECT id,title FROM feeds ORDER BY id")
+    self.assertEqual([(1,"first"),(2,"second")],c.fetchall(),"duplicate feed should have been merged into first one")
+    c.execute("SELECT id,feedID,title FROM items ORDER BY id")
+    self.assertEqual([(2,2,"other feed"),(3,1,"no guid"),(4,1,"no guid either"),(5,1,"new"),(6,1,"moved"),(7,2,None)],
+                     c.fetchall(),
+                     "duplicate feed's items should have been moved, newest duplicate item should have been kept")
+
+    c.execute("SELECT lastRefreshed,lastRefreshedOffset,lastChanged,lastChangedOffset FROM feeds WHERE id=1")
+    row=c.fetchone()
+    self.assertEqual(datetime(2018,10,6,16,17,18,192021),schema.sqlToDatetime(row[0],row[1]),"naive timestamp should be kept")
+    self.assertEqual(datetime(2017,6,15,9,43,12,tzinfo=timezone.utc),schema.sqlToDatetime(row[2],row[3]))
+    self.assertEqual(16200,row[3],"UTC offset should be kept")
+    c.execute("SELECT publicationDate,publicationDateOffset FROM items WHERE id=7")
+    self.assertEqual((1451707445060708,-3600),c.fetchone(),"item timestamp should be converted to UTC microseconds")
+    c.execute("SELECT rowid FROM itemsSearch WHERE itemsSearch MATCH 'moved'")
+    self.assertEqual([(6,)],c.fetchall(),"existing items should have been added to the search index")
+    c.execute("SELECT rowid FROM itemsSearch WHERE itemsSearch MATCH 'same' ORDER BY rowid")
+    self.assertEqual([(2,),(4,)],c.fetchall(),"existing descriptions should have been added to the search index")
+    c.execute("SELECT refCount FROM descriptions ORDER BY refCount")
+    self.assertEqual([(1,),(2,)],c.fetchall(),"identical descriptions should have been stored once")
+    c.execute("SELECT content FROM items JOIN descriptions ON descriptions.hash=items.descriptionHash WHERE items.id=6")
+    self.assertEqual("different",schema.sqlToDescription(c.fetchone()[0]))
+    c.execute("INSERT INTO items (feedID) VALUES (1)")
+    self.assertEqual(8,c.lastrowid,"AUTOINCREMENT counter should have been kept")
+
+  def testItemLookupUsesIndex(self):
+    """Tests whether looking up items by feed ID uses an index instead of scanning the table.
+    """
+    conn=sqlite3.connect(":memory:")
+    SQLiteSchema().migrate(conn)
+    plan=conn.execute("EXPLAIN QUERY PLAN SELECT id,title FROM items WHERE feedID=? ORDER BY publicationDate",(1,)).fetchall()
+    details=" ".join([row[-1] for row in plan])
+    self.assertIn("USING INDEX itemsFeedPublication",details)
+    self.assertNotIn("TEMP B-TREE",details,"ordering by publicationDate shouldn't require sorting")
+
+  def _assertIndexes(self, conn):
+    rows=conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL").fetchall()
+    names=set([row[0] for row in rows])
+    self.assertEqual({"itemsFeedPublication","itemsFeedGUID","feedsSource","archivedItemsFeedPublication"},names)
+    self.assertEqual(2,conn.execute("PRAGMA auto_vacuum").fetchone()[0],"incremental vacuum should be enabled")
+
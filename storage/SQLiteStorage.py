@@ -1,11 +1,12 @@
 import sqlite3
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 import os
-import sys
-from time import sleep
+from time import sleep, time
 from threading import local, Timer
-from typing import List, Union
+from typing import Iterator, List, Union
 import unittest
+from urllib.request import pathname2url
 
 from domain import *
 from logger import get_logger
@@ -18,59 +19,237 @@ log=get_logger(__name__)
 class SQLiteStorage(Storage):
   """Persistent storage implementation using an SQLite backend.
 
-  This is safe for use in multithreaded environments. Each thread will open its own connection handle to the database file, as
-  a result the sqlite's special ":memory:" file won't work across multiple threads - use a temporary local file instead.
+  This is safe for use in multithreaded environments. By default each thread will open its own connection handle to the
+  database file, as a result the sqlite's special ":memory:" file won't work across multiple threads - use a temporary local
+  file instead.
+
+  In WAL mode, writes go through a single dedicated writer connection (guarded by the write lock) while reads use a bounded
+  pool of read-only connections. Readers then see the last committed state and never wait for writers. Without WAL mode,
+  open snapshots keep writers from committing until SQLite's busy timeout expires: reads within snapshots older than
+  maxBlockingSnapshotTime seconds log a warning.
+
+  Every write is recorded in a persistent change log within the same transaction, see .getChanges().
   """
 
   _filename=None
   _threadlocal=None
-
-  def __init__(self, filename:str):
+  _wal=False
+  _writer=None
+  _readers=None
+  _pragmas=None
+
+  _schema=None
+
+  _feedColumns="id,sourceName,feedURL,updateInterval,title,description,websiteURL,lastRefreshed,lastRefreshedOffset,lastChanged,lastChangedOffset,etag,lastModified,contentHash"
+  #             0  1          2       3              4     5           6          7             8                   9           10                11   12           13
+  _itemColumns="id,feedID,guid,title,descriptionHash,itemURL,publicationDate,publicationDateOffset,fingerprint"
+  _itemSelect="items.id,items.feedID,items.guid,items.title,descriptions.content,items.itemURL,items.publicationDate,items.publicationDateOffset,items.fingerprint"
+  #             0        1            2          3           4                    5             6                     7                           8
+  _itemJoin="items LEFT JOIN descriptions ON descriptions.hash=items.descriptionHash"
+  _itemQuery="SELECT %s FROM %s"%(_itemSelect,_itemJoin)
+
+  maxBlockingSnapshotTime=1.0 #: the age of snapshots in seconds when not in WAL mode after which reads log a warning
+  itemIDStep=1                #: new items' IDs are assigned in steps of this size, e.g. to keep several databases' IDs apart
+  itemIDOffset=0              #: the remainder of new items' IDs divided by itemIDStep
+  minItemID=1                 #: the lowest ID to assign to new items, e.g. to stay above other databases' item IDs
+
+  _synchronousModes=["OFF","NORMAL","FULL","EXTRA"]
+  _feedBatchSize=100
+
+  def __init__(self, filename:str, wal:bool=False, read_pool_size:int=4, synchronous:Union[str,None]=None,
+               mmap_size:Union[int,None]=None, cache_size:Union[int,None]=None):
+    """
+    :param str filename: the database file
+    :param bool wal: whether to use WAL mode with a pool of reader connections and a dedicated writer (default: False)
+    :param int read_pool_size: the maximum number of reader connections in WAL mode (default: 4)
+    :param Union[str,None] synchronous: SQLite's "synchronous" setting, one of OFF, NORMAL, FULL, EXTRA (default: SQLite's)
+    :param Union[int,None] mmap_size: the maximum number of bytes to memory-map per connection (default: SQLite's)
+    :param Union[int,None] cache_size: the page cache size per connection, negative values are in KiB (default: SQLite's)
+    :raises ValueError: if WAL mode is requested for an in-memory database, or for invalid settings
+    """
     super().__init__()
     self._filename=filename
     self._threadlocal=local()
-    self._getConnection()
+    self._schema=SQLiteSchema()
+    self._pragmas=self._createPragmas(synchronous,mmap_size,cache_size)
+    if wal:
+      if filename==":memory:":
+        raise ValueError("WAL mode requires a database file")
+      self._wal=True
+      self._writer=self._connect()
+      self._writer.execute("PRAGMA journal_mode=WAL")
+      self._readers=SQLiteConnectionPool(lambda: self._connect(read_only=True),read_pool_size)
     self._setupSchema()
 
-  def _getConnection(self):
+  def _createPragmas(self, synchronous, mmap_size, cache_size) -> List[str]:
+    rv=[]
+    if synchronous!=None:
+      if not synchronous.upper() in self._synchronousModes:
+        raise ValueError("invalid synchronous setting '%s'"%synchronous)
+      rv.append("PRAGMA synchronous=%s"%synchronous.upper())
+    if mmap_size!=None:
+      rv.append("PRAGMA mmap_size=%d"%mmap_size)
+    if cache_size!=None:
+      rv.append("PRAGMA cache_size=%d"%cache_size)
+    return rv
+
+  def _connect(self, read_only:bool=False) -> sqlite3.Connection:
+    if read_only:
+      conn=sqlite3.connect("file:%s?mode=ro"%pathname2url(os.path.abspath(self._filename)),uri=True,check_same_thread=False)
+    else:
+      conn=sqlite3.connect(self._filename,check_same_thread=not self._wal)
+    for pragma in self._pragmas:
+      conn.execute(pragma)
+    return conn
+
+  def _getConnection(self) -> sqlite3.Connection:
+    """returns the connection for writes: the dedicated writer in WAL mode, otherwise the current thread's connection
+    """
+    if self._wal:
+      return self._writer
     if not hasattr(self._threadlocal,"conn"):
-      self._threadlocal.conn=sqlite3.connect(self._filename)
+      self._threadlocal.conn=self._connect()
     return self._threadlocal.conn
 
+  @contextmanager
+  def _readConnection(self):
+    """context manager for read accesses: uses the current snapshot's connection if there is one, otherwise checks out a
+    pooled reader in WAL mode or uses the thread's connection
+    """
+    snapshot=getattr(self._threadlocal,"snapshot",None)
+    if snapshot!=None:
+      age=time()-self._threadlocal.snapshotStart
+      if not self._wal and not self._threadlocal.snapshotWarned and age>self.maxBlockingSnapshotTime:
+        self._threadlocal.snapshotWarned=True
+        log.warning("snapshot held for %.1fs while blocking writers, read into memory within snapshots",age)
+      yield snapshot
+      return
+    if not self._wal:
+      yield self._getConnection()
+      return
+    with self._readers.connection() as conn:
+      yield conn
+
+
+  @contextmanager
+  def snapshot(self):
+    """Context manager for consistent reads, see Storage.snapshot(): the current thread's reads share a read transaction.
+
+    In WAL mode the snapshot holds one of the pooled readers, and neither waits for writers nor blocks them. Otherwise the
+    read transaction uses the thread's connection: writers in other threads can't commit until the block ends, and fail once
+    SQLite's busy timeout expires. Such snapshots need to be short, reads within them log a warning after
+    maxBlockingSnapshotTime seconds.
+    """
+    if getattr(self._threadlocal,"snapshot",None)!=None:
+      yield self
+      return
+    with self._readConnection() as conn:
+      if conn.in_transaction:
+        yield self
+        return
+      conn.execute("BEGIN")
+      self._threadlocal.snapshot=conn
+      self._threadlocal.snapshotStart=time()
+      self._threadlocal.snapshotWarned=False
+      try:
+        yield self
+      finally:
+        self._threadlocal.snapshot=None
+        conn.rollback()
+
+  def snapshotBlocksWriters(self) -> bool:
+    """Checks whether writes have to wait while a snapshot is open: that's the case unless in WAL mode.
+
+    :rtype: bool
+    """
+    return not self._wal
 
   def getFeeds(self) -> List[Feed]:
-    """Returns all stored feeds.
+    """Returns all stored feeds, including their items.
 
     :rtype: List[Feed]
     """
-    c=self._getConnection().cursor()
-    query="SELECT id,sourceName,feedURL,updateInterval,title,description,websiteURL,lastRefreshed,lastChanged FROM feeds"
-    c.execute(query)
-    rv=[]
-    for row in c:
-      feed=self._feedRowToObject(row)
-      feed.items=self.getItemsByFeedID(feed.id)
-      rv.append(feed)
-    c.close()
+    items={}
+    with self.snapshot():
+      feeds=self.getFeedHeaders()
+      with self._readConnection() as conn:
+        c=conn.cursor()
+        for row in c.execute(self._itemQuery+" ORDER BY items.id"):
+          item=self._itemRowToObject(row)
+          items.setdefault(item.feedID,[]).append(item)
+        c.close()
+    for feed in feeds:
+      feed.items=items.get(feed.id,[])
+    return feeds
+
+  def getFeedHeaders(self) -> List[Feed]:
+    """Returns all stored feeds without reading their items: these will be loaded on first access.
+
+    :rtype: List[Feed]
+    """
+    with self._readConnection() as conn:
+      c=conn.cursor()
+      c.execute("SELECT %s FROM feeds ORDER BY id"%self._feedColumns)
+      rv=[self._feedRowToHeader(row) for row in c]
+      c.close()
     return rv
 
+  def iterFeeds(self) -> Iterator[Feed]:
+    """Yields all stored feeds without their items, ordered by ID. Items are loaded on first access.
+
+    Feeds are read in batches by ID and no read connection is kept between batches, so callers may write to this storage
+    while iterating. Feeds written during iteration are returned with their state at the time their batch was read.
+
+    :rtype: Iterator[Feed]
+    """
+    last_id=None
+    while True:
+      with self._readConnection() as conn:
+        c=conn.cursor()
+        if last_id==None:
+          c.execute("SELECT %s FROM feeds ORDER BY id LIMIT ?"%self._feedColumns,(self._feedBatchSize,))
+        else:
+          c.execute("SELECT %s FROM feeds WHERE id>? ORDER BY id LIMIT ?"%self._feedColumns,(last_id,self._feedBatchSize))
+        rows=c.fetchall()
+        c.close()
+      for row in rows:
+        yield self._feedRowToHeader(row)
+      if len(rows)<self._feedBatchSize:
+        return
+      last_id=rows[-1][0]
+
   def getFeedByID(self, id:int) -> Union[Feed,None]:
     """Returns the feed with the given ID, or None if not found
 
     :param int id: the feed ID to look up
     :rtype: Feed or None
     """
-    c=self._getConnection().cursor()
-    query="SELECT id,sourceName,feedURL,updateInterval,title,description,websiteURL,lastRefreshed,lastChanged FROM feeds WHERE id=?"
-    #             0  1          2       3              4     5           6          7             8
-    c.execute(query,(id,))
-    row=c.fetchone()
-    c.close()
+    with self.snapshot():
+      feed=self.getFeedHeaderByID(id)
+      if feed==None:
+        return None
+      feed.items=self.getItemsByFeedID(feed.id)
+    return feed
+
+  def getFeedHeaderByID(self, id:int) -> Union[Feed,None]:
+    """Returns the feed with the given ID without reading its items, or None if not found
+
+    :param int id: the feed ID to look up
+    :rtype: Feed or None
+    """
+    with self._readConnection() as conn:
+      c=conn.cursor()
+      c.execute("SELECT %s FROM feeds WHERE id=?"%self._feedColumns,(id,))
+      row=c.fetchone()
+      c.close()
     if row==None:
       return None
+    return self._feedRowToHeader(row)
 
+  def _feedRowToHeader(self, row):
     feed=self._feedRowToObject(row)
-    feed.items=self.getItemsByFeedID(feed.id)
+    feed_id=feed.id
+    feed.setItemLoader(lambda: self.getItemsByFeedID(feed_id))
     return feed
 
   def _feedRowToObject(self,row):
@@ -82,135 +261,497 @@ class SQLiteStorage(Storage):
     feed.title=row[4]
     feed.description=row[5]
     feed.websiteURL=row[6]
-    feed.lastRefreshed=self._sqlToDatetime(row[7])
-    feed.lastChanged=self._sqlToDatetime(row[8])
+    feed.lastRefreshed=self._schema.sqlToDatetime(row[7],row[8])
+    feed.lastChanged=self._schema.sqlToDatetime(row[9],row[10])
+    feed.etag=row[11]
+    feed.lastModified=row[12]
+    feed.contentHash=row[13]
+    feed.markClean()
     return feed
 
   def putFeed(self, feed:Feed) -> None:
     """Stores a single Feed object.
 
-    If the feed comes with items, the items are stored as well.
+    If the feed comes with items, the items are stored as well. Only new items and items that changed since they were loaded
+    or stored are written, all writes happen in a single transaction. Items of feeds read via getFeedHeaders() aren't loaded
+    just for this.
 
-    To assure thread-safety you need to get a lock by calling .acquireWriteLock() first.
+    To assure thread-safety you need to get a lock by calling .acquireWriteLock() first, or use .writeTransaction().
 
     :param Feed feed: the Feed to store
     :raises AssertionError: if acquireWriteLock() wasn't called before this method
     """
     self._assertIsWriteLocked()
+    with self._transaction() as c:
+      changed=feed.id==None or feed.isDirty()
+      if changed:
+        self._putFeedRow(feed,c)
+      item_ids=[]
+      if feed.hasItemsLoaded():
+        for item in feed.items:
+          item.feedID=feed.id
+        item_ids=self._putItems(feed.id,feed.items,c)
+      self._afterCommit(lambda: self._markFeedClean(feed))
+      if changed or len(item_ids)>0:
+        self._logChange(feed.id,item_ids,[],feed.lastChanged,c)
+
+  def _markFeedClean(self, feed:Feed):
+    feed.markClean()
+    if feed.hasItemsLoaded():
+      for item in feed.items:
+        item.markClean()
+
+  @contextmanager
+  def writeTransaction(self, feed_id:Union[int,None]=None):
+    """Context manager for writes: holds the write lock and stores all writes within the block in a single transaction.
+
+    Writes become visible to other connections, objects are marked clean and change events are published once the block ends.
+    If the block raises an exception, none of its writes are stored.
+
+    :param Union[int,None] feed_id: optional: the feed to lock for, see .acquireWriteLock()
+    """
+    self.acquireWriteLock(feed_id)
+    try:
+      with self._transaction():
+        yield self
+    finally:
+      self.releaseWriteLock(feed_id)
+
+  @contextmanager
+  def _transaction(self):
+    """context manager for write accesses: yields a cursor within the current write transaction, or starts a transaction
+    that's committed at the end of the block. Actions registered with ._afterCommit() run after the outermost block committed.
+    """
+    cursor=getattr(self._threadlocal,"writeCursor",None)
+    if cursor!=None:
+      yield cursor
+      return
     conn=self._getConnection()
     c=conn.cursor()
-    query=self._insertReplace(feed.id,"""%s INTO feeds
-                                    (id,sourceName,feedURL,updateInterval,title,description,websiteURL,lastRefreshed,lastChanged)
-                             VALUES (?, ?,         ?,      ?,             ?,    ?,          ?,         ?,            ?)""")
-    #                                0, 1          2       3              4     5           6          7             8
-    row=(feed.id,
-         feed.sourceName,
+    actions=[]
+    self._threadlocal.writeCursor=c
+    self._threadlocal.afterCommit=actions
+    try:
+      c.execute("BEGIN IMMEDIATE")
+      yield c
+      conn.commit()
+    except:
+      conn.rollback()
+      raise
+    finally:
+      self._threadlocal.writeCursor=None
+      self._threadlocal.afterCommit=None
+      c.close()
+    for action in actions:
+      action()
+
+  def _afterCommit(self, action):
+    self._threadlocal.afterCommit.append(action)
+
+  def _putFeedRow(self, feed:Feed, c):
+    row=(feed.sourceName,
          feed.feedURL,
          self._timedeltaToSQL(feed.updateInterval),
          feed.title,
          feed.description,
-         feed.websiteURL,
-         self._datetimeToSQL(feed.lastRefreshed),
-         self._datetimeToSQL(feed.lastChanged))
-    c.execute(query,row)
-    conn.commit()
+         feed.websiteURL)+\
+        self._schema.datetimeToSQL(feed.lastRefreshed)+\
+        self._schema.datetimeToSQL(feed.lastChanged)+\
+        (feed.etag,
+         feed.lastModified,
+         feed.contentHash,
+         feed.id)
+    if feed.id!=None:
+      c.execute("""UPDATE feeds SET sourceName=?,feedURL=?,updateInterval=?,title=?,description=?,websiteURL=?,lastRefreshed=?,
+                                    lastRefreshedOffset=?,lastChanged=?,lastChangedOffset=?,etag=?,lastModified=?,
+                                    contentHash=?
+                              WHERE id=?""",row)
+      if c.rowcount>0:
+        return
+    c.execute("""INSERT INTO feeds (sourceName,feedURL,updateInterval,title,description,websiteURL,lastRefreshed,lastRefreshedOffset,lastChanged,lastChangedOffset,etag,lastModified,contentHash,id)
+                            VALUES (?,         ?,      ?,             ?,    ?,          ?,         ?,            ?,                  ?,          ?,                ?,   ?,           ?,          ?)""",row)
     if feed.id==None:
       feed.id=c.lastrowid
 
-    for item in feed.items:
-      item.feedID=feed.id
-      self._putItem(item,c)
-    conn.commit()
-    c.close()
+  def _findFeedID(self, source_name:str, feed_url:str) -> Union[int,None]:
+    """returns the ID of the feed with the given source and URL, or None if there isn't one
+    """
+    with self._readConnection() as conn:
+      row=conn.execute("SELECT id FROM feeds WHERE sourceName=? AND feedURL=?",(source_name,feed_url)).fetchone()
+    return row[0] if row!=None else None
+
+  def getItemsByFeedID(self, feed_id:int, limit:Union[int,None]=None, before:Union[datetime,None]=None,
+                       since:Union[datetime,None]=None) -> List[Item]:
+    """Returns a feed's items, ordered by publication date (oldest first).
 
-  def getItemsByFeedID(self, feed_id:int) -> List[Item]:
-    """Returns all items for a given feed ID.
+    Items without publication date come first. If a time window is given, items without publication date are excluded.
 
     :param int feed_id: the feed ID to look up items for
+    :param Union[int,None] limit: optional: the maximum number of items to return, the most recent ones are returned
+    :param Union[datetime,None] before: optional: only return items published before this time
+    :param Union[datetime,None] since: optional: only return items published at or after this time
     :rtype: List[Item]
     """
+    return list(self.iterItems(feed_id,limit=limit,before=before,since=since))
+
+  def iterItems(self, feed_id:int, limit:Union[int,None]=None, before:Union[datetime,None]=None,
+                since:Union[datetime,None]=None) -> Iterator[Item]:
+    """Yields a feed's items straight from the database cursor, see .getItemsByFeedID() for the order and parameters.
+
+    A read connection is used until the iterator is exhausted or closed. In WAL mode that's one of the pooled readers, so
+    iterators shouldn't be kept around unconsumed.
+
+    :rtype: Iterator[Item]
+    """
+    query,params=self._createItemQuery(feed_id,limit,before,since)
+    with self._readConnection() as conn:
+      c=conn.cursor()
+      try:
+        c.execute(query,params)
+        for row in c:
+          yield self._itemRowToObject(row)
+      finally:
+        c.close()
+
+  def _createItemQuery(self, feed_id:int, limit:Union[int,None], before:Union[datetime,None], since:Union[datetime,None]):
+    """builds the item query, all variants are served by the (feedID,publicationDate) index
+
+    Limited queries need to find the most recent items, so these are sorted in descending order first. Only the limited
+    result is sorted again.
+    """
+    query=self._itemQuery+" WHERE items.feedID=?"
+    params=[feed_id]
+    if before!=None:
+      query+=" AND items.publicationDate<?"
+      params.append(self._schema.datetimeToSQL(before)[0])
+    if since!=None:
+      query+=" AND items.publicationDate>=?"
+      params.append(self._schema.datetimeToSQL(since)[0])
+    if limit==None:
+      query+=" ORDER BY items.publicationDate,items.id"
+    else:
+      query="SELECT * FROM (%s ORDER BY items.publicationDate DESC,items.id DESC LIMIT ?) ORDER BY publicationDate,id"%query
+      params.append(limit)
+    return query,params
+
+  def _itemRowToObject(self, row):
+    item=Item()
+    item.id=row[0]
+    item.feedID=row[1]
+    item.guid=row[2]
+    item.title=row[3]
+    content=row[4]
+    if content!=None:
+      item.setDescriptionLoader(lambda: self._schema.sqlToDescription(content))
+    item.itemURL=row[5]
+    item.publicationDate=self._schema.sqlToDatetime(row[6],row[7])
+    item.fingerprint=row[8]
+    item.markClean()
+    return item
+
+  def _putItems(self, feed_id:int, items:List[Item], c):
+    """writes new and changed items with one batched INSERT and one batched UPDATE, leaving all other rows untouched.
+
+    Items without ID that match a stored item's guid update that item. New items get their IDs assigned here, since
+    executemany() doesn't report generated keys - this relies on the surrounding transaction being a write transaction.
+
+    :return: the IDs of the written items
+    """
+    dirty=[item for item in items if item.id==None or item.isDirty()]
+    if len(dirty)<1:
+      return []
+
+    stored_ids=self._findStoredIDs([item.id for item in dirty if item.id!=None],c)
+    guid_ids=self._findIDsByGUID(feed_id,[item.guid for item in dirty if item.id==None and item.guid!=None],c)
+
+    inserts=[]
+    updates=[]
+    for item in dirty:
+      if item.id==None and item.guid in guid_ids:
+        item.id=guid_ids[item.guid]
+        stored_ids.add(item.id)
+      if item.id in stored_ids:
+        updates.append(item)
+      else:
+        inserts.append(item)
+
+    new=[item for item in inserts if item.id==None]
+    if len(new)>0:
+      next_id=max([self._getNextItemID(c),self.minItemID]+[item.id+1 for item in inserts if item.id!=None])
+      next_id+=(self.itemIDOffset-next_id)%self.itemIDStep
+      for item in new:
+        item.id=next_id
+        next_id+=self.itemIDStep
+
+    replaced=self._removeFromSearchIndex([item.id for item in updates],c)
+    insert_hashes=self._addDescriptions(inserts,c)
+    update_hashes=self._addDescriptions(updates,c)
+    c.executemany("""INSERT INTO items (feedID,guid,title,descriptionHash,itemURL,publicationDate,publicationDateOffset,fingerprint,id)
+                                VALUES (?,     ?,   ?,    ?,              ?,      ?,              ?,                    ?,          ?)""",
+                  [self._itemToRow(item,hash) for item,hash in zip(inserts,insert_hashes)])
+    c.executemany("""UPDATE items SET feedID=?,guid=?,title=?,descriptionHash=?,itemURL=?,publicationDate=?,publicationDateOffset=?,
+                                      fingerprint=?
+                            WHERE id=?""",
+                  [self._itemToRow(item,hash) for item,hash in zip(updates,update_hashes)])
+    c.executemany("INSERT INTO itemsSearch (rowid,title,description) VALUES (?,?,?)",
+                  [(item.id,item.title,item.description) for item in inserts+updates])
+    self._releaseDescriptions(replaced,c)
+    return [item.id for item in dirty]
+
+  def _logChange(self, feed_id:int, item_ids:List[int], removed_ids:List[int], last_changed:Union[datetime,None], c):
+    """records a change in the change log as part of the surrounding write transaction, its event is published after committing
+    """
+    c.execute("INSERT INTO changeLog (feedID,itemIDs,removedItemIDs,lastChanged,lastChangedOffset) VALUES (?,?,?,?,?)",
+              (feed_id,self._schema.idsToSQL(item_ids),self._schema.idsToSQL(removed_ids))+
+              self._schema.datetimeToSQL(last_changed))
+    event=ChangeEvent(c.lastrowid,feed_id,item_ids,removed_ids,last_changed)
+    self._afterCommit(lambda: self._publishChange(event))
+
+  def _getLastChanged(self, feed_id:int, c) -> Union[datetime,None]:
+    c.execute("SELECT lastChanged,lastChangedOffset FROM feeds WHERE id=?",(feed_id,))
+    row=c.fetchone()
+    return self._schema.sqlToDatetime(row[0],row[1])
+
+  def getChanges(self, after:int, limit:int) -> List[ChangeEvent]:
+    """Returns logged changes in commit order, starting after the given sequence number.
+
+    The change log is part of the database: consumers can resume after restarts by keeping the last sequence number they
+    processed. Sequence numbers are never reused, they're not necessarily contiguous.
+
+    :param int after: the last sequence number already processed, 0 to start at the oldest logged change
+    :param int limit: the maximum number of changes to return
+    :rtype: List[ChangeEvent]
+    """
+    with self._readConnection() as conn:
+      c=conn.cursor()
+      c.execute("""SELECT sequence,feedID,itemIDs,removedItemIDs,lastChanged,lastChangedOffset FROM changeLog
+                     WHERE sequence>? ORDER BY sequence LIMIT ?""",(after,limit))
+      rows=c.fetchall()
+      c.close()
+    return [ChangeEvent(row[0],row[1],self._schema.sqlToIDs(row[2]),self._schema.sqlToIDs(row[3]),
+                        self._schema.sqlToDatetime(row[4],row[5])) for row in rows]
+
+  def pruneChanges(self, keep:int) -> int:
+    """Deletes logged changes except for the given number of most recent ones.
+
+    To assure thread-safety you need to get a lock by calling .acquireWriteLock() first, or use .writeTransaction().
+
+    :param int keep: the number of changes to keep
+    :return: the number of changes deleted
+    :rtype: int
+    :raises AssertionError: if acquireWriteLock() wasn't called before this method
+    """
+    self._assertIsWriteLocked()
+    with self._transaction() as c:
+      c.execute("DELETE FROM changeLog WHERE sequence<=(SELECT sequence FROM changeLog ORDER BY sequence DESC LIMIT 1 OFFSET ?)",
+                (keep,))
+      return c.rowcount
+
+  def _itemToRow(self, item:Item, description_hash:Union[bytes,None]) -> tuple:
+    return (item.feedID,
+            item.guid,
+            item.title,
+            description_hash,
+            item.itemURL)+\
+           self._schema.datetimeToSQL(item.publicationDate)+\
+           (item.fingerprint,
+            item.id)
+
+  def _addDescriptions(self, items:List[Item], c) -> List[Union[bytes,None]]:
+    """adds a reference to each item's description, storing descriptions that aren't known yet
+
+    :return: the description hashes, in the same order as the items
+    """
+    hashes=[]
+    texts={}
+    for item in items:
+      hash=None
+      if item.description!=None:
+        hash=self._schema.hashDescription(item.description)
+        texts[hash]=item.description
+      hashes.append(hash)
+
+    known=set()
+    for chunk in self._chunks(list(texts.keys())):
+      c.execute("SELECT hash FROM descriptions WHERE hash IN (%s)"%",".join("?"*len(chunk)),chunk)
+      known.update([row[0] for row in c.fetchall()])
+    c.executemany("INSERT INTO descriptions (hash,content,refCount) VALUES (?,?,0)",
+                  [(hash,self._schema.descriptionToSQL(text)) for hash,text in texts.items() if not hash in known])
+    c.executemany("UPDATE descriptions SET refCount=refCount+1 WHERE hash=?",[(hash,) for hash in hashes if hash!=None])
+    return hashes
+
+  def _releaseDescriptions(self, hashes:List[bytes], c):
+    """removes a reference to each of the given descriptions, deleting descriptions that aren't referenced anymore
+    """
+    c.executemany("UPDATE descriptions SET refCount=refCount-1 WHERE hash=?",[(hash,) for hash in hashes])
+    for chunk in self._chunks(list(set(hashes))):
+      c.execute("DELETE FROM descriptions WHERE refCount<1 AND hash IN (%s)"%",".join("?"*len(chunk)),chunk)
+
+  def _removeFromSearchIndex(self, ids:List[int], c) -> List[bytes]:
+    """removes items from the full-text index, this needs to happen before the items are changed or deleted
+
+    The index doesn't store the indexed texts, so removing entries requires passing the texts that were indexed.
+
+    :return: the removed items' description hashes
+    """
     rv=[]
-    c=self._getConnection().cursor()
-    query="SELECT id,feedID,guid,title,description,itemURL,publicationDate FROM items WHERE feedID=?"
-    #             0  1      2    3     4           5       6
-    for row in c.execute(query,(feed_id,)):
-      item=Item()
-      item.id=row[0]
-      item.feedID=row[1]
-      item.guid=row[2]
-      item.title=row[3]
-      item.description=row[4]
-      item.itemURL=row[5]
-      item.publicationDate=self._sqlToDatetime(row[6])
-      rv.append(item)
-    c.close()
+    for chunk in self._chunks(ids):
+      c.execute("SELECT items.id,items.title,descriptions.content,items.descriptionHash FROM %s WHERE items.id IN (%s)"
+                %(self._itemJoin,",".join("?"*len(chunk))),chunk)
+      rows=c.fetchall()
+      c.executemany("INSERT INTO itemsSearch (itemsSearch,rowid,title,description) VALUES ('delete',?,?,?)",
+                    [(row[0],row[1],self._schema.sqlToDescription(row[2])) for row in rows])
+      rv+=[row[3] for row in rows if row[3]!=None]
+    return rv
+
+  def _findStoredIDs(self, ids:List[int], c) -> set:
+    rv=set()
+    for chunk in self._chunks(ids):
+      c.execute("SELECT id FROM items WHERE id IN (%s)"%",".join("?"*len(chunk)),chunk)
+      rv.update([row[0] for row in c.fetchall()])
+    return rv
+
+  def _findIDsByGUID(self, feed_id:int, guids:List[str], c) -> dict:
+    rv={}
+    for chunk in self._chunks(guids):
+      c.execute("SELECT guid,id FROM items WHERE feedID=? AND guid IN (%s)"%",".join("?"*len(chunk)),[feed_id]+chunk)
+      rv.update(c.fetchall())
     return rv
 
-  def _putItem(self, item:Item, c):
-    query=self._insertReplace(item.id,"""%s INTO items (id,feedID,guid,title,description,itemURL,publicationDate)
-                                                VALUES (?, ?,     ?,   ?,    ?,          ?,      ?)""")
-    #                                                   0, 1      2    3     4           5       6
-    row=(item.id,
-         item.feedID,
-         item.guid,
-         item.title,
-         item.description,
-         item.itemURL,
-         self._datetimeToSQL(item.publicationDate))
-    c.execute(query,row)
-    if item.id==None:
-      item.id=c.lastrowid
-
-  def _insertReplace(self,id,template:str) -> str:
-    """helper method for compatibility with Python versions before 3.6.
-
-    We need the last primary key generated/changed, this isn't implemented for the REPLACE statement until Python 3.6.
-    """
-    verb="INSERT"
-    if id!=None:
-      verb="REPLACE"
-    return template%verb
+  def _getNextItemID(self, c) -> int:
+    c.execute("SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM items UNION ALL SELECT seq FROM sqlite_sequence WHERE name='items')")
+    last=c.fetchone()[0]
+    if last==None:
+      return 1
+    return last+1
+
+  def _chunks(self, values:list, size:int=500):
+    for start in range(0,len(values),size):
+      yield values[start:start+size]
+
+  def markRefreshed(self, feed_id:int, last_refreshed:datetime) -> None:
+    """Stores a feed's last refresh time with a single UPDATE, without logging a change.
+
+    To assure thread-safety you need to get a lock by calling .acquireWriteLock() first, or use .writeTransaction().
+
+    :param int feed_id: the feed's ID, unknown feeds are ignored
+    :param datetime last_refreshed: the feed's new lastRefreshed value
+    :raises AssertionError: if acquireWriteLock() wasn't called before this method
+    """
+    self._assertIsWriteLocked()
+    with self._transaction() as c:
+      c.execute("UPDATE feeds SET lastRefreshed=?,lastRefreshedOffset=? WHERE id=?",
+                self._schema.datetimeToSQL(last_refreshed)+(feed_id,))
 
   def putItem(self, item:Item) -> None:
     """Stores a single item.
 
     TODO: improve handling of orphaned items, probably throw exception
 
-    To assure thread-safety you need to get a lock by calling .acquireWriteLock() first.
+    To assure thread-safety you need to get a lock by calling .acquireWriteLock() first, or use .writeTransaction().
 
     :param Item item: the item to store
     :raises AssertionError: if acquireWriteLock() wasn't called before this method
     """
     self._assertIsWriteLocked()
-    feed=self.getFeedByID(item.feedID)
-    if feed==None:
-      return
-    conn=self._getConnection()
-    c=conn.cursor()
-    self._putItem(item,c)
-    conn.commit()
-    c.close()
+    with self._transaction() as c:
+      c.execute("SELECT id FROM feeds WHERE id=?",(item.feedID,))
+      if c.fetchone()==None:
+        return
+      item_ids=self._putItems(item.feedID,[item],c)
+      self._afterCommit(item.markClean)
+      if len(item_ids)>0:
+        self._logChange(item.feedID,item_ids,[],self._getLastChanged(item.feedID,c),c)
+
+  def searchItems(self, query:str, limit:int) -> List[Item]:
+    """Returns the items containing all words of the query in their title or description, most relevant first.
+
+    Lookups go through the full-text index, relevance is SQLite's BM25 ranking with title matches weighing ten times as much
+    as description matches.
+
+    :param str query: the words to search for
+    :param int limit: the maximum number of items to return
+    :rtype: List[Item]
+    """
+    return [item for score,item in self._searchRankedItems(query,limit)]
 
-  def _setupSchema(self):
+  def _searchRankedItems(self, query:str, limit:int) -> List[tuple]:
+    """returns the matching items along with their BM25 scores, lower scores are more relevant
+    """
+    terms=self._getSearchTerms(query)
+    if len(terms)<1:
+      return []
+    expression=" ".join(['"%s"'%term for term in terms])
+    with self._readConnection() as conn:
+      c=conn.cursor()
+      c.execute("""SELECT %s,hits.score FROM %s
+                     JOIN (SELECT rowid AS itemID,bm25(itemsSearch,10.0,1.0) AS score FROM itemsSearch
+                            WHERE itemsSearch MATCH ? ORDER BY score,itemID LIMIT ?) hits ON items.id=hits.itemID
+                    ORDER BY hits.score,hits.itemID"""%(self._itemSelect,self._itemJoin),(expression,limit))
+      rv=[(row[9],self._itemRowToObject(row)) for row in c]
+      c.close()
+    return rv
+
+  def compactItems(self, feed_id:int, policy:RetentionPolicy, limit:int) -> int:
+    """Deletes or archives a batch of a feed's items that the retention policy doesn't keep.
+
+    To assure thread-safety you need to get a lock by calling .acquireWriteLock() first, or use .writeTransaction().
+
+    :param int feed_id: the feed ID to compact items for
+    :param RetentionPolicy policy: the retention policy to apply
+    :param int limit: the maximum number of items to remove in this call
+    :return: the number of items removed
+    :rtype: int
+    :raises AssertionError: if acquireWriteLock() wasn't called before this method
+    """
+    self._assertIsWriteLocked()
+    with self._transaction() as c:
+      ids=self._findExpiredItemIDs(feed_id,policy,limit,c)
+      hashes=self._removeFromSearchIndex(ids,c)
+      for chunk in self._chunks(ids):
+        placeholders=",".join("?"*len(chunk))
+        if policy.archive:
+          c.execute("INSERT INTO archivedItems (%s) SELECT %s FROM items WHERE id IN (%s)"%(self._itemColumns,self._itemColumns,placeholders),chunk)
+        c.execute("DELETE FROM items WHERE id IN (%s)"%placeholders,chunk)
+      if not policy.archive:
+        self._releaseDescriptions(hashes,c)
+      if len(ids)>0:
+        self._logChange(feed_id,[],ids,self._getLastChanged(feed_id,c),c)
+    return len(ids)
+
+  def _findExpiredItemIDs(self, feed_id:int, policy:RetentionPolicy, limit:int, c) -> List[int]:
+    rv=[]
+    if policy.maxItems!=None:
+      c.execute("SELECT id FROM items WHERE feedID=? ORDER BY publicationDate DESC,id DESC LIMIT ? OFFSET ?",(feed_id,limit,policy.maxItems))
+      rv=[row[0] for row in c.fetchall()]
+    cutoff=policy.getCutoff()
+    if cutoff!=None and len(rv)<limit:
+      c.execute("SELECT id FROM items WHERE feedID=? AND publicationDate<? ORDER BY publicationDate LIMIT ?",
+                (feed_id,self._schema.datetimeToSQL(cutoff)[0],limit))
+      found=set(rv)
+      rv+=[row[0] for row in c.fetchall() if not row[0] in found][0:limit-len(rv)]
+    return rv
+
+  def reclaimSpace(self, pages:int) -> int:
+    """Returns up to the given number of free pages to the file system, using SQLite's incremental vacuum.
+
+    To assure thread-safety you need to get a lock by calling .acquireWriteLock() first, or use .writeTransaction().
+
+    :param int pages: the maximum number of pages to release
+    :return: the number of free pages left
+    :rtype: int
+    :raises AssertionError: if acquireWriteLock() wasn't called before this method
+    """
+    self._assertIsWriteLocked()
     c=self._getConnection().cursor()
-    c.execute("""CREATE TABLE IF NOT EXISTS feeds (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                                   sourceName TEXT NOT NULL,
-                                                   feedURL TEXT NOT NULL,
-                                                   updateInterval INT,
-                                                   title TEXT,
-                                                   description TEXT,
-                                                   websiteURL TEXT,
-                                                   lastRefreshed TEXT,
-                                                   lastChanged TEXT)""")
-
-    c.execute("""CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                                   feedID INT NOT NULL,
-                                                   guid TEXT,
-                                                   title TEXT,
-                                                   description TEXT,
-                                                   itemURL TEXT,
-                                                   publicationDate TEXT)""")
+    c.execute("PRAGMA incremental_vacuum(%d)"%pages).fetchall()
+    c.execute("PRAGMA freelist_count")
+    rv=c.fetchone()[0]
     c.close()
+    return rv
+
+  def _setupSchema(self):
+    self._schema.migrate(self._getConnection())
 
   def _sqlToTimedelta(self,raw:str) -> Union[timedelta,None]:
     if raw==None:
@@ -222,42 +763,13 @@ class SQLiteStorage(Storage):
       return None
     return obj.total_seconds()
 
-  def _sqlToDatetime(self,raw:str) -> Union[datetime,None]:
-    if raw==None:
-      return None
-    if sys.version_info>=(3,7):
-      return datetime.fromisoformat(raw) #requires Python 3.7+
-
-    plain=datetime.strptime(raw[0:19],"%Y-%m-%d %H:%M:%S")
-    microseconds=0
-    tz=None
-    remainder=raw[19:]
-    if remainder[0]==".":
-      microseconds=int(remainder[1:7])
-      remainder=remainder[7:]
-    if remainder!="":
-      sign=None
-      if remainder[0]=="+":
-        sign=1
-      elif remainder[0]=="-":
-        sign=-1
-      parts=remainder[1:].split(":")
-      minutes=int(parts[0])*60
-      if 1 in parts:
-        minutes+=parts[0]
-      tz=timezone(timedelta(seconds=sign*minutes))
-    return datetime(plain.year,plain.month,plain.day,plain.hour,plain.minute,plain.second,microseconds,tz)
-
-  def _datetimeToSQL(self,obj:Union[datetime,None]) -> Union[int,None]:
-    if obj==None:
-      return None
-    return obj.isoformat(" ")
-
   def close(self):
-    """Closes the (thread-local) SQLite connection.
+    """Closes the (thread-local) SQLite connection, or in WAL mode the writer and all idle reader connections.
 
     This method is mainly useful for multihreaded tests.
     """
+    if self._wal:
+      self._readers.close()
     self._getConnection().close()
 
 
@@ -289,17 +801,227 @@ class TestSQLiteStorage(BaseStorageTest,unittest.TestCase):
     storage.releaseWriteLock()
 
     c=storage._getConnection().cursor()
-    c.execute("SELECT id,updateInterval,lastRefreshed,lastChanged FROM feeds WHERE id=1")
+    c.execute("SELECT id,updateInterval,lastRefreshed,lastRefreshedOffset,lastChanged,lastChangedOffset FROM feeds WHERE id=1")
     feed_row=c.fetchone()
     self.assertIsNotNone(feed_row,"should have found a 'feeds' row")
     self.assertEqual(12*60+37,feed_row[1],"stored feed interval should be 12m37s in seconds")
-    self.assertEqual("2018-10-06 16:17:18.192021",feed_row[2],"stored lastRefreshed should be in expected date format")
-    self.assertEqual("2017-06-15 14:13:12.111009+04:30",feed_row[3],"stored lastChanged should include timezone offset")
+    self.assertEqual((1538842638192021,None),feed_row[2:4],"naive lastRefreshed should be stored as UTC without offset")
+    self.assertEqual((1497519792111009,16200),feed_row[4:6],"lastChanged should be stored as UTC with offset")
 
-    c.execute("SELECT id,publicationDate FROM items WHERE id=1")
+    c.execute("SELECT id,publicationDate,publicationDateOffset FROM items WHERE id=1")
     item_row=c.fetchone()
     self.assertIsNotNone(item_row,"should have found an 'items' row")
-    self.assertEqual("2016-01-02 03:04:05.060708",item_row[1],"stored publicationDate should be in expected date format")
+    self.assertEqual((1451703845060708,None),item_row[1:3],"stored publicationDate should be in microseconds")
+
+    stored=storage.getFeedByID(1)
+    self.assertEqual(feed.lastRefreshed,stored.lastRefreshed)
+    self.assertEqual(feed.lastChanged,  stored.lastChanged)
+    self.assertEqual(feed.lastChanged.utcoffset(),stored.lastChanged.utcoffset(),"offset should have been kept")
+    self.assertEqual(item.publicationDate,stored.items[0].publicationDate)
+
+
+  def testPutFeedWritesOnlyChanges(self):
+    """Tests whether putFeed() leaves unchanged rows alone.
+    """
+    storage=self._createStorage()
+    feed=Feed(sourceName="test",feedURL="uri://delta")
+    for tc in range(0,3):
+      item=Item(title="item %d"%tc)
+      item.guid="guid %d"%tc
+      feed.items.append(item)
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+
+    stored=storage.getFeedByID(feed.id)
+    stored.items[1].title="changed"
+    added=Item(feedID=feed.id,title="added")
+    added.guid="guid 1"
+    stored.items.append(Item(title="new"))
+
+    conn=storage._getConnection()
+    conn.execute("CREATE TEMP TABLE writtenItems (id INT)")
+    conn.execute("CREATE TEMP TRIGGER itemInserted AFTER INSERT ON items BEGIN INSERT INTO writtenItems VALUES (new.id); END")
+    conn.execute("CREATE TEMP TRIGGER itemUpdated AFTER UPDATE ON items BEGIN INSERT INTO writtenItems VALUES (new.id); END")
+    storage.putFeed(stored)
+    written=[row[0] for row in conn.execute("SELECT id FROM writtenItems ORDER BY id")]
+    self.assertEqual([stored.items[1].id,stored.items[3].id],written,"only the changed and the new item should have been written")
+
+    storage.putItem(added)
+    storage.releaseWriteLock()
+    self.assertEqual(stored.items[1].id,added.id,"item with known guid should update the existing item")
+
+    titles=[item.title for item in storage.getItemsByFeedID(feed.id)]
+    self.assertEqual(["item 0","added","item 2","new"],titles)
+
+  def testFeedHeadersDontQueryItems(self):
+    """Tests whether getFeedHeaders() reads all feeds without touching the items table.
+    """
+    storage=self._createStorage()
+    storage.acquireWriteLock()
+    for tc in range(0,3):
+      feed=Feed(sourceName="test",feedURL="uri://%d"%tc)
+      feed.items=[Item(title="item")]
+      storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    statements=[]
+    storage._getConnection().set_trace_callback(statements.append)
+    headers=storage.getFeedHeaders()
+    self.assertEqual(3,len(headers))
+    self.assertEqual(1,len(statements),"should have read all headers with one query")
+    self.assertNotIn("items",statements[0])
+
+    storage.getFeeds()
+    queries=[statement for statement in statements if statement.startswith("SELECT")]
+    self.assertEqual(3,len(queries),"should have read all feeds with items with two queries")
+    self.assertEqual(["BEGIN","ROLLBACK"],[statements[1],statements[-1]],"both queries should share a read transaction")
+
+  def testSearchUsesIndex(self):
+    """Tests whether searchItems() looks up items through the full-text index.
+    """
+    storage=self._createStorage()
+    statements=[]
+    conn=storage._getConnection()
+    conn.set_trace_callback(statements.append)
+    storage.searchItems("needle",10)
+    conn.set_trace_callback(None)
+
+    query=[statement for statement in statements if "MATCH" in statement][0]
+    plan=conn.execute("EXPLAIN QUERY PLAN "+query).fetchall()
+    details=" ".join([row[-1] for row in plan])
+    self.assertIn("VIRTUAL TABLE INDEX",details,"should have searched the full-text index")
+    self.assertIn("SEARCH items USING INTEGER PRIMARY KEY",details,"should have looked up matching items by ID")
+    self.assertNotIn("SCAN items ",details,"shouldn't have scanned the items table")
+
+  def testDescriptionBlobs(self):
+    """Tests whether descriptions are stored once per distinct text, reference counted and decompressed only when accessed.
+    """
+    storage=self._createStorage()
+    boilerplate="<p>shared footer</p>"*50
+    storage.acquireWriteLock()
+    for feed_id in [1,2]:
+      feed=Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id)
+      for title in ["a","b"]:
+        item=Item(title=title)
+        item.guid=title
+        item.description=boilerplate
+        feed.items.append(item)
+      storage.putFeed(feed)
+
+    conn=storage._getConnection()
+    blobs=lambda: conn.execute("SELECT refCount,LENGTH(content) FROM descriptions ORDER BY refCount").fetchall()
+    self.assertEqual(1,len(blobs()),"identical descriptions should have been stored once")
+    self.assertEqual(4,blobs()[0][0],"description should be referenced by all items")
+    self.assertLess(blobs()[0][1],len(boilerplate)/10,"description should have been compressed")
+
+    stored=storage.getFeedByID(1)
+    self.assertFalse(stored.items[0].hasDescriptionLoaded(),"loaded description shouldn't be decompressed yet")
+    self.assertEqual(boilerplate,stored.items[0].description)
+    self.assertTrue(stored.items[0].hasDescriptionLoaded())
+    unloaded=storage.getFeedByID(2).items[0]
+    unloaded.setDescriptionLoader(lambda: self.fail("replaced description shouldn't have been loaded"))
+    unloaded.description=boilerplate
+    self.assertTrue(unloaded.isDirty(),"replacing an unloaded description should have marked the item dirty")
+
+    stored.items[0].description="changed"
+    stored.items[1].title="retitled"
+    storage.putFeed(stored)
+    self.assertEqual([(1,),(3,)],[row[0:1] for row in blobs()],"references should have been moved to the new description")
+    self.assertEqual(["a","b","retitled"],sorted([item.title for item in storage.searchItems("shared footer",10)]))
+
+    storage.compactItems(2,RetentionPolicy(max_items=0),10)
+    storage.compactItems(1,RetentionPolicy(max_items=0,archive=True),10)
+    storage.releaseWriteLock()
+    self.assertEqual([(1,),(1,)],[row[0:1] for row in blobs()],"only archived items should keep their descriptions")
+
+  def testIterators(self):
+    """Tests whether feeds are read in batches and items are read from the cursor as they're consumed.
+    """
+    storage=self._createStorage()
+    storage._feedBatchSize=2
+    storage.acquireWriteLock()
+    for feed_id in range(1,6):
+      storage.putFeed(Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id))
+    feed=storage.getFeedHeaderByID(1)
+    feed.items=[Item(title="item %d"%tc) for tc in range(0,3)]
+    storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    statements=[]
+    storage._getConnection().set_trace_callback(statements.append)
+    self.assertEqual([1,2,3,4,5],[feed.id for feed in storage.iterFeeds()])
+    self.assertEqual(3,len(statements),"should have read feeds in batches")
+
+    items=storage.iterItems(1)
+    self.assertEqual("item 0",next(items).title)
+    self.assertEqual(4,len(statements),"items should be read with a single query")
+    self.assertEqual(["item 1","item 2"],[item.title for item in items],"remaining items should be read from the cursor")
+    self.assertEqual(["item 1","item 2"],[item.title for item in storage.iterItems(1,limit=2)])
+
+  def testShortSnapshots(self):
+    """Tests whether reads within snapshots that block writers log a warning once the snapshot is too old, but still work.
+    """
+    storage=self._createStorage()
+    storage.maxBlockingSnapshotTime=0.1
+    storage.acquireWriteLock()
+    storage.putFeed(Feed(id=1,sourceName="test",feedURL="uri://test"))
+    storage.releaseWriteLock()
+    self.assertTrue(storage.snapshotBlocksWriters())
+
+    with storage.snapshot():
+      self.assertEqual(1,storage.getFeedHeaderByID(1).id)
+      sleep(0.15)
+      with self.assertLogs(log,"WARNING") as logs:
+        self.assertEqual(1,storage.getFeedHeaderByID(1).id,"old snapshot should still be readable")
+        self.assertEqual([],storage.getFeedHeaders()[1:])
+    self.assertEqual(1,len(logs.records),"should have warned once per snapshot")
+
+  def testPutFeedIsAtomic(self):
+    """Tests whether a failing putFeed() doesn't leave partial data behind.
+    """
+    storage=self._createStorage()
+    feed=Feed(sourceName="test",feedURL="uri://atomic")
+    for tc in range(0,2):
+      item=Item(title="item %d"%tc)
+      item.guid="duplicate"
+      feed.items.append(item)
+
+    storage.acquireWriteLock()
+    with self.assertRaises(sqlite3.IntegrityError):
+      storage.putFeed(feed)
+    storage.releaseWriteLock()
+    self.assertEqual([],storage.getFeeds(),"failed write shouldn't have stored the feed")
+
+  def testWriteTransaction(self):
+    """Tests whether writes within a write transaction are committed once, or discarded entirely on errors.
+    """
+    storage=self._createStorage()
+    statements=[]
+    storage._getConnection().set_trace_callback(statements.append)
+    events=[]
+    storage.subscribe(events.append)
+    feeds=[Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id) for feed_id in range(1,4)]
+    with storage.writeTransaction():
+      for feed in feeds:
+        storage.putFeed(feed)
+      self.assertEqual([],events,"events should be published after committing")
+      self.assertTrue(feeds[0].isDirty(),"feeds should be marked clean after committing")
+    self.assertEqual(1,statements.count("BEGIN IMMEDIATE"),"should have used a single transaction")
+    self.assertEqual(3,len(events))
+    self.assertFalse(feeds[0].isDirty())
+
+    events.clear()
+    with self.assertRaises(RuntimeError):
+      with storage.writeTransaction():
+        storage.putFeed(Feed(id=4,sourceName="test",feedURL="uri://4"))
+        feeds[0].title="changed"
+        storage.putFeed(feeds[0])
+        raise RuntimeError()
+    self.assertEqual([1,2,3],[feed.id for feed in storage.getFeedHeaders()],"failed transaction should have been discarded")
+    self.assertEqual(None,storage.getFeedHeaderByID(1).title)
+    self.assertTrue(feeds[0].isDirty(),"discarded changes should still be pending")
+    self.assertEqual([],events,"discarded changes shouldn't have been published")
+    self.assertFalse(storage.isWriteLocked())
 
 
   def testPutFeedWriteLock(self):
@@ -378,3 +1100,125 @@ class TestSQLiteStorage(BaseStorageTest,unittest.TestCase):
 
     os.remove(filename)
 
+
+class TestWALSQLiteStorage(BaseStorageTest,unittest.TestCase):
+  """Tests for the SQLiteStorage class in WAL mode.
+  """
+
+  _filename="test."+__name__+".wal.sqlite"
+  _storage=None
+
+  def _createStorage(self, **kwargs):
+    self._removeFiles()
+    self._storage=SQLiteStorage(self._filename,wal=True,**kwargs)
+    return self._storage
+
+  def tearDown(self):
+    """test fixture, called by unittest after each test.
+    """
+    if self._storage!=None:
+      self._storage.close()
+      self._storage=None
+    self._removeFiles()
+
+  def _removeFiles(self):
+    for suffix in ["","-wal","-shm"]:
+      if os.path.isfile(self._filename+suffix):
+        os.remove(self._filename+suffix)
+
+
+  def testLongSnapshots(self):
+    """Tests whether snapshots in WAL mode may be held for long without warnings, since they don't block writers.
+    """
+    storage=self._createStorage()
+    storage.maxBlockingSnapshotTime=0
+    self.assertFalse(storage.snapshotBlocksWriters())
+    with storage.snapshot():
+      sleep(0.01)
+      self.assertEqual([],storage.getFeedHeaders())
+
+  def testReadsDontWaitForWriter(self):
+    """Tests whether reads see the last committed state while a write transaction is in progress.
+    """
+    storage=self._createStorage()
+    storage.acquireWriteLock()
+    storage.putFeed(Feed(sourceName="test",feedURL="uri://committed"))
+
+    writer=storage._getConnection()
+    writer.execute("BEGIN EXCLUSIVE")
+    writer.execute("INSERT INTO feeds (sourceName,feedURL) VALUES ('test','uri://uncommitted')")
+
+    start=time()
+    feeds=storage.getFeedHeaders()
+    self.assertLess(time()-start,1,"read shouldn't have waited for the writer")
+    self.assertEqual(["uri://committed"],[feed.feedURL for feed in feeds],"read should only see committed data")
+
+    writer.commit()
+    storage.releaseWriteLock()
+    self.assertEqual(2,len(storage.getFeedHeaders()),"read should see data after commit")
+
+  def testSnapshotIsolation(self):
+    """Tests whether reads within a snapshot don't see writes committed during the snapshot, without blocking the writer.
+    """
+    storage=self._createStorage()
+    feed=Feed(id=1,sourceName="test",feedURL="uri://test",title="old")
+    feed.items=[Item(title="old item")]
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    with storage.snapshot():
+      header=storage.getFeedHeaderByID(1)
+      update=storage.getFeedHeaderByID(1)
+      update.title="new"
+      update.items=[Item(title="new item")]
+      storage.acquireWriteLock()
+      storage.putFeed(update)
+      storage.releaseWriteLock()
+      self.assertEqual("old",header.title)
+      self.assertEqual(["old item"],[item.title for item in storage.iterItems(1)],"snapshot shouldn't see new items")
+      self.assertEqual("old",storage.getFeedByID(1).title,"snapshot shouldn't see new feed data")
+    self.assertEqual(["old item","new item"],[item.title for item in storage.getFeedByID(1).items],"write should be visible afterwards")
+    self.assertEqual("new",storage.getFeedHeaderByID(1).title)
+    self.assertEqual(1,len(storage._readers._idle),"snapshot should have returned its reader")
+
+  def testIteratorReleasesReader(self):
+    """Tests whether item iterators return their reader connection once they're exhausted or closed.
+    """
+    storage=self._createStorage(read_pool_size=1)
+    feed=Feed(id=1,sourceName="test",feedURL="uri://test")
+    feed.items=[Item(title="item %d"%tc) for tc in range(0,3)]
+    storage.acquireWriteLock()
+    storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    items=storage.iterItems(1)
+    next(items)
+    self.assertEqual([],storage._readers._idle,"unfinished iterator should keep its reader")
+    items.close()
+    self.assertEqual(1,len(storage._readers._idle),"closed iterator should have returned its reader")
+    self.assertEqual(3,len(list(storage.iterItems(1))))
+    self.assertEqual(1,len(storage._readers._idle),"exhausted iterator should have returned its reader")
+
+  def testPragmas(self):
+    """Tests whether tuning settings are applied to the writer and reader connections.
+    """
+    storage=self._createStorage(synchronous="normal",mmap_size=1048576,cache_size=-4096)
+    writer=storage._getConnection()
+    self.assertEqual("wal",  writer.execute("PRAGMA journal_mode").fetchone()[0])
+    self.assertEqual(1,      writer.execute("PRAGMA synchronous").fetchone()[0],"synchronous should be NORMAL")
+    self.assertEqual(1048576,writer.execute("PRAGMA mmap_size").fetchone()[0])
+    with storage._readConnection() as reader:
+      self.assertIsNot(writer,reader,"reads should use separate connections")
+      self.assertEqual(-4096,reader.execute("PRAGMA cache_size").fetchone()[0])
+      with self.assertRaises(sqlite3.OperationalError):
+        reader.execute("INSERT INTO feeds (sourceName,feedURL) VALUES ('test','uri://readonly')")
+
+  def testInvalidSettings(self):
+    """Tests whether WAL mode for in-memory databases and invalid settings are rejected.
+    """
+    with self.assertRaises(ValueError):
+      SQLiteStorage(":memory:",wal=True)
+    with self.assertRaises(ValueError):
+      self._createStorage(synchronous="sometimes")
+
@@ -0,0 +1,534 @@
+from contextlib import contextmanager, ExitStack
+from datetime import datetime
+from heapq import merge
+import io
+from itertools import islice
+import os
+import sqlite3
+from threading import Lock, Thread
+from time import sleep
+from typing import Iterator, List, Union
+import unittest
+
+from domain import *
+from storage import *
+
+
+class ShardedSQLiteStorage(Storage):
+  """Persistent storage implementation partitioning feeds across several SQLite database files.
+
+  Each feed and its items are stored in shard number <feed ID> modulo <number of shards>. Every shard is a separate
+  SQLiteStorage with its own write lock: writers locking individual feeds (see .acquireWriteLock()) only wait for writers of
+  feeds in the same shard. Reads are passed on to the responsible shard, or combined from all shards.
+
+  Change events are published by each shard, their sequence numbers are only unique within a shard. .getChanges() combines
+  the shards' change logs, positions in the combined log consist of one sequence number per shard.
+
+  Feed IDs and feed URLs (per source) are unique across all shards. New items get IDs that are unique across all shards as
+  well: each shard assigns IDs in steps of <number of shards>, the remainder being the shard number, starting above the
+  highest item ID in any shard. Items stored by earlier versions may share IDs with items in other shards.
+
+  The number of shards can't be changed once feeds are stored: to reshard, export all feeds with NDJSONExporter and import
+  them into a new set of shards.
+  """
+
+  _cursorBits=64 #the number of bits per shard in combined change log positions, SQLite sequence numbers are 64 bit integers
+
+  _shards=None
+  _idLock=None
+  _nextFeedID=1
+
+  def __init__(self, filename_pattern:str, shard_count:int, **kwargs):
+    """
+    :param str filename_pattern: the database file name, containing "%d" for the shard number. ":memory:" creates in-memory
+                                 shards, these only work within a single thread.
+    :param int shard_count: the number of shards
+    :param kwargs: additional SQLiteStorage settings for all shards, e.g. wal=True
+    :raises ValueError: if the shard count is invalid, or if stored feeds don't match the shard count
+    """
+    super().__init__()
+    if shard_count<1:
+      raise ValueError("shard count must be at least 1, got %d"%shard_count)
+    self._shards=[]
+    for index in range(0,shard_count):
+      filename=filename_pattern
+      if filename!=":memory:":
+        filename=filename_pattern%index
+      shard=SQLiteStorage(filename,**kwargs)
+      shard.itemIDStep=shard_count
+      shard.itemIDOffset=index
+      self._shards.append(shard)
+    self._idLock=Lock()
+    self._nextFeedID=1
+    next_item_id=1
+    for index,shard in enumerate(self._shards):
+      for feed in shard.getFeedHeaders():
+        if feed.id%shard_count!=index:
+          raise ValueError("feed %d is stored in shard %d, expected %d shards"%(feed.id,index,shard_count))
+        self._nextFeedID=max(self._nextFeedID,feed.id+1)
+      with shard._readConnection() as conn:
+        next_item_id=max(next_item_id,shard._getNextItemID(conn.cursor()))
+    self._raiseMinItemID([next_item_id-1])
+
+  def _getShard(self, feed_id:int) -> SQLiteStorage:
+    return self._shards[feed_id%len(self._shards)]
+
+  def acquireWriteLock(self, feed_id:Union[int,None]=None):
+    """Gets the write lock for the given feed's shard, or for all shards.
+
+    Locking all shards is required for adding new feeds.
+
+    :param Union[int,None] feed_id: optional: the feed to lock for, None to lock all shards (default)
+    """
+    if feed_id!=None:
+      return self._getShard(feed_id).acquireWriteLock()
+    for shard in self._shards:
+      shard.acquireWriteLock()
+    return True
+
+  def releaseWriteLock(self, feed_id:Union[int,None]=None):
+    """Releases the write lock for the given feed's shard, or for all shards.
+
+    :param Union[int,None] feed_id: optional: the feed ID the lock was acquired for
+    """
+    if feed_id!=None:
+      return self._getShard(feed_id).releaseWriteLock()
+    for shard in reversed(self._shards):
+      shard.releaseWriteLock()
+
+  def isWriteLocked(self, feed_id:Union[int,None]=None):
+    """Checks whether the given feed's shard, or any shard, is currently write-locked.
+
+    :param Union[int,None] feed_id: optional: the feed to check the lock for, None to check all shards
+    :return bool: whether a write lock is in place
+    """
+    if feed_id!=None:
+      return self._getShard(feed_id).isWriteLocked()
+    return any([shard.isWriteLocked() for shard in self._shards])
+
+  def getWriteLockGroup(self, feed_id:int) -> Union[int,None]:
+    """Returns the feed's shard number: feeds in the same shard share a write lock.
+
+    :param int feed_id: the feed to look up
+    :rtype: Union[int,None]
+    """
+    return feed_id%len(self._shards)
+
+  @contextmanager
+  def writeTransaction(self, feed_id:Union[int,None]=None):
+    """Context manager for writes, see SQLiteStorage.writeTransaction(): with a feed ID only that feed's shard is locked.
+
+    Without a feed ID all shards are locked and each shard's writes are stored in a transaction of its own, committed one
+    after another at the end of the block. Writes are atomic per shard: if committing fails, earlier shards keep their writes.
+
+    :param Union[int,None] feed_id: optional: the feed to lock for, None to lock all shards (default)
+    """
+    if feed_id!=None:
+      with self._getShard(feed_id).writeTransaction():
+        yield self
+      return
+    with ExitStack() as stack:
+      for shard in self._shards:
+        stack.enter_context(shard.writeTransaction())
+      yield self
+
+  @contextmanager
+  def snapshot(self):
+    """Context manager for consistent reads, see SQLiteStorage.snapshot(): each shard's reads share a read transaction.
+
+    Each shard is read consistently, which includes everything about an individual feed. Shards aren't synchronized with
+    each other, so reads combining several shards may include writes to one shard but not to another.
+    """
+    with ExitStack() as stack:
+      for shard in self._shards:
+        stack.enter_context(shard.snapshot())
+      yield self
+
+  def snapshotBlocksWriters(self) -> bool:
+    """Checks whether writes have to wait while a snapshot is open, see SQLiteStorage.snapshotBlocksWriters().
+
+    :rtype: bool
+    """
+    return any([shard.snapshotBlocksWriters() for shard in self._shards])
+
+  def getFeeds(self) -> List[Feed]:
+    """Returns all stored feeds from all shards, including their items.
+
+    :rtype: List[Feed]
+    """
+    return self._sortByID([feed for shard in self._shards for feed in shard.getFeeds()])
+
+  def getFeedHeaders(self) -> List[Feed]:
+    """Returns all stored feeds from all shards without reading their items: these will be loaded on first access.
+
+    :rtype: List[Feed]
+    """
+    return self._sortByID([feed for shard in self._shards for feed in shard.getFeedHeaders()])
+
+  def iterFeeds(self) -> Iterator[Feed]:
+    """Yields all stored feeds from all shards without their items, ordered by ID. Each shard is read in batches, see
+    SQLiteStorage.iterFeeds().
+
+    :rtype: Iterator[Feed]
+    """
+    return merge(*[shard.iterFeeds() for shard in self._shards],key=lambda feed: feed.id)
+
+  def _sortByID(self, feeds:List[Feed]) -> List[Feed]:
+    return sorted(feeds,key=lambda feed: feed.id)
+
+  def getFeedByID(self, id:int) -> Union[Feed,None]:
+    """Returns the feed with the given ID, or None if not found
+
+    :param int id: the feed ID to look up
+    :rtype: Feed or None
+    """
+    return self._getShard(id).getFeedByID(id)
+
+  def getFeedHeaderByID(self, id:int) -> Union[Feed,None]:
+    """Returns the feed with the given ID without reading its items, or None if not found
+
+    :param int id: the feed ID to look up
+    :rtype: Feed or None
+    """
+    return self._getShard(id).getFeedHeaderByID(id)
+
+  def getItemsByFeedID(self, feed_id:int, limit:Union[int,None]=None, before:Union[datetime,None]=None,
+                       since:Union[datetime,None]=None) -> List[Item]:
+    """Returns a feed's items, ordered by publication date (oldest first). See SQLiteStorage.getItemsByFeedID() for details.
+
+    :rtype: List[Item]
+    """
+    return self._getShard(feed_id).getItemsByFeedID(feed_id,limit=limit,before=before,since=since)
+
+  def iterItems(self, feed_id:int, limit:Union[int,None]=None, before:Union[datetime,None]=None,
+                since:Union[datetime,None]=None) -> Iterator[Item]:
+    """Yields a feed's items straight from its shard's database cursor, see SQLiteStorage.iterItems() for details.
+
+    :rtype: Iterator[Item]
+    """
+    return self._getShard(feed_id).iterItems(feed_id,limit=limit,before=before,since=since)
+
+  def searchItems(self, query:str, limit:int) -> List[Item]:
+    """Returns the items containing all words of the query, searching all shards.
+
+    Each shard ranks its own matches, relevance scores are comparable as long as shards hold similar contents.
+
+    :param str query: the words to search for
+    :param int limit: the maximum number of items to return
+    :rtype: List[Item]
+    """
+    matches=[match for shard in self._shards for match in shard._searchRankedItems(query,limit)]
+    matches.sort(key=lambda match: match[0])
+    return [item for score,item in matches[0:limit]]
+
+  def putFeed(self, feed:Feed) -> None:
+    """Stores a single Feed object in its shard, new feeds get an ID assigned first.
+
+    Each shard's database only checks its own feeds' URLs, so new and changed feeds are checked against all other shards
+    first. To assure thread-safety you need to get a lock by calling .acquireWriteLock(feed.id) first, new feeds and feeds
+    changing their URL require .acquireWriteLock() without feed ID.
+
+    :param Feed feed: the Feed to store
+    :raises AssertionError: if the feed's shard isn't write-locked
+    :raises sqlite3.IntegrityError: if another feed of the same source has the same URL
+    """
+    if feed.id==None or feed.isDirty():
+      self._assertUniqueURL(feed)
+    if feed.id==None:
+      with self._idLock:
+        feed.id=self._nextFeedID
+        self._nextFeedID+=1
+    else:
+      with self._idLock:
+        self._nextFeedID=max(self._nextFeedID,feed.id+1)
+    self._getShard(feed.id).putFeed(feed)
+    if feed.hasItemsLoaded():
+      self._raiseMinItemID([item.id for item in feed.items])
+
+  def _raiseMinItemID(self, item_ids:List[int]):
+    """makes all shards assign new item IDs above the given stored ones, e.g. imported IDs not following the shard stepping
+    """
+    with self._idLock:
+      min_item_id=max([self._shards[0].minItemID]+[item_id+1 for item_id in item_ids if item_id!=None])
+      for shard in self._shards:
+        shard.minItemID=min_item_id
+
+  def _assertUniqueURL(self, feed:Feed):
+    """raises an IntegrityError if any shard stores another feed with the feed's source and URL
+    """
+    if feed.id!=None and self._getShard(feed.id)._findFeedID(feed.sourceName,feed.feedURL)==feed.id:
+      return #URL didn't change, only one shard needs to be checked for refreshed feeds
+    for shard in self._shards:
+      stored_id=shard._findFeedID(feed.sourceName,feed.feedURL)
+      if stored_id!=None and stored_id!=feed.id:
+        raise sqlite3.IntegrityError("feed %s has the same source and URL as feed %d"%(feed.id,stored_id))
+
+  def markRefreshed(self, feed_id:int, last_refreshed:datetime) -> None:
+    """Stores a feed's last refresh time in its shard, see SQLiteStorage.markRefreshed().
+
+    To assure thread-safety you need to get a lock by calling .acquireWriteLock(feed_id) first.
+
+    :param int feed_id: the feed's ID
+    :param datetime last_refreshed: the feed's new lastRefreshed value
+    :raises AssertionError: if the feed's shard isn't write-locked
+    """
+    self._getShard(feed_id).markRefreshed(feed_id,last_refreshed)
+
+  def putItem(self, item:Item) -> None:
+    """Stores a single item in its feed's shard, items of unknown feeds are discarded.
+
+    To assure thread-safety you need to get a lock by calling .acquireWriteLock(item.feedID) first.
+
+    :param Item item: the item to store
+    :raises AssertionError: if the item's shard isn't write-locked
+    """
+    if item.feedID==None:
+      return
+    self._getShard(item.feedID).putItem(item)
+    self._raiseMinItemID([item.id])
+
+  def compactItems(self, feed_id:int, policy:RetentionPolicy, limit:int) -> int:
+    """Deletes or archives a batch of a feed's items that the retention policy doesn't keep.
+
+    To assure thread-safety you need to get a lock by calling .acquireWriteLock(feed_id) first.
+
+    :rtype: int
+    """
+    return self._getShard(feed_id).compactItems(feed_id,policy,limit)
+
+  def reclaimSpace(self, pages:int) -> int:
+    """Returns up to the given number of free pages per shard to the file system.
+
+    To assure thread-safety you need to get a lock for all shards by calling .acquireWriteLock() first.
+
+    :param int pages: the maximum number of pages to release per shard
+    :return: the number of free pages left in all shards
+    :rtype: int
+    """
+    return sum([shard.reclaimSpace(pages) for shard in self._shards])
+
+  def subscribe(self, callback) -> None:
+    """Registers a function for all shards' change events, see Storage.subscribe().
+
+    Events of different shards may be delivered concurrently, sequence numbers are only ordered within a shard.
+
+    :param Callable[[ChangeEvent],None] callback: the function to call
+    """
+    for shard in self._shards:
+      shard.subscribe(callback)
+
+  def unsubscribe(self, callback) -> None:
+    """Removes a function registered with .subscribe().
+
+    :param Callable[[ChangeEvent],None] callback: the function to remove
+    """
+    for shard in self._shards:
+      shard.unsubscribe(callback)
+
+  def getChanges(self, after:int, limit:int) -> List[ChangeEvent]:
+    """Returns logged changes of all shards, starting after the given position in the combined change log.
+
+    Shards commit independently, so a single sequence number can't mark a position in all of them: positions combine the
+    last processed sequence number of each shard instead. Returned events carry the position after themselves as sequence
+    number, passing the last one to the next call resumes from there. Positions increase with every change, they're larger
+    than and unrelated to the sequence numbers of published events.
+
+    Each shard's changes are returned in commit order, changes of different shards are interleaved by their shards' sequence
+    numbers.
+
+    :param int after: the position after the last change already processed, 0 to start at the oldest logged changes
+    :param int limit: the maximum number of changes to return
+    :rtype: List[ChangeEvent]
+    """
+    mask=(1<<self._cursorBits)-1
+    cursors=[(after>>(index*self._cursorBits))&mask for index in range(0,len(self._shards))]
+    logs=[[(event.sequence,index,event) for event in shard.getChanges(cursors[index],limit)]
+          for index,shard in enumerate(self._shards)]
+    rv=[]
+    for sequence,index,event in islice(merge(*logs),limit):
+      cursors[index]=sequence
+      event.sequence=sum([cursor<<(index*self._cursorBits) for index,cursor in enumerate(cursors)])
+      rv.append(event)
+    return rv
+
+  def pruneChanges(self, keep:int) -> int:
+    """Deletes logged changes in each shard, except for the given number of most recent ones per shard.
+
+    To assure thread-safety you need to get a lock for all shards by calling .acquireWriteLock() first.
+
+    :param int keep: the number of changes to keep per shard
+    :return: the number of changes deleted
+    :rtype: int
+    """
+    return sum([shard.pruneChanges(keep) for shard in self._shards])
+
+  def close(self):
+    """Closes all shards' connections, see SQLiteStorage.close().
+    """
+    for shard in self._shards:
+      shard.close()
+
+
+class TestShardedSQLiteStorage(BaseStorageTest,unittest.TestCase):
+  """Tests for the ShardedSQLiteStorage class.
+  """
+
+  _pattern="test."+__name__+".%d.sqlite"
+  _storage=None
+
+  def _createStorage(self, shard_count:int=3):
+    self._storage=ShardedSQLiteStorage(":memory:",shard_count)
+    return self._storage
+
+  def _createFileStorage(self, shard_count:int):
+    self._storage=ShardedSQLiteStorage(self._pattern,shard_count)
+    return self._storage
+
+  def tearDown(self):
+    """test fixture, called by unittest after each test.
+    """
+    if self._storage!=None:
+      self._storage.close()
+      self._storage=None
+    for index in range(0,3):
+      if os.path.isfile(self._pattern%index):
+        os.remove(self._pattern%index)
+
+
+  def testPartitioning(self):
+    """Tests whether feeds are stored in the shard matching their ID, and whether new feeds get unique IDs.
+    """
+    storage=self._createStorage()
+    storage.acquireWriteLock()
+    storage.putFeed(Feed(id=4,sourceName="test",feedURL="uri://4"))
+    for tc in range(0,3):
+      feed=Feed(sourceName="test",feedURL="uri://new/%d"%tc)
+      feed.items=[Item(title="item")]
+      storage.putFeed(feed)
+    storage.releaseWriteLock()
+
+    self.assertEqual([4,5,6,7],[feed.id for feed in storage.getFeedHeaders()],"new feeds should have gotten unique IDs")
+    self.assertEqual([[6],[4,7],[5]],[[feed.id for feed in shard.getFeedHeaders()] for shard in storage._shards])
+    self.assertEqual(["item"],[item.title for item in storage.getItemsByFeedID(5)])
+    self.assertEqual(3,len(storage.searchItems("item",10)),"search should have combined all shards")
+
+  def testUniqueness(self):
+    """Tests whether feed URLs are unique across shards, and whether new items get IDs that are unique across shards.
+    """
+    storage=self._createStorage()
+    storage.acquireWriteLock()
+    for feed_id in [1,2]:
+      feed=Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id)
+      feed.items=[Item(title="item %d"%tc) for tc in range(0,3)]
+      storage.putFeed(feed)
+    for duplicate in [Feed(sourceName="test",feedURL="uri://1"),Feed(id=3,sourceName="test",feedURL="uri://2")]:
+      with self.assertRaises(sqlite3.IntegrityError):
+        storage.putFeed(duplicate)
+    storage.putFeed(Feed(sourceName="other",feedURL="uri://1"))
+    storage.releaseWriteLock()
+
+    self.assertEqual([1,2,3],[feed.id for feed in storage.getFeedHeaders()],"refused feeds shouldn't have used IDs")
+    self.assertEqual([1,4,7],[item.id for item in storage.getItemsByFeedID(1)])
+    self.assertEqual([8,11,14],[item.id for item in storage.getItemsByFeedID(2)],"IDs should start above all shards' items")
+
+  def testImportedItemIDs(self):
+    """Tests whether new items get IDs above imported ones, even if those don't follow the shard stepping.
+    """
+    from storage.NDJSONExporter import NDJSONExporter #imported after this module by the storage package
+    from storage.NDJSONImporter import NDJSONImporter
+    source=SQLiteStorage(":memory:")
+    with source.writeTransaction():
+      for feed_id in [1,2]:
+        feed=Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id)
+        feed.items=[Item(title="item %d"%tc) for tc in range(0,3)]
+        source.putFeed(feed)
+    stream=io.StringIO()
+    NDJSONExporter(source).export(stream)
+    stream.seek(0)
+    storage=self._createFileStorage(2)
+    NDJSONImporter(storage).load(stream)
+
+    storage.acquireWriteLock(1)
+    storage.putItem(Item(feedID=1,title="appended"))
+    storage.releaseWriteLock(1)
+    storage.close()
+    storage=self._createFileStorage(2)
+    storage.acquireWriteLock(2)
+    storage.putItem(Item(feedID=2,title="appended after reopening"))
+    storage.releaseWriteLock(2)
+
+    ids=[item.id for feed_id in [1,2] for item in storage.getItemsByFeedID(feed_id)]
+    self.assertEqual([1,2,3,7,4,5,6,8],ids,"new items should have gotten IDs above all shards' items")
+
+  def testParallelWrites(self):
+    """Tests whether writers of feeds in different shards don't wait for each other.
+    """
+    storage=self._createFileStorage(2)
+    storage.acquireWriteLock()
+    storage.putFeed(Feed(id=1,sourceName="test",feedURL="uri://1"))
+    storage.putFeed(Feed(id=2,sourceName="test",feedURL="uri://2"))
+    storage.releaseWriteLock()
+
+    storage.acquireWriteLock(1)
+    finished=[]
+    def write(feed_id):
+      storage.acquireWriteLock(feed_id)
+      storage.putItem(Item(feedID=feed_id,title="parallel"))
+      storage.releaseWriteLock(feed_id)
+      finished.append(feed_id)
+    threads=[Thread(target=write,args=(feed_id,)) for feed_id in [3,2]]
+    for thread in threads:
+      thread.start()
+    sleep(0.5)
+    self.assertEqual([2],finished,"write to other shard shouldn't have waited, write to same shard should have")
+    self.assertTrue(storage.isWriteLocked(),"storage should report active lock")
+
+    storage.releaseWriteLock(1)
+    for thread in threads:
+      thread.join(2)
+    self.assertEqual([2,3],finished)
+
+  def testChangeLog(self):
+    """Tests whether shards' change events are published, and whether the combined change log can be read in batches.
+    """
+    storage=self._createStorage()
+    events=[]
+    storage.subscribe(events.append)
+    storage.acquireWriteLock()
+    for feed_id in range(1,5):
+      storage.putFeed(Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id))
+    self.assertEqual(1,storage.pruneChanges(1),"each shard should have kept one change")
+    storage.releaseWriteLock()
+    self.assertEqual([1,2,3,4],[event.feedID for event in events])
+    self.assertEqual([1,1,1,2],[event.sequence for event in events],"sequence numbers should be counted per shard")
+    self.assertEqual([3,2,4],[event.feedID for event in storage.getChanges(0,10)],"pruned change should be missing")
+
+    storage.acquireWriteLock()
+    for feed_id in range(5,9):
+      storage.putFeed(Feed(id=feed_id,sourceName="test",feedURL="uri://%d"%feed_id))
+    storage.releaseWriteLock()
+    first=storage.getChanges(0,3)
+    rest=storage.getChanges(first[-1].sequence,10)
+    self.assertEqual([3,2,6,4,5,7,8],[event.feedID for event in first+rest],"should have resumed after the last position")
+    positions=[event.sequence for event in first+rest]
+    self.assertEqual(sorted(set(positions)),positions,"positions should increase")
+    self.assertEqual([],storage.getChanges(positions[-1],10))
+
+    storage.acquireWriteLock(3)
+    storage.putFeed(Feed(id=3,sourceName="test",feedURL="uri://3",title="late"))
+    storage.releaseWriteLock(3)
+    self.assertEqual([3],[event.feedID for event in storage.getChanges(positions[-1],10)],
+                     "changes to shards that were behind should still be returned")
+
+  def testShardCountMismatch(self):
+    """Tests whether opening shards with a different shard count is refused.
+    """
+    storage=self._createFileStorage(3)
+    storage.acquireWriteLock()
+    storage.putFeed(Feed(id=4,sourceName="test",feedURL="uri://4"))
+    storage.releaseWriteLock()
+    storage.close()
+
+    with self.assertRaises(ValueError):
+      self._createFileStorage(2)
+    self.assertEqual([4],[feed.id for feed in self._createFileStorage(3).getFeedHeaders()],"same shard count should work")
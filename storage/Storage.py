@@ -1,8 +1,17 @@
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+import re
 from threading import Lock
-from typing import List,Union
+from typing import Iterator,List,Union
 
 from domain import *
+import logger
+from storage.ChangeEvent import *
+from storage.RetentionPolicy import *
+
+
+log=logger.get_logger(__name__)
 
 
 class Storage(ABC):
@@ -16,27 +25,41 @@ class Storage(ABC):
   """
 
   _writeLock=None
+  _subscribers=None
+  _subscriberLock=None
+  _searchTermPattern=re.compile(r"[^\W_]+")
 
   def __init__(self):
     self._writeLock=Lock()
+    self._subscribers=[]
+    self._subscriberLock=Lock()
 
-  def acquireWriteLock(self):
+  def acquireWriteLock(self, feed_id:Union[int,None]=None):
     """Gets a write lock for the storage.
 
     This method call will block if someone else got a lock first.
 
-    Locks need to be released with .releaseWriteLock().
+    Storage implementations with separate locks for groups of feeds (e.g. ShardedSQLiteStorage) only lock the given feed's
+    group, writes to other feeds may proceed in parallel. Without a feed ID the whole storage is locked, this is required for
+    adding new feeds. Implementations with a single lock ignore the feed ID.
+
+    Locks need to be released with .releaseWriteLock(), passing the same feed ID.
+
+    :param Union[int,None] feed_id: optional: the feed to lock for, None to lock all feeds (default)
     """
     return self._writeLock.acquire()
 
-  def releaseWriteLock(self):
+  def releaseWriteLock(self, feed_id:Union[int,None]=None):
     """Releases a write lock.
+
+    :param Union[int,None] feed_id: optional: the feed ID the lock was acquired for
     """
     return self._writeLock.release()
 
-  def isWriteLocked(self):
+  def isWriteLocked(self, feed_id:Union[int,None]=None):
     """Checks whether the storage is currently write-locked.
 
+    :param Union[int,None] feed_id: optional: the feed to check the lock for, None to check the whole storage's lock
     :return bool: whether a write lock is in place
     """
     was_unlocked=self._writeLock.acquire(blocking=False)
@@ -44,9 +67,126 @@ class Storage(ABC):
       self._writeLock.release()
     return not was_unlocked
 
+  def getWriteLockGroup(self, feed_id:int) -> Union[int,None]:
+    """Returns which write lock .acquireWriteLock(feed_id) gets: feeds of the same group can be written within a single
+    write transaction, locked for any of them.
+
+    This default implementation has a single lock for all feeds and returns None, the group of .acquireWriteLock() without
+    feed ID.
+
+    :param int feed_id: the feed to look up
+    :rtype: Union[int,None]
+    """
+    return None
+
   def _assertIsWriteLocked(self):
     assert self.isWriteLocked()
 
+  @contextmanager
+  def writeTransaction(self, feed_id:Union[int,None]=None):
+    """Context manager for writes: holds the write lock and stores all writes within the block in a single transaction.
+
+    Storing several feeds in one transaction is cheaper than committing each one separately. If the block raises an exception,
+    storages supporting transactions discard all of its writes. Write locks aren't reentrant, so write transactions mustn't be
+    nested.
+
+    This default implementation only handles the write lock: writes are applied immediately and not undone on errors.
+
+    :param Union[int,None] feed_id: optional: the feed to lock for, see .acquireWriteLock()
+    """
+    self.acquireWriteLock(feed_id)
+    try:
+      yield self
+    finally:
+      self.releaseWriteLock(feed_id)
+
+  def subscribe(self, callback) -> None:
+    """Registers a function to be called with a ChangeEvent after every committed write.
+
+    Callbacks run in the writing thread in commit order, usually while the writer still holds the write lock: they should
+    return quickly and mustn't write to this storage. Exceptions raised by callbacks are logged and otherwise ignored.
+
+    :param Callable[[ChangeEvent],None] callback: the function to call
+    """
+    with self._subscriberLock:
+      self._subscribers=self._subscribers+[callback]
+
+  def unsubscribe(self, callback) -> None:
+    """Removes a function registered with .subscribe().
+
+    :param Callable[[ChangeEvent],None] callback: the function to remove
+    """
+    with self._subscriberLock:
+      self._subscribers=[subscriber for subscriber in self._subscribers if subscriber!=callback]
+
+  def _publishChange(self, event:ChangeEvent):
+    for callback in self._subscribers:
+      try:
+        callback(event)
+      except Exception:
+        log.exception("change event subscriber failed")
+
+  def _getSearchTerms(self, query:str) -> List[str]:
+    """splits a search query into lowercase words, ignoring punctuation and other special characters
+    """
+    return self._searchTermPattern.findall(query.lower())
+
+  def reclaimSpace(self, pages:int) -> int:
+    """Returns unused space to the operating system, in steps of the given size.
+
+    Storage implementations without a backing file don't need to override this. Callers need to hold a write lock.
+
+    :param int pages: the maximum number of storage pages to release
+    :return: the number of unused pages left
+    :rtype: int
+    """
+    return 0
+
+  @contextmanager
+  def snapshot(self):
+    """Context manager for consistent reads: all reads in the current thread see the same stored state until the block ends.
+
+    Writes committed by other threads in the meantime aren't visible inside the block, so e.g. a feed header and its items
+    read separately always match. Snapshots may be nested, inner blocks share the outer block's state. Items and
+    descriptions loaded lazily after the block ended are read from the current state again.
+
+    Don't write to the storage from within a snapshot. Depending on the implementation, snapshots may keep writers from
+    committing (see .snapshotBlocksWriters()): keep such snapshots short, e.g. don't send data to network clients from
+    within them. This default implementation doesn't isolate reads at all, storage implementations should override it.
+    """
+    yield self
+
+  def snapshotBlocksWriters(self) -> bool:
+    """Checks whether writes by other threads have to wait while a snapshot is open.
+
+    If they do, snapshots should only be held for as long as it takes to read the required data into memory. This default
+    implementation returns False, matching the default .snapshot().
+
+    :rtype: bool
+    """
+    return False
+
+  def iterFeeds(self) -> Iterator[Feed]:
+    """Yields all stored feeds without their items, ordered by ID. Items are loaded on first access to Feed.items.
+
+    Storage implementations should read feeds as they're consumed instead of all at once, this default implementation uses
+    .getFeedHeaders().
+
+    :rtype: Iterator[Feed]
+    """
+    yield from self.getFeedHeaders()
+
+  def iterItems(self, feed_id:int, limit:Union[int,None]=None, before:Union[datetime,None]=None,
+                since:Union[datetime,None]=None) -> Iterator[Item]:
+    """Yields a feed's items in the same order as .getItemsByFeedID() returns them, the parameters work the same way.
+
+    Storage implementations should read items as they're consumed instead of all at once, so the size of a feed doesn't
+    matter to callers processing one item at a time. This default implementation uses .getItemsByFeedID().
+
+    :rtype: Iterator[Item]
+    """
+    yield from self.getItemsByFeedID(feed_id,limit=limit,before=before,since=since)
+
   @abstractmethod
   def getFeeds(self) -> List[Feed]:
     """abstract: this should return a list of all feeds
@@ -64,25 +204,118 @@ class Storage(ABC):
     """
     pass
 
+  @abstractmethod
+  def getFeedHeaders(self) -> List[Feed]:
+    """abstract: this should return a list of all feeds, without reading their items
+
+    The returned feeds' items should be loaded on first access to Feed.items instead.
+
+    :rtype: List[Feed]
+    """
+    pass
+
+  @abstractmethod
+  def getFeedHeaderByID(self, id:int) -> Union[Feed,None]:
+    """abstract: this should return the feed with the given ID without reading its items, or None if not found
+
+    :param int id: the feed ID to look up
+    :rtype: Feed or None
+    """
+    pass
+
   @abstractmethod
   def putFeed(self, feed:Feed) -> None:
     """abstract: this should store a feed
 
-    If the feed comes with items, the items should be stored as well.
+    If the feed comes with items, the items should be stored as well. If the feed's items weren't loaded (see
+    Feed.hasItemsLoaded()) the stored items should be kept as they are.
 
     :param Feed feed: the Feed to store
     """
     pass
 
   @abstractmethod
-  def getItemsByFeedID(self, feed_id:int) -> List[Item]:
-    """abstract: this should return all items for a given feed ID
+  def getItemsByFeedID(self, feed_id:int, limit:Union[int,None]=None, before:Union[datetime,None]=None,
+                       since:Union[datetime,None]=None) -> List[Item]:
+    """abstract: this should return a feed's items, ordered by publication date (oldest first)
+
+    Items without publication date come first. Naive datetimes are treated as UTC. If a time window is given, items without
+    publication date are excluded.
 
     :param int feed_id: the feed ID to look up items for
+    :param Union[int,None] limit: optional: the maximum number of items to return, the most recent ones are returned
+    :param Union[datetime,None] before: optional: only return items published before this time
+    :param Union[datetime,None] since: optional: only return items published at or after this time
+    :rtype: List[Item]
+    """
+    pass
+
+  @abstractmethod
+  def searchItems(self, query:str, limit:int) -> List[Item]:
+    """abstract: this should return the items containing all words of the query in their title or description
+
+    Words are matched case-insensitively, punctuation is ignored. The most relevant items come first, matches in titles
+    should weigh more than matches in descriptions.
+
+    :param str query: the words to search for
+    :param int limit: the maximum number of items to return
     :rtype: List[Item]
     """
     pass
 
+  @abstractmethod
+  def compactItems(self, feed_id:int, policy:RetentionPolicy, limit:int) -> int:
+    """abstract: this should delete or archive a batch of a feed's items that the retention policy doesn't keep
+
+    Callers need to hold a write lock.
+
+    :param int feed_id: the feed ID to compact items for
+    :param RetentionPolicy policy: the retention policy to apply
+    :param int limit: the maximum number of items to remove in this call
+    :return: the number of items removed, if this is less than the limit no further expired items are left
+    :rtype: int
+    """
+    pass
+
+  @abstractmethod
+  def getChanges(self, after:int, limit:int) -> List[ChangeEvent]:
+    """abstract: this should return logged changes in commit order, starting after the given sequence number
+
+    Consumers can process changes in batches, passing the last returned sequence number to the next call.
+
+    :param int after: the last sequence number already processed, 0 to start at the oldest logged change
+    :param int limit: the maximum number of changes to return
+    :rtype: List[ChangeEvent]
+    """
+    pass
+
+  @abstractmethod
+  def pruneChanges(self, keep:int) -> int:
+    """abstract: this should delete logged changes except for the given number of most recent ones
+
+    Callers need to hold a write lock.
+
+    :param int keep: the number of changes to keep
+    :return: the number of changes deleted
+    :rtype: int
+    """
+    pass
+
+  def markRefreshed(self, feed_id:int, last_refreshed:datetime) -> None:
+    """Stores a feed's last refresh time without changing anything else, e.g. after upstream reported the feed unchanged.
+
+    Refreshing a feed doesn't change its contents, so storage implementations should neither log nor publish a change event.
+    This default implementation stores the feed header with .putFeed(), which does. Callers need to hold a write lock.
+
+    :param int feed_id: the feed's ID, unknown feeds are ignored
+    :param datetime last_refreshed: the feed's new lastRefreshed value
+    """
+    feed=self.getFeedHeaderByID(feed_id)
+    if feed==None:
+      return
+    feed.lastRefreshed=last_refreshed
+    self.putFeed(feed)
+
   @abstractmethod
   def putItem(self, item:Item) -> None:
     """abstract: this should store an item
@@ -1,4 +1,14 @@
+from storage.RetentionPolicy import *
+from storage.ChangeEvent import *
 from storage.Storage import *
 from storage.BaseStorageTest import *
 from storage.InMemoryStorage import *
+from storage.SQLiteConnectionPool import *
+from storage.SQLiteSchema import *
 from storage.SQLiteStorage import *
+from storage.Compactor import *
+from storage.CachingStorage import *
+from storage.ShardedSQLiteStorage import *
+from storage.NDJSONExporter import *
+from storage.NDJSONImporter import *
+from storage.GroupCommitWriter import *